@@ -0,0 +1,59 @@
+"""
+Decryption of the admin accounts listing, serial unprocess_accounts against the chunked process pool
+and against the decoder without a pool (PYTHON_DECODE_WORKERS=0), chunks in a thread. \n
+Run with: python -m benchmarks.account_decoder [sizes...], default sizes are 10000 100000 1000000
+"""
+import asyncio
+import sys
+import time
+
+from schemas import AccountProcessed
+from security import AccountDecoder, field_cipher
+import service.conversions_service as conversions
+
+
+def synthetic_accounts(size: int) -> list[AccountProcessed]:
+    """Encrypting is as slow as decrypting, so one encrypted account is repeated"""
+    account = AccountProcessed(
+        id=0,
+        access_level_enc=field_cipher.encrypt('access_level', '1'),
+        username_enc=field_cipher.encrypt('username', 'bench'),
+        name_enc=field_cipher.encrypt('name', 'Bench Mark'),
+        email_enc=field_cipher.encrypt('email', 'bench@mark.io'),
+        password_hash='',
+        email_hash='',
+        is_active=True
+    )
+    return [account] * size
+
+
+async def iterate(items: list):
+    for i in items:
+        yield i
+
+
+async def main(sizes: list[int]):
+    print(f'{"accounts":>10} {"serial, s":>10} {"pool, s":>10} {"no pool, s":>10} {"workers":>8} {"chunk":>6}')
+    for size in sizes:
+        accounts = synthetic_accounts(size)
+        start = time.perf_counter()
+        conversions.unprocess_accounts(accounts)
+        serial = time.perf_counter() - start
+
+        decoder = conversions.account_decoder
+        start = time.perf_counter()
+        async for _ in conversions.unprocess_accounts_stream(iterate(accounts)):
+            pass
+        pool = time.perf_counter() - start
+
+        no_pool = AccountDecoder(workers=0, chunk_size=decoder.chunk_size)
+        start = time.perf_counter()
+        async for _ in no_pool.decrypt(iterate([(i.username_enc, i.name_enc, i.email_enc) for i in accounts])):
+            pass
+        threaded = time.perf_counter() - start
+        print(f'{size:>10} {serial:>10.2f} {pool:>10.2f} {threaded:>10.2f} {decoder.workers:>8} {decoder.chunk_size:>6}')
+    conversions.account_decoder.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main([int(i) for i in sys.argv[1:]] or [10000, 100000, 1000000]))
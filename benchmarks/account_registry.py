@@ -0,0 +1,44 @@
+"""
+Per-request cost of the account liveness check, old json blob against the redis set. \n
+Needs the redis from .env, run with: python -m benchmarks.account_registry
+"""
+import asyncio
+import json
+import time
+
+from cache import AccountRegistry, redis_client
+
+sizes = [1000, 10000, 100000, 300000]
+requests = 2000
+
+
+async def old_check(account_id: int) -> bool:
+    return account_id in set(json.loads(await redis_client.get('bench:used_ids_postgres')))
+
+
+async def main():
+    registry = AccountRegistry()
+    registry.ids_key = 'bench:accounts:ids'
+    registry.active_key = 'bench:accounts:active'
+    print(f'{"accounts":>10} {"json blob, us":>15} {"redis set, us":>15}')
+    for size in sizes:
+        ids = list(range(1, size + 1))
+        await redis_client.set('bench:used_ids_postgres', json.dumps(ids))
+        await registry.rebuild(ids=ids, active_ids=ids)
+
+        start = time.perf_counter()
+        for i in range(requests):
+            await old_check(i * 7 % size)
+        old = (time.perf_counter() - start) / requests * 1e6
+
+        start = time.perf_counter()
+        for i in range(requests):
+            await registry.is_active(i * 7 % size)
+        new = (time.perf_counter() - start) / requests * 1e6
+        print(f'{size:>10} {old:>15.1f} {new:>15.1f}')
+
+    await redis_client.delete('bench:used_ids_postgres', registry.ids_key, registry.active_key)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""
+Latency of /service/aggregate while important_data grows, against the way dashboards did it before:
+download the whole table through fetch_data and sum it up on the client. \n
+The table is seeded up to every --sizes step (the seeder updates the rollup with every batch, its rows/s show
+the write cost), then both ways are measured. Downloading stops after --download-max rows, it only gets slower. \n
+Run with: python -m benchmarks.aggregate --sizes 10000,100000,1000000
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+
+from benchmarks import endpoints, stand_ins
+
+
+def client_side(body: list[dict]) -> dict:
+    months = defaultdict(lambda: [0, 0])
+    for row in body:
+        bucket = months[datetime.fromisoformat(row['date']).strftime('%Y-%m')]
+        bucket[0] += 1
+        bucket[1] += row['amount']
+    return months
+
+
+async def main(args):
+    stand_ins.use_test_secrets()
+    stand_ins.use_sqlite()
+    stand_ins.use_memory_redis()
+    from main import app
+    from database import database_getter, seeder
+    from database.orm_schemas import ImportantData
+    from settings import settings
+
+    lifespan = await endpoints.prepare(app, endpoints.parse_args(['--rows', '0']))
+    admin = (settings.admin_email, settings.admin_password)
+    try:
+        seeded = 0
+        for size in args.sizes:
+            await seeder.main(seeder.parse_args(['--rows', str(size - seeded), '--tables', 'important_data',
+                                                 '--seed', str(size), '--workers', '1']))
+            seeded = size
+            async with database_getter.engine.connect() as conn:
+                rows = await seeder.next_id(conn, ImportantData)
+            scenarios = [endpoints.Scenario(f'aggregate:{period}', lambda client, period=period: client.get(
+                f'/service/aggregate?repository_name=important_data&period={period}'), login=admin)
+                for period in ('day', 'week', 'month')]
+            if size <= args.download_max:
+                async def download(client):
+                    response = await client.get('/service/fetch_data?repository_name=important_data')
+                    client_side(response.json())
+                    return response
+
+                scenarios.append(endpoints.Scenario('download and sum', download, login=admin))
+            for scenario in scenarios:
+                requests = args.requests if scenario.name.startswith('aggregate') else args.download_requests
+                result = await endpoints.run_scenario(app, scenario, 1, requests)
+                print(f'{rows:>9} rows  {scenario.name:<18} p50 {result["p50_ms"]:>9.2f} ms  '
+                      f'p95 {result["p95_ms"]:>9.2f} ms  errors {result["errors"]}')
+    finally:
+        await lifespan.__aexit__(None, None, None)
+
+
+def parse_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.aggregate')
+    parser.add_argument('--sizes', type=lambda text: [int(i) for i in text.split(',')],
+                        default=[10_000, 100_000, 1_000_000], help='rows of important_data to measure at, ascending')
+    parser.add_argument('--requests', type=int, default=200, help='aggregate requests per period and size')
+    parser.add_argument('--download-requests', type=int, default=5)
+    parser.add_argument('--download-max', type=int, default=100_000, help='largest table to download whole')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
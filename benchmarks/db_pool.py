@@ -0,0 +1,52 @@
+"""
+Latency of a short query as concurrency grows past the pool size (POSTGRES_POOL_SIZE + POSTGRES_MAX_OVERFLOW). \n
+Needs the postgres from .env, run with: python -m benchmarks.db_pool
+"""
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import text
+
+from database import get_db_session_cm, pool_stats
+from database.database_getter import ObservedPool
+from settings import settings
+
+query_seconds = 0.02
+requests_per_level = 400
+
+
+async def request(latencies: list[float]):
+    start = time.perf_counter()
+    async with get_db_session_cm() as session:
+        await session.execute(text(f'SELECT pg_sleep({query_seconds})'))
+    latencies.append(time.perf_counter() - start)
+
+
+async def run_level(concurrency: int):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    ObservedPool.checkouts, ObservedPool.checkout_time, ObservedPool.max_checkout_time = 0, 0.0, 0.0
+
+    async def limited():
+        async with semaphore:
+            await request(latencies)
+
+    await asyncio.gather(*[limited() for _ in range(requests_per_level)], return_exceptions=True)
+    latencies.sort()
+    stats = pool_stats()
+    print(f'{concurrency:>11} {statistics.median(latencies) * 1000:>8.1f} '
+          f'{latencies[int(len(latencies) * 0.99) - 1] * 1000:>8.1f} '
+          f'{stats["avg_checkout_seconds"] * 1000:>14.1f} {stats["timeouts"]:>8}')
+
+
+async def main():
+    capacity = settings.db_pool_size + settings.db_max_overflow
+    print(f'pool capacity {capacity}, every query holds a connection for {query_seconds * 1000:.0f} ms')
+    print(f'{"concurrency":>11} {"p50, ms":>8} {"p99, ms":>8} {"checkout, ms":>14} {"timeouts":>8}')
+    for concurrency in sorted({1, capacity // 2, capacity, capacity * 2, capacity * 4, capacity * 8} - {0}):
+        await run_level(concurrency)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
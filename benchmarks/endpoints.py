@@ -0,0 +1,235 @@
+"""
+Throughput and p50/p95/p99 latency of the main endpoints, the app runs in-process. \n
+By default against a temporary sqlite file and an in-memory redis (see benchmarks.stand_ins),
+with --database postgres against the postgres from .env, use a throwaway one, it gets seeded.
+Writes JSON, --compare checks it against a stored baseline and exits with 1 on a regression. \n
+Run with: python -m benchmarks.endpoints --concurrency 1,16 --output baseline.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, UTC
+from itertools import count
+
+from benchmarks import stand_ins
+
+repositories = ['very_unimportant_data', 'unimportant_data', 'important_data', 'accounts']
+
+
+def percentile(values: list[float], share: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    return values[max(int(len(values) * share + 0.999999) - 1, 0)]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000 if latencies else 0.0,
+        'p95_ms': percentile(latencies, 0.95) * 1000 if latencies else 0.0,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else 0.0,
+    }
+
+
+class Scenario:
+    """
+    One endpoint: setup logs a client in (or not), call makes one request and tells if it went as expected
+    """
+    def __init__(self, name: str, call, expected: int = 200, login: tuple[str, str] | None = None,
+                 anonymous: bool = False, auth_heavy: bool = False):
+        self.name = name
+        self.call = call
+        self.expected = expected
+        self.login = login
+        self.anonymous = anonymous
+        self.auth_heavy = auth_heavy  # Runs bcrypt, gets fewer requests
+
+
+def scenarios(settings, args) -> list[Scenario]:
+    admin = (settings.admin_email, settings.admin_password)
+    user = ('bench-user@bench.example', 'bench-password')
+    emails = count()
+    limit = f'&limit={args.fetch_limit}' if args.fetch_limit else ''
+    result = [
+        Scenario('anonymous_index', lambda client: client.get('/'), anonymous=True),
+        Scenario('get_name', lambda client: client.get('/auth/get_name'), login=user),
+        Scenario('login', lambda client: client.post('/auth/login', json={'email': user[0], 'password': user[1]}),
+                 expected=303, anonymous=True, auth_heavy=True),
+        Scenario('register', lambda client: client.post('/auth/register', json={
+            'username': 'bench', 'name': 'Bench', 'surname': 'User',
+            'email': f'register-{next(emails)}-{time.time_ns()}@bench.example', 'password': 'bench-password'}),
+                 expected=303, anonymous=True, auth_heavy=True),
+    ]
+    for repository in repositories:
+        result.append(Scenario(f'fetch_data:{repository}', lambda client, repository=repository: client.get(
+            f'/service/fetch_data?repository_name={repository}{limit}'), login=admin))
+    for period in ('day', 'month'):
+        result.append(Scenario(f'aggregate:{period}', lambda client, period=period: client.get(
+            f'/service/aggregate?repository_name=important_data&period={period}'), login=admin))
+    return result
+
+
+async def run_scenario(app, scenario: Scenario, concurrency: int, requests: int) -> dict:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    clients = [httpx.AsyncClient(transport=transport, base_url='http://bench', follow_redirects=False)
+               for _ in range(concurrency)]
+    for client in clients:
+        if scenario.login:
+            await client.post('/auth/login', json={'email': scenario.login[0], 'password': scenario.login[1]})
+    for _ in range(min(concurrency, 5)):  # Warm up the caches and the pools
+        await scenario.call(clients[0])
+
+    latencies = []
+    errors = 0
+    remaining = count()
+
+    async def worker(client):
+        nonlocal errors
+        while next(remaining) < requests:
+            if scenario.anonymous:
+                client.cookies.clear()
+            start = time.perf_counter()
+            try:
+                response = await scenario.call(client)
+                ok = response.status_code == scenario.expected
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(client) for client in clients])
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        await client.aclose()
+    return summarize(latencies, errors, elapsed)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Gives the regressions: throughput dropped or p95 grew by more than tolerance
+    """
+    regressions = []
+    print(f'{"":<36} {"rps":>9} {"base":>9} {"p95, ms":>9} {"base":>9}')
+    for key, result in results['results'].items():
+        if (base := baseline['results'].get(key)) is None:
+            continue
+        print(f'{key:<36} {result["throughput_rps"]:>9.1f} {base["throughput_rps"]:>9.1f} '
+              f'{result["p95_ms"]:>9.1f} {base["p95_ms"]:>9.1f}')
+        if result['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            regressions.append(f'{key}: throughput {base["throughput_rps"]:.1f} -> {result["throughput_rps"]:.1f} rps')
+        if result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{key}: p95 {base["p95_ms"]:.1f} -> {result["p95_ms"]:.1f} ms')
+    return regressions
+
+
+async def prepare(app, args):
+    """
+    Starts the app the way uvicorn would, then seeds the data and the benchmark user
+    """
+    import httpx
+    from cache import login_throttle
+    from database import seeder
+    from service import startup
+
+    login_throttle.enabled = False  # The same users log in over and over from one address
+    lifespan = app.router.lifespan_context(app)
+    await lifespan.__aenter__()
+    while not startup.ready:
+        if startup.failed:
+            raise RuntimeError('Startup failed')
+        await asyncio.sleep(0.05)
+    if args.rows:
+        await seeder.main(seeder.parse_args([
+            '--rows', str(args.rows), '--accounts', str(args.rows // 10), '--seed', '0',
+            '--precomputed-hash', '--workers', '1']))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        await client.post('/auth/register', json={'username': 'bench', 'name': 'Bench', 'surname': 'User',
+                                                  'email': 'bench-user@bench.example', 'password': 'bench-password'})
+    return lifespan
+
+
+async def main(args):
+    stand_ins.use_test_secrets()
+    if args.database == 'sqlite':
+        stand_ins.use_sqlite()
+    if args.redis == 'memory':
+        stand_ins.use_memory_redis()
+    from main import app
+    from settings import settings
+
+    lifespan = await prepare(app, args)
+    results = {}
+    try:
+        for scenario in scenarios(settings, args):
+            if args.only and not any(scenario.name.startswith(i) for i in args.only):
+                continue
+            for concurrency in args.concurrency:
+                requests = args.auth_requests if scenario.auth_heavy else args.requests
+                result = await run_scenario(app, scenario, concurrency, requests)
+                key = f'{scenario.name}@{concurrency}'
+                results[key] = result
+                print(f'{key:<36} {result["throughput_rps"]:>9.1f} rps  p50 {result["p50_ms"]:>7.1f}  '
+                      f'p95 {result["p95_ms"]:>7.1f}  p99 {result["p99_ms"]:>7.1f} ms  errors {result["errors"]}')
+    finally:
+        await lifespan.__aexit__(None, None, None)
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    report = {
+        'meta': {
+            'date': datetime.now(UTC).isoformat(),
+            'commit': commit,
+            'python': platform.python_version(),
+            'database': args.database,
+            'redis': args.redis,
+            'rows': args.rows,
+            'requests': args.requests,
+            'auth_requests': args.auth_requests,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+
+
+def parse_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.endpoints')
+    parser.add_argument('--database', choices=('sqlite', 'postgres'), default='sqlite')
+    parser.add_argument('--redis', choices=('memory', 'real'), default='memory')
+    parser.add_argument('--concurrency', type=lambda text: [int(i) for i in text.split(',')], default=[1, 16])
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario and concurrency')
+    parser.add_argument('--auth-requests', type=int, default=40, help='same for login and register, they run bcrypt')
+    parser.add_argument('--rows', type=int, default=10000, help='rows seeded into every data table, 0 to skip')
+    parser.add_argument('--fetch-limit', type=int, default=100, help='fetch_data page size, 0 for all rows')
+    parser.add_argument('--only', type=lambda text: text.split(','), default=None,
+                        help='comma separated scenario name prefixes')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--compare', help='baseline JSON from an earlier --output')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed relative change before it is a regression')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,67 @@
+"""
+Per-account Fernet cost, building Fernet objects per call against the cached field_cipher. \n
+bcrypt is left out, run with: python -m benchmarks.field_cipher
+"""
+import time
+
+from cryptography.fernet import Fernet
+
+from schemas import Account
+from security import FieldCipher
+from service.conversions_service import unprocess_account
+
+accounts = 20000
+key = Fernet.generate_key().decode()
+
+
+class BenchSettings:
+    name_secret = email_secret = access_level_secret = username_secret = key
+
+
+def old_encode(account: Account) -> list[str]:
+    return [Fernet(key=key).encrypt(i.encode()).decode()
+            for i in (account.name + ' ' + account.surname, account.email, '1', account.username)]
+
+
+def old_decode(tokens: list[str]) -> Account:
+    full_name, email, username = [Fernet(key=key).decrypt(i.encode()).decode() for i in tokens[:2] + tokens[3:]]
+    full_name = full_name.split()
+    return Account(username=username, name=full_name[0], surname=full_name[1], password='', email=email)
+
+
+def main():
+    import service.conversions_service as conversions
+    cipher = FieldCipher(BenchSettings)
+    conversions.field_cipher = cipher
+    account = Account(username='bench', name='Bench', surname='Mark', email='bench@mark.io', password='')
+
+    start = time.perf_counter()
+    tokens = [old_encode(account) for _ in range(accounts)]
+    old_enc = (time.perf_counter() - start) / accounts * 1e6
+    start = time.perf_counter()
+    for i in tokens:
+        old_decode(i)
+    old_dec = (time.perf_counter() - start) / accounts * 1e6
+
+    start = time.perf_counter()
+    encoded = [[cipher.encrypt(field, text) for field, text in
+                (('name', 'Bench Mark'), ('email', account.email), ('access_level', '1'), ('username', account.username))]
+               for _ in range(accounts)]
+    new_enc = (time.perf_counter() - start) / accounts * 1e6
+
+    class Row:
+        def __init__(self, tokens):
+            self.name_enc, self.email_enc, self.access_level_enc, self.username_enc = tokens
+    rows = [Row(i) for i in encoded]
+    start = time.perf_counter()
+    for i in rows:
+        unprocess_account(i)
+    new_dec = (time.perf_counter() - start) / accounts * 1e6
+
+    print(f'{"":>10} {"Fernet per call, us":>20} {"field_cipher, us":>18}')
+    print(f'{"encode":>10} {old_enc:>20.1f} {new_enc:>18.1f}')
+    print(f'{"decode":>10} {old_dec:>20.1f} {new_dec:>18.1f}')
+
+
+if __name__ == '__main__':
+    main()
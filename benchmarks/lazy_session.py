@@ -0,0 +1,75 @@
+"""
+Pool occupancy under mixed traffic: a session held for the whole request against a LazySession
+released right after the query. Most requests are anonymous or cached and never query. \n
+Needs the postgres from .env, run with: python -m benchmarks.lazy_session
+"""
+import asyncio
+import random
+import time
+
+from sqlalchemy import text
+
+from database import get_db_session_cm, LazySession, pool_stats
+from database.database_getter import ObservedPool, engine
+
+query_seconds = 0.005
+render_seconds = 0.02  # Template rendering, serialization, sending the response
+requests_total = 2000
+concurrency = 100
+db_share = 0.3
+
+
+async def eager_request(needs_db: bool):
+    async with get_db_session_cm() as session:
+        if needs_db:
+            await session.execute(text(f'SELECT pg_sleep({query_seconds})'))
+        await asyncio.sleep(render_seconds)
+
+
+async def lazy_request(needs_db: bool):
+    lazy_session = LazySession(read_only=True)
+    try:
+        if needs_db:
+            async with lazy_session as session:
+                await session.execute(text(f'SELECT pg_sleep({query_seconds})'))
+        await asyncio.sleep(render_seconds)
+    finally:
+        await lazy_session.release()
+
+
+async def run(name: str, request):
+    rng = random.Random(0)
+    plan = [rng.random() < db_share for _ in range(requests_total)]
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+    ObservedPool.checkouts, ObservedPool.checkout_time, ObservedPool.max_checkout_time = 0, 0.0, 0.0
+
+    async def sample():
+        while True:
+            samples.append(engine.sync_engine.pool.checkedout())
+            await asyncio.sleep(0.001)
+
+    async def limited(needs_db: bool):
+        async with semaphore:
+            await request(needs_db)
+
+    sampler = asyncio.create_task(sample())
+    start = time.perf_counter()
+    await asyncio.gather(*[limited(i) for i in plan])
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    stats = pool_stats()
+    print(f'{name:>6} {elapsed:>8.2f} {sum(samples) / len(samples):>15.1f} {max(samples):>15} '
+          f'{stats["avg_checkout_seconds"] * 1000:>14.1f}')
+
+
+async def main():
+    print(f'{requests_total} requests, {concurrency} at a time, {db_share:.0%} of them query postgres')
+    print(f'{"":>6} {"total, s":>8} {"avg checked out":>15} {"max checked out":>15} {"checkout, ms":>14}')
+    await run('eager', eager_request)
+    await run('lazy', lazy_request)
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
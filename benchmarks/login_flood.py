@@ -0,0 +1,129 @@
+"""
+Legitimate login latency during a credential-stuffing flood, with the login throttle off and on. \n
+Seeded accounts are split: the first --legit ones log in with the right password one after another,
+each from its own address, the rest are attacked with wrong passwords from --attacker-ips addresses.
+The flood runs --warmup seconds before the legitimate logins are measured, so the throttle is in its steady state.
+Every phase reports the legitimate p50/p95/max and status codes, and what the attackers got. \n
+Run with: python -m benchmarks.login_flood --duration 20 --attackers 16
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import Counter
+
+from benchmarks import endpoints, stand_ins
+
+
+def client(app, ip: str):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app, client=(ip, 40000))
+    return httpx.AsyncClient(transport=transport, base_url='http://bench', follow_redirects=False)
+
+
+async def legit_logins(app, ids: list[int], password: str, duration: float, interval: float) -> dict:
+    latencies, statuses = [], Counter()
+    deadline = time.perf_counter() + duration
+    i = 0
+    while time.perf_counter() < deadline:
+        account_id = ids[i % len(ids)]
+        async with client(app, f'10.1.0.{i % len(ids) + 1}') as legit:
+            start = time.perf_counter()
+            response = await legit.post('/auth/login', json={'email': f'user{account_id}@seed.example',
+                                                             'password': password})
+            latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] += 1
+        i += 1
+        await asyncio.sleep(interval)
+    latencies.sort()
+    return {
+        'logins': len(latencies),
+        'p50_ms': endpoints.percentile(latencies, 0.5) * 1000,
+        'p95_ms': endpoints.percentile(latencies, 0.95) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'statuses': dict(statuses),
+    }
+
+
+async def attack(app, targets: list[int], ips: list[str], attackers: int, stop: asyncio.Event) -> Counter:
+    statuses = Counter()
+    rng = random.Random(0)
+
+    async def attacker(n: int):
+        async with client(app, ips[n % len(ips)]) as bot:
+            while not stop.is_set():
+                response = await bot.post('/auth/login', json={
+                    'email': f'user{rng.choice(targets)}@seed.example', 'password': f'guess-{rng.random()}'})
+                statuses[response.status_code] += 1
+                if response.status_code in (429, 503):  # A real bot does not wait, but keeps the event loop free
+                    await asyncio.sleep(0)
+
+    await asyncio.gather(*[attacker(n) for n in range(attackers)])
+    return statuses
+
+
+async def phase(app, name: str, args, legit: list[int], targets: list[int], under_attack: bool, throttle: bool):
+    from cache import login_throttle, redis_client
+    from database import seeder
+
+    login_throttle.enabled = throttle
+    async for key in redis_client.scan_iter(match='throttle:*'):  # Every phase starts clean
+        await redis_client.delete(key)
+    stop = asyncio.Event()
+    ips = [f'203.0.113.{i + 1}' for i in range(args.attacker_ips)]
+    flood = None
+    if under_attack:
+        flood = asyncio.create_task(attack(app, targets, ips, args.attackers, stop))
+        await asyncio.sleep(args.warmup)
+    result = await legit_logins(app, legit, seeder.seeded_password, args.duration, args.interval)
+    stop.set()
+    attacked = await flood if flood else Counter()
+    print(f'{name:<24} legit p50 {result["p50_ms"]:>8.1f}  p95 {result["p95_ms"]:>8.1f}  '
+          f'max {result["max_ms"]:>8.1f} ms  {result["statuses"]}  attackers {dict(attacked)}')
+    return result
+
+
+async def main(args):
+    stand_ins.use_test_secrets()
+    if args.database == 'sqlite':
+        stand_ins.use_sqlite()
+    if args.redis == 'memory':
+        stand_ins.use_memory_redis()
+    from main import app
+    from database import database_getter, seeder
+    from database.orm_schemas import Accounts
+
+    lifespan = await endpoints.prepare(app, endpoints.parse_args(['--rows', '0']))
+    try:
+        async with database_getter.engine.connect() as conn:
+            start_id = await seeder.next_id(conn, Accounts, minimum=seeder.first_account_id)
+        await seeder.main(seeder.parse_args(['--tables', 'accounts', '--accounts', str(args.accounts), '--seed', '0',
+                                             '--precomputed-hash', '--workers', '1']))
+        ids = list(range(start_id, start_id + args.accounts))
+        legit, targets = ids[:args.legit], ids[args.legit:]
+        await phase(app, 'quiet', args, legit, targets, under_attack=False, throttle=True)
+        await phase(app, 'flood, throttle off', args, legit, targets, under_attack=True, throttle=False)
+        await phase(app, 'flood, throttle on', args, legit, targets, under_attack=True, throttle=True)
+    finally:
+        await lifespan.__aexit__(None, None, None)
+
+
+def parse_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.login_flood')
+    parser.add_argument('--database', choices=('sqlite', 'postgres'), default='sqlite')
+    parser.add_argument('--redis', choices=('memory', 'real'), default='memory')
+    parser.add_argument('--accounts', type=int, default=200, help='seeded accounts, legit ones included')
+    parser.add_argument('--legit', type=int, default=20, help='accounts that log in with the right password')
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between legitimate logins')
+    parser.add_argument('--attackers', type=int, default=16, help='concurrent attacking clients')
+    parser.add_argument('--attacker-ips', type=int, default=4)
+    parser.add_argument('--warmup', type=float, default=40, help='seconds of flood before measuring')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of measuring per phase')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,69 @@
+"""
+Cost of the metrics: nanoseconds per observation, then request throughput with the registry on and off,
+in alternating rounds, on the same stand-ins as benchmarks.endpoints. \n
+Run with: python -m benchmarks.metrics_overhead
+"""
+import asyncio
+import statistics
+import time
+
+from benchmarks import endpoints, stand_ins
+
+observations = 200000
+rounds = 5
+requests = 300
+concurrency = 8
+scenario_names = ('anonymous_index', 'get_name', 'fetch_data:important_data')
+
+
+def micro():
+    from metrics import Counter, Histogram
+
+    histogram = Histogram('bench_seconds', 'bench', ('label',))
+    counter = Counter('bench_total', 'bench', ('label',))
+    start = time.perf_counter()
+    for i in range(observations):
+        histogram.observe(0.003, 'a')
+    observe = (time.perf_counter() - start) / observations * 1e9
+    start = time.perf_counter()
+    for i in range(observations):
+        with histogram.time('a'):
+            pass
+    timed = (time.perf_counter() - start) / observations * 1e9
+    start = time.perf_counter()
+    for i in range(observations):
+        counter.inc('a', 200)
+    inc = (time.perf_counter() - start) / observations * 1e9
+    print(f'Histogram.observe {observe:.0f} ns, Histogram.time {timed:.0f} ns, Counter.inc {inc:.0f} ns')
+
+
+async def main():
+    stand_ins.use_test_secrets()
+    stand_ins.use_sqlite()
+    stand_ins.use_memory_redis()
+    micro()
+    from main import app
+    from metrics import registry
+    from settings import settings
+
+    args = endpoints.parse_args(['--rows', '2000'])
+    lifespan = await endpoints.prepare(app, args)
+    try:
+        for scenario in endpoints.scenarios(settings, args):
+            if scenario.name not in scenario_names:
+                continue
+            throughput = {True: [], False: []}
+            for i in range(rounds):
+                for enabled in ((True, False) if i % 2 == 0 else (False, True)):
+                    registry.enabled = enabled
+                    result = await endpoints.run_scenario(app, scenario, concurrency, requests)
+                    throughput[enabled].append(result['throughput_rps'])
+            on, off = statistics.median(throughput[True]), statistics.median(throughput[False])
+            print(f'{scenario.name:<28} on {on:>8.1f} rps, off {off:>8.1f} rps, overhead {(off - on) / off:>6.1%}')
+    finally:
+        registry.enabled = True
+        await lifespan.__aexit__(None, None, None)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
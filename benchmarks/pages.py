@@ -0,0 +1,73 @@
+"""
+Bytes on the wire and requests per second of the pages, /static and fetch_data, by Accept-Encoding,
+and with If-None-Match (a browser revalidating its copy), on the same stand-ins as benchmarks.endpoints.
+Also the cost of rendering a page per request, as it was done before the pages were rendered at startup. \n
+Run with: python -m benchmarks.pages
+"""
+import asyncio
+import time
+
+from benchmarks import endpoints, stand_ins
+
+requests = 300
+renders = 2000
+variants = {'identity': 'identity', 'gzip': 'gzip', 'br': 'br, gzip'}
+
+
+def micro():
+    from starlette.requests import Request
+    from handlers.assets import pages
+
+    request = Request({'type': 'http', 'method': 'GET', 'path': '/', 'headers': [(b'accept-encoding', b'br, gzip')],
+                       'query_string': b''})
+    start = time.perf_counter()
+    for _ in range(renders):
+        pages.templates.TemplateResponse(request, 'index.html')
+    rendered = (time.perf_counter() - start) / renders * 1e6
+    start = time.perf_counter()
+    for _ in range(renders):
+        pages.response(request, 'index.html')
+    cached = (time.perf_counter() - start) / renders * 1e6
+    print(f'index.html rendered per request {rendered:.1f} us, from the page cache {cached:.1f} us')
+
+
+async def measure(client, path: str, headers: dict) -> tuple[float, int]:
+    start = time.perf_counter()
+    wire = 0
+    for _ in range(requests):
+        response = await client.get(path, headers=headers)
+        wire = int(response.headers.get('content-length') or len(response.content))
+    return requests / (time.perf_counter() - start), wire
+
+
+async def main():
+    stand_ins.use_test_secrets()
+    stand_ins.use_sqlite()
+    stand_ins.use_memory_redis()
+    micro()
+    import httpx
+    from main import app
+    from settings import settings
+
+    lifespan = await endpoints.prepare(app, endpoints.parse_args(['--rows', '2000']))
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            await client.post('/auth/login', json={'email': settings.admin_email, 'password': settings.admin_password})
+            for path in ('/', '/service/', '/static/favicon.ico',
+                         '/service/fetch_data?repository_name=important_data&limit=100',
+                         '/service/fetch_data?repository_name=important_data'):
+                line = []
+                for name, accept in variants.items():
+                    rps, wire = await measure(client, path, {'Accept-Encoding': accept})
+                    line.append(f'{name} {wire:>8} B {rps:>7.0f} rps')
+                etag = (await client.get(path, headers={'Accept-Encoding': 'br, gzip'})).headers.get('etag')
+                rps, wire = await measure(client, path, {'Accept-Encoding': 'br, gzip', 'If-None-Match': etag})
+                line.append(f'304 {wire:>3} B {rps:>7.0f} rps')
+                print(f'{path[:48]:<48} ' + ', '.join(line))
+    finally:
+        await lifespan.__aexit__(None, None, None)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+"""
+/auth/get_name with the profile cache on and off, in alternating rounds, on the same stand-ins as
+benchmarks.endpoints, then the hit rate of the cached rounds. \n
+Run with: python -m benchmarks.profile_cache
+"""
+import asyncio
+import statistics
+
+from benchmarks import endpoints, stand_ins
+
+rounds = 5
+requests = 500
+concurrency = (1, 8)
+
+
+async def main():
+    stand_ins.use_test_secrets()
+    stand_ins.use_sqlite()
+    stand_ins.use_memory_redis()
+    from main import app
+    from cache import profile_cache
+    from settings import settings
+
+    args = endpoints.parse_args(['--rows', '0'])
+    lifespan = await endpoints.prepare(app, args)
+    scenario = next(i for i in endpoints.scenarios(settings, args) if i.name == 'get_name')
+    try:
+        for workers in concurrency:
+            results = {True: [], False: []}
+            for i in range(rounds):
+                for enabled in ((True, False) if i % 2 == 0 else (False, True)):
+                    profile_cache.enabled = enabled
+                    results[enabled].append(await endpoints.run_scenario(app, scenario, workers, requests))
+            for enabled, name in ((False, 'off'), (True, 'on')):
+                rps = statistics.median(i['throughput_rps'] for i in results[enabled])
+                p50 = statistics.median(i['p50_ms'] for i in results[enabled])
+                p95 = statistics.median(i['p95_ms'] for i in results[enabled])
+                print(f'get_name@{workers:<3} cache {name:<4} {rps:>8.1f} rps  p50 {p50:>7.2f}  p95 {p95:>7.2f} ms')
+        print(profile_cache.stats())
+    finally:
+        profile_cache.enabled = True
+        await lifespan.__aexit__(None, None, None)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+"""
+Cost of the profiler: nanoseconds the disabled middleware adds to a request, then request throughput with
+profiling off, slow capture on (every request tracked and sampled) and every request sampled,
+in alternating rounds, on the same stand-ins as benchmarks.endpoints. \n
+Run with: python -m benchmarks.profiler_overhead
+"""
+import asyncio
+import statistics
+import time
+
+from benchmarks import endpoints, stand_ins
+
+calls = 200000
+rounds = 5
+requests = 300
+concurrency = 8
+scenario_names = ('anonymous_index', 'get_name', 'fetch_data:important_data')
+modes = {'off': (0, 0), 'slow': (0, 60), 'sampled': (1, 0)}  # sample_rate, slow_seconds
+
+
+async def micro():
+    from metrics import ProfilingMiddleware
+
+    async def app(scope, receive, send):
+        pass
+
+    async def is_admin(request):
+        return False
+
+    middleware = ProfilingMiddleware(app, is_admin=is_admin)
+    scope = {'type': 'http', 'method': 'GET', 'path': '/',
+             'headers': [(f'x-header-{i}'.encode(), b'value') for i in range(12)]}
+    start = time.perf_counter()
+    for i in range(calls):
+        await app(scope, None, None)
+    bare = (time.perf_counter() - start) / calls * 1e9
+    start = time.perf_counter()
+    for i in range(calls):
+        await middleware(scope, None, None)
+    wrapped = (time.perf_counter() - start) / calls * 1e9
+    print(f'Disabled middleware adds {wrapped - bare:.0f} ns per request')
+
+
+async def main():
+    stand_ins.use_test_secrets()
+    stand_ins.use_sqlite()
+    stand_ins.use_memory_redis()
+    await micro()
+    from main import app
+    from metrics import profiler
+    from settings import settings
+
+    args = endpoints.parse_args(['--rows', '2000'])
+    lifespan = await endpoints.prepare(app, args)
+    try:
+        for scenario in endpoints.scenarios(settings, args):
+            if scenario.name not in scenario_names:
+                continue
+            throughput = {mode: [] for mode in modes}
+            for i in range(rounds):
+                for mode in (list(modes) if i % 2 == 0 else list(reversed(modes))):
+                    profiler.sample_rate, profiler.slow_seconds = modes[mode]
+                    result = await endpoints.run_scenario(app, scenario, concurrency, requests)
+                    throughput[mode].append(result['throughput_rps'])
+            off = statistics.median(throughput['off'])
+            line = ', '.join(f'{mode} {statistics.median(values):>8.1f} rps '
+                             f'({(off - statistics.median(values)) / off:>6.1%})'
+                             for mode, values in throughput.items())
+            print(f'{scenario.name:<28} {line}')
+    finally:
+        profiler.sample_rate, profiler.slow_seconds = modes['off']
+        await lifespan.__aexit__(None, None, None)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,55 @@
+"""
+Redis commands and round trips per request for the main endpoints, after a warm-up request. \n
+Needs the postgres and redis from .env (admin account is used to log in), run with: python -m benchmarks.redis_commands
+"""
+import asyncio
+
+import httpx
+from redis.asyncio.client import Pipeline
+
+from cache import redis_client
+from main import app, lifespan
+from settings import settings
+
+counter = {'commands': 0, 'round_trips': 0}
+execute_command = redis_client.execute_command
+pipeline_execute = Pipeline.execute
+
+
+async def counted_execute_command(*args, **kwargs):
+    counter['commands'] += 1
+    counter['round_trips'] += 1
+    return await execute_command(*args, **kwargs)
+
+
+async def counted_pipeline_execute(self, *args, **kwargs):
+    counter['commands'] += len(self.command_stack)
+    counter['round_trips'] += 1
+    return await pipeline_execute(self, *args, **kwargs)
+
+
+async def measure(client: httpx.AsyncClient, name: str, url: str, requests: int = 20):
+    await client.get(url)
+    counter['commands'] = counter['round_trips'] = 0
+    for _ in range(requests):
+        await client.get(url)
+    print(f'{name:>40} {counter["commands"] / requests:>9.2f} {counter["round_trips"] / requests:>12.2f}')
+
+
+async def main():
+    redis_client.execute_command = counted_execute_command
+    Pipeline.execute = counted_pipeline_execute
+    async with lifespan(app):
+        await asyncio.sleep(1)  # Let client-side caching connect
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            print(f'{"endpoint":>40} {"commands":>9} {"round trips":>12}')
+            await measure(client, 'anonymous /', '/')
+            await measure(client, 'anonymous fetch_data', '/service/fetch_data?repository_name=very_unimportant_data')
+            await client.post('/auth/login', json={'email': settings.admin_email, 'password': settings.admin_password})
+            await measure(client, 'logged in /auth/get_name', '/auth/get_name')
+            await measure(client, 'logged in fetch_data', '/service/fetch_data?repository_name=important_data')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
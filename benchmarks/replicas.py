@@ -0,0 +1,165 @@
+"""
+Read/write splitting on two sqlite files: the primary, and a replica that gets a copy of it every --replication-delay
+seconds (benchmarks.stand_ins.copy_sqlite), so it lags like a real one. \n
+Goes through the cases and prints where the reads went: a healthy replica, read-your-writes after admin_create
+(with the primary_until cookie and without it), fetch_data pages filled into the cache right after a write and
+once the replica has it, a replica that stopped replicating, and one that is down. \n
+Run with: python -m benchmarks.replicas --rows 100000
+"""
+import argparse
+import asyncio
+import contextlib
+import time
+
+from benchmarks import endpoints, stand_ins
+
+
+class Replicator:
+    """
+    Copies the primary file into the replica one every delay seconds while not paused
+    """
+    def __init__(self, primary: str, replica: str, delay: float):
+        self.primary = primary
+        self.replica = replica
+        self.delay = delay
+        self.paused = False
+
+    async def run(self):
+        while True:
+            if not self.paused:
+                await asyncio.to_thread(stand_ins.copy_sqlite, self.primary, self.replica)
+            await asyncio.sleep(self.delay)
+
+
+async def wait_for(condition, timeout: float = 30):
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            raise RuntimeError('Timed out')
+        await asyncio.sleep(0.05)
+
+
+async def count_accounts(client) -> int:
+    response = await client.get('/service/fetch_data?repository_name=accounts&stream=true')
+    return len(response.text.splitlines())
+
+
+def report(name: str, before: dict, after: dict, note: str = ''):
+    replica = after['replica_reads'] - before['replica_reads']
+    primary = after['primary_reads'] - before['primary_reads']
+    lag = f'{after["lag_seconds"]:.2f} s' if after['lag_seconds'] is not None else '-'
+    print(f'{name:<34} replica {replica:>5}  primary {primary:>5}  lag {lag:>7}  {note}')
+
+
+async def main(args):
+    import httpx
+
+    stand_ins.use_test_secrets()
+    primary = stand_ins.use_sqlite()
+    replica = stand_ins.use_sqlite_replica()
+    stand_ins.use_memory_redis()
+    from main import app
+    from cache import result_cache
+    from database import database_getter, seeder, session_router
+    from settings import settings
+
+    session_router.max_lag = args.max_lag
+    session_router.check_interval = args.check_interval
+    lifespan = await endpoints.prepare(app, endpoints.parse_args(['--rows', '0']))
+    await seeder.main(seeder.parse_args(['--rows', str(args.rows), '--tables', 'important_data', '--seed', '0',
+                                         '--workers', '1']))
+    replicator = Replicator(primary, replica, args.replication_delay)
+    replication = asyncio.create_task(replicator.run())
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            await client.post('/auth/login', json={'email': settings.admin_email,
+                                                   'password': settings.admin_password})
+            client.cookies.delete(session_router.cookie)
+            seeded_at = await result_cache.bumped_at('important_data')
+            await wait_for(lambda: session_router.usable and session_router.caught_up(seeded_at))
+
+            before = session_router.stats()
+            for path in ('aggregate?repository_name=important_data&period=month',
+                         'search?repository_name=important_data&q=data'):
+                latencies, errors = [], 0
+                for _ in range(args.requests):
+                    start = time.perf_counter()
+                    response = await client.get(f'/service/{path}')
+                    latencies.append(time.perf_counter() - start)
+                    errors += response.status_code != 200
+                result = endpoints.summarize(latencies, errors, sum(latencies))
+                report(path.split('?')[0] + ' (healthy)', before, before := session_router.stats(),
+                       f'p50 {result["p50_ms"]:.2f} ms, errors {errors}')
+
+            before = session_router.stats()
+            for after_id in range(args.requests):  # Every page is a cache miss
+                await client.get(f'/service/fetch_data?repository_name=important_data&limit=10&after_id={after_id}')
+            report('fetch_data page fills', before, before := session_router.stats())
+            await result_cache.bump('important_data')
+            await client.get('/service/fetch_data?repository_name=important_data&limit=10')
+            report('page fill right after a write', before, before := session_router.stats(),
+                   'the replica may not have it yet')
+            bumped_at = await result_cache.bumped_at('important_data')
+            await wait_for(lambda: session_router.caught_up(bumped_at))
+            await client.get('/service/fetch_data?repository_name=important_data&limit=10&after_id=1')
+            report('page fill once the replica has it', before, before := session_router.stats())
+
+            replicator.paused = True
+            await asyncio.sleep(args.replication_delay)  # A copy that was running has finished
+            accounts = await count_accounts(client)
+            await client.post('/auth/admin_create', json={'account': {
+                'username': 'replica', 'name': 'Replica', 'surname': 'Check', 'email': 'replica@bench.example',
+                'password': 'bench-password'}, 'access_level': 1})
+            before = session_router.stats()
+            pinned = await count_accounts(client)
+            report('after admin_create, with cookie', before, before := session_router.stats(),
+                   f'sees the new account: {pinned == accounts + 1}')
+            client.cookies.delete(session_router.cookie)
+            unpinned = await count_accounts(client)
+            report('after admin_create, no cookie', before, before := session_router.stats(),
+                   f'sees the new account: {unpinned == accounts + 1} (replica not caught up yet)')
+
+            await wait_for(lambda: not session_router.usable)
+            lagging = await count_accounts(client)
+            report('replication stopped', before, before := session_router.stats(),
+                   f'sees the new account: {lagging == accounts + 1}')
+
+            replicator.paused = False
+            await wait_for(lambda: session_router.usable)
+            caught_up = await count_accounts(client)
+            report('replication resumed', before, before := session_router.stats(),
+                   f'sees the new account: {caught_up == accounts + 1}')
+
+            replica_engine = session_router.replica_engine
+            session_router.use_replica(database_getter.make_engine('sqlite+aiosqlite:////nonexistent/replica.sqlite'))
+            await wait_for(lambda: session_router.failures > 0 and not session_router.usable)
+            before = session_router.stats()
+            statuses = [(await client.get('/service/aggregate?repository_name=important_data')).status_code
+                        for _ in range(args.requests)]
+            report('replica down', before, before := session_router.stats(),
+                   f'errors {sum(status != 200 for status in statuses)}')
+            await session_router.replica_engine.dispose()
+            session_router.use_replica(replica_engine)
+            await wait_for(lambda: session_router.usable)
+            print(f'replica back after the next check, stats: {session_router.stats()}')
+    finally:
+        replication.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await replication
+        await lifespan.__aexit__(None, None, None)
+
+
+def parse_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.replicas')
+    parser.add_argument('--rows', type=int, default=100_000, help='rows seeded into important_data')
+    parser.add_argument('--requests', type=int, default=200, help='requests per healthy and down case')
+    parser.add_argument('--replication-delay', type=float, default=0.5, help='seconds between copies')
+    parser.add_argument('--max-lag', type=float, default=2, help='POSTGRES_REPLICA_MAX_LAG for the run')
+    parser.add_argument('--check-interval', type=float, default=0.25,
+                        help='POSTGRES_REPLICA_CHECK_INTERVAL for the run')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,51 @@
+"""
+Stampede on one cold fetch_data key: several workers (ResultCache instances on one redis) with several callers each,
+and a fill that takes longer than lock_ttl, like an unpaginated fetch_data on a big table. \n
+The fill has to run once, the holder keeps the lock alive and the others wait for the entry.
+Exits with an error if it ran more than once. Run with: python -m benchmarks.result_cache
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks import stand_ins
+
+
+async def main(args):
+    stand_ins.use_test_secrets()
+    import fakeredis
+    from cache import ResultCache
+
+    client = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer(), decode_responses=True)
+    fills = 0
+
+    async def fill() -> tuple[str, int | None]:
+        nonlocal fills
+        fills += 1
+        await asyncio.sleep(args.fill_seconds)
+        return '[]', None
+
+    workers = [ResultCache(client=client, lock_ttl=args.lock_ttl) for _ in range(args.workers)]
+    start = time.perf_counter()
+    results = await asyncio.gather(*(worker.get_or_fill('important_data:v1:cold', fill)
+                                     for worker in workers for _ in range(args.callers)))
+    elapsed = time.perf_counter() - start
+    print(f'{len(results)} callers in {args.workers} workers, fill {args.fill_seconds} s, lock_ttl {args.lock_ttl} s: '
+          f'fills {fills}, {elapsed:.2f} s')
+    for i, worker in enumerate(workers):
+        print(f'worker {i}: {worker.stats()}')
+    if fills != 1 or any(result != ('[]', None) for result in results):
+        raise SystemExit(f'Expected one fill and the same entry for every caller, got {fills} fills')
+
+
+def parse_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.result_cache')
+    parser.add_argument('--workers', type=int, default=4, help='ResultCache instances sharing one redis')
+    parser.add_argument('--callers', type=int, default=25, help='concurrent callers per worker')
+    parser.add_argument('--lock-ttl', type=float, default=0.3, help='lock_ttl of the caches')
+    parser.add_argument('--fill-seconds', type=float, default=1, help='duration of the fill, longer than lock_ttl')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
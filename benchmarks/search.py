@@ -0,0 +1,71 @@
+"""
+/service/search against the way rows were found before: download the whole table through fetch_data
+and grep it on the client, on important_data with --rows rows (1M by default). \n
+The seeder draws every word from a vocabulary of about a hundred, so one word matches roughly every eighth row,
+every extra word cuts the matches about eight times. Ranking looks at every match, so the one-word query
+is the slow case of the search. \n
+On the sqlite stand-in the search goes through FTS5, with --database postgres through the tsvector column
+and its GIN index. \n
+Run with: python -m benchmarks.search --rows 1000000
+"""
+import argparse
+import asyncio
+import re
+
+from benchmarks import endpoints, stand_ins
+
+queries = {
+    'one word': 'report',
+    'two words': 'report invoice',
+    'three words': 'report invoice budget',
+    'no match': 'zeppelin',
+}
+
+
+async def main(args):
+    stand_ins.use_test_secrets()
+    if args.database == 'sqlite':
+        stand_ins.use_sqlite()
+    stand_ins.use_memory_redis()
+    from main import app
+    from database import seeder
+    from settings import settings
+
+    lifespan = await endpoints.prepare(app, endpoints.parse_args(['--rows', '0']))
+    admin = (settings.admin_email, settings.admin_password)
+    try:
+        await seeder.main(seeder.parse_args(['--rows', str(args.rows), '--tables', 'important_data',
+                                             '--seed', '0', '--workers', '1']))
+        scenarios = [endpoints.Scenario(f'search: {name}', lambda client, terms=terms: client.get(
+            '/service/search', params={'repository_name': 'important_data', 'q': terms, 'limit': args.limit}),
+                                        login=admin)
+                     for name, terms in queries.items()]
+
+        async def download(client):
+            response = await client.get('/service/fetch_data?repository_name=important_data')
+            pattern = re.compile(r'\b' + queries['two words'].replace(' ', r'\b|\b') + r'\b', re.IGNORECASE)
+            [row for row in response.json() if pattern.search(row['text'])]
+            return response
+
+        scenarios.append(endpoints.Scenario('download and grep', download, login=admin))
+        for scenario in scenarios:
+            requests = args.requests if scenario.name.startswith('search') else args.download_requests
+            result = await endpoints.run_scenario(app, scenario, 1, requests)
+            print(f'{args.rows:>9} rows  {scenario.name:<20} p50 {result["p50_ms"]:>10.2f} ms  '
+                  f'p95 {result["p95_ms"]:>10.2f} ms  errors {result["errors"]}')
+    finally:
+        await lifespan.__aexit__(None, None, None)
+
+
+def parse_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.search')
+    parser.add_argument('--database', choices=('sqlite', 'postgres'), default='sqlite')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='rows seeded into important_data')
+    parser.add_argument('--limit', type=int, default=20, help='search page size')
+    parser.add_argument('--requests', type=int, default=50, help='search requests per query')
+    parser.add_argument('--download-requests', type=int, default=3)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
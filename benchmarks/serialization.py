@@ -0,0 +1,117 @@
+"""
+CPU time and peak memory of turning a page of rows into a fetch_data body, per 100k rows, for every data table. \n
+previous - ORM instances, model_validate into a pydantic copy of every row, model_dump_json per row
+and json.dumps of the list of strings, the way get_all and fetch_data did it before. \n
+current - column projection, row tuples into dicts, one TypeAdapter dump_json of the page. \n
+Both read the same rows from the sqlite stand-in, memory is the tracemalloc peak in a separate run,
+so tracing doesn't slow the timed one. \n
+Run with: python -m benchmarks.serialization --rows 100000
+"""
+import argparse
+import asyncio
+import gc
+import json
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+
+from pydantic import BaseModel
+
+from benchmarks import endpoints, stand_ins
+
+tables = ('very_unimportant_data', 'unimportant_data', 'important_data')
+
+
+class PreviousVeryUnimportantRow(BaseModel):
+    id: int
+    text: str
+
+    model_config = {'from_attributes': True}
+
+
+class PreviousUnimportantRow(PreviousVeryUnimportantRow):
+    date: datetime
+
+
+class PreviousImportantRow(PreviousUnimportantRow):
+    amount: int
+
+
+async def previous(session, table: str) -> bytes:
+    from sqlalchemy import select
+    from database.orm_schemas import VeryUnimportantData, UnimportantData, ImportantData
+
+    orm, row = {
+        'very_unimportant_data': (VeryUnimportantData, PreviousVeryUnimportantRow),
+        'unimportant_data': (UnimportantData, PreviousUnimportantRow),
+        'important_data': (ImportantData, PreviousImportantRow),
+    }[table]
+    result = await session.execute(select(orm).order_by(orm.id))
+    data = [row.model_validate(i) for i in result.scalars().all()]
+    return json.dumps([i.model_dump_json() for i in data], ensure_ascii=False, separators=(',', ':')).encode()
+
+
+async def current(session, table: str) -> bytes:
+    from service.data_service import get_repository, serialize
+
+    data = await get_repository(session, table).get_all(access_level=5)
+    return serialize(table, data)
+
+
+async def measure(way, table: str, traced: bool) -> tuple[float, int, int]:
+    """
+    :return: cpu seconds, peak traced bytes (0 if not traced) and body size
+    """
+    from database import database_getter
+
+    async with database_getter.AsyncSessionLocal() as session:
+        gc.collect()
+        if traced:
+            tracemalloc.start()
+        start = time.process_time()
+        body = await way(session, table)
+        cpu = time.process_time() - start
+        peak = 0
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return cpu, peak, len(body)
+
+
+async def main(args):
+    stand_ins.use_test_secrets()
+    stand_ins.use_sqlite()
+    stand_ins.use_memory_redis()
+    from main import app
+    from database import seeder
+
+    lifespan = await endpoints.prepare(app, endpoints.parse_args(['--rows', '0']))
+    try:
+        await seeder.main(seeder.parse_args(['--rows', str(args.rows), '--tables', ','.join(tables), '--seed', '0',
+                                             '--workers', '1']))
+        scale = 100_000 / args.rows
+        for table in tables:
+            results = {}
+            for name, way in (('previous', previous), ('current', current)):
+                cpu = [(await measure(way, table, traced=False))[0] for _ in range(args.rounds)]
+                _, peak, size = await measure(way, table, traced=True)
+                results[name] = statistics.median(cpu) * scale, peak * scale, size * scale
+                print(f'{table:<22} {name:<9} cpu {results[name][0] * 1000:>8.1f} ms  '
+                      f'peak {results[name][1] / 2 ** 20:>7.1f} MiB  body {results[name][2] / 2 ** 20:>6.1f} MiB'
+                      f'  per 100k rows')
+            print(f'{table:<22} current uses {results["current"][0] / results["previous"][0]:.0%} of the cpu '
+                  f'and {results["current"][1] / results["previous"][1]:.0%} of the memory')
+    finally:
+        await lifespan.__aexit__(None, None, None)
+
+
+def parse_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.serialization')
+    parser.add_argument('--rows', type=int, default=100_000, help='rows seeded into every data table')
+    parser.add_argument('--rounds', type=int, default=5, help='timed runs of every way, the median is shown')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,92 @@
+"""
+Local stand-ins for the benchmarks: in-memory redis (fakeredis) and a throwaway sqlite file (aiosqlite). \n
+Call them before the app is imported, they need the bench extra: poetry install --extras bench
+"""
+import os
+import tempfile
+
+from cryptography.fernet import Fernet
+
+
+def use_test_secrets():
+    """
+    Fernet keys and admin credentials for a throwaway database, keeps the ones that are already set
+    """
+    for name in ('EMAIL', 'NAME', 'ACCESS_LEVEL', 'USERNAME'):
+        os.environ.setdefault(f'PYTHON_{name}_SECRET', Fernet.generate_key().decode())
+    os.environ.setdefault('PYTHON_JWT_SECRET', Fernet.generate_key().decode())
+    os.environ.setdefault('PYTHON_ADMIN_EMAIL', 'admin@bench.example')
+    os.environ.setdefault('PYTHON_ADMIN_PASSWORD', 'bench-admin-password')
+
+
+def use_memory_redis():
+    """
+    Points the shared redis pool at an in-memory fakeredis server, every redis_client user goes through it.
+    Client-side caching needs a real server, so tracked_cache stays disabled and reads go to the stand-in
+    """
+    import fakeredis
+    import redis.asyncio as redis
+    from fakeredis._clients._async import FakeAsyncRedisConnection
+    from cache import redis_pool
+
+    redis_pool.connection_class = FakeAsyncRedisConnection
+    redis_pool.connection_kwargs.pop('password', None)
+    redis_pool.connection_kwargs.update(server=fakeredis.FakeServer(), version=(7,), server_type='redis',
+                                        lua_modules=None, client_class=redis.Redis, connected=True,
+                                        health_check_interval=0)
+
+
+def use_sqlite(path: str | None = None) -> str:
+    """
+    Swaps the engine for a sqlite file, sessions keep going through ObservedPool
+    :param path: database file (Default=None, a new temporary file)
+    :return: str - path of the file
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from database import database_getter
+    from settings import settings
+
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.sqlite')
+    database_getter.engine = create_async_engine(
+        f'sqlite+aiosqlite:///{path}',
+        poolclass=database_getter.ObservedPool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        connect_args={'timeout': 30},
+    )
+    database_getter.read_only_engine = database_getter.engine
+    database_getter.AsyncSessionLocal = async_sessionmaker(database_getter.engine, expire_on_commit=False)
+    database_getter.ReadOnlySessionLocal = async_sessionmaker(database_getter.engine, expire_on_commit=False)
+    return path
+
+
+def use_sqlite_replica(path: str | None = None) -> str:
+    """
+    Second sqlite file as the read replica, call after use_sqlite. It gets data only through copy_sqlite,
+    so the lag is whatever the caller makes it
+    :param path: database file (Default=None, a new temporary file)
+    :return: str - path of the file
+    """
+    from database import database_getter
+
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='bench-replica-'), 'replica.sqlite')
+    database_getter.session_router.use_replica(
+        database_getter.make_engine(f'sqlite+aiosqlite:///{path}', connect_args={'timeout': 30}))
+    return path
+
+
+def copy_sqlite(source: str, target: str):
+    """
+    Replicates the source file into the target one with the sqlite backup api, safe while both are in use
+    """
+    import sqlite3
+
+    src, dst = sqlite3.connect(source, timeout=30), sqlite3.connect(target, timeout=30)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
@@ -0,0 +1,58 @@
+"""
+Anonymous page-load throughput, old redis temp users against the signed temp_token cookie. \n
+Needs the redis from .env, run with: python -m benchmarks.temp_users
+"""
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+
+from cache import redis_client
+from main import app
+from service.conversions_service import generate_id
+
+requests = 2000
+existing_temp_users = [0, 10000, 100000]
+
+
+async def old_identity(temp_id: str) -> int:
+    """The removed create_temp_user, one GET and two SETs of the whole id list per visitor"""
+    used_ids = json.loads(await redis_client.get('bench:used_ids_redis'))
+    account_id = generate_id(used_ids=used_ids)
+    used_ids.append(account_id)
+    await redis_client.set(f'bench:{temp_id}', json.dumps({'id': account_id}), ex=60)
+    await redis_client.set('bench:used_ids_redis', json.dumps(used_ids), ex=60)
+    return account_id
+
+
+async def page_loads(client: httpx.AsyncClient) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.cookies.clear()
+        await client.get('/')
+    return requests / (time.perf_counter() - start)
+
+
+async def main():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        new = await page_loads(client)
+    print(f'signed temp_token, whole page: {new:.0f} req/s')
+
+    for size in existing_temp_users:
+        await redis_client.set('bench:used_ids_redis', json.dumps(list(range(size))))
+        start = time.perf_counter()
+        for _ in range(requests // 10):
+            await old_identity(str(uuid.uuid4()))
+        old = requests // 10 / (time.perf_counter() - start)
+        print(f'old redis temp user, {size} existing, identity only: {old:.0f} req/s')
+    await redis_client.delete('bench:used_ids_redis')
+    keys = [key async for key in redis_client.scan_iter('bench:*')]
+    if keys:
+        await redis_client.delete(*keys)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
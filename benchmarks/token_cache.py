@@ -0,0 +1,41 @@
+"""
+Auth overhead per request, full HS256 verification against the verified-token cache. \n
+Liveness check is left out, run with: python -m benchmarks.token_cache
+"""
+import time
+
+import jwt
+
+from schemas import TokenDict
+from security import TokenCache
+from service.auth_service import give_jwt_token
+from settings import settings
+
+requests = 100000
+users = 1000
+
+
+def main():
+    tokens = [give_jwt_token(TokenDict(id=i, access_level=1)) for i in range(users)]
+
+    start = time.perf_counter()
+    for i in range(requests):
+        payload = jwt.decode(tokens[i % users], key=settings.jwt_secret, algorithms=['HS256'])
+        TokenDict(id=payload['id'], access_level=payload['access_level'])
+    decode = (time.perf_counter() - start) / requests * 1e6
+
+    cache = TokenCache(max_size=users, ttl=300)
+    for token in tokens:
+        payload = jwt.decode(token, key=settings.jwt_secret, algorithms=['HS256'])
+        cache.put(token, TokenDict(id=payload['id'], access_level=payload['access_level']), exp=payload['exp'])
+    start = time.perf_counter()
+    for i in range(requests):
+        cache.get(tokens[i % users])
+    cached = (time.perf_counter() - start) / requests * 1e6
+
+    print(f'jwt.decode: {decode:.2f} us, cache hit: {cached:.2f} us per request')
+    print(cache.stats())
+
+
+if __name__ == '__main__':
+    main()
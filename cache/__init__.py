@@ -1,3 +1,11 @@
-from cache.cache_getter import redis_client
+from cache.cache_getter import redis_client, redis_pool
+from cache.tracked_cache import TrackedCache, tracked_cache
+from cache.redis_lock import RedisLock
+from cache.account_registry import AccountRegistry, account_registry
+from cache.result_cache import ResultCache, result_cache
+from cache.login_throttle import Policy, LoginThrottle, login_throttle
+from cache.profile_cache import ProfileCache, profile_cache
 
-__all__ = ['redis_client']
+__all__ = ['redis_client', 'redis_pool', 'TrackedCache', 'tracked_cache', 'RedisLock',
+           'AccountRegistry', 'account_registry', 'ResultCache', 'result_cache',
+           'Policy', 'LoginThrottle', 'login_throttle', 'ProfileCache', 'profile_cache']
@@ -0,0 +1,98 @@
+from typing import Iterable
+
+from cache.cache_getter import redis_client
+from cache.tracked_cache import tracked_cache
+
+
+class AccountRegistry:
+    """
+    Redis sets of account ids, mirrors the accounts table. \n
+    ids_key holds every id present in postgres (used when generating new ids),
+    active_key holds only the ids of active accounts (used when checking logins)
+    """
+    ids_key = 'accounts:ids'
+    active_key = 'accounts:active'
+    rebuild_key = 'accounts:rebuild_requested'
+    batch_size = 10000
+
+    def __init__(self, client=redis_client, local_cache=tracked_cache):
+        self.client = client
+        self.local_cache = local_cache
+
+    async def is_active(self, account_id: int) -> bool:
+        return bool(await self.local_cache.sismember(self.active_key, account_id))
+
+    async def is_used(self, account_id: int) -> bool:
+        return bool(await self.local_cache.sismember(self.ids_key, account_id))
+
+    async def are_used(self, account_ids: list[int]) -> list[bool]:
+        """
+        Same as is_used for many ids in one round trip
+        """
+        if not account_ids:
+            return []
+        return [bool(i) for i in await self.client.smismember(self.ids_key, account_ids)]
+
+    async def add(self, account_id: int, is_active: bool = True) -> bool:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.sadd(self.ids_key, account_id)
+            if is_active:
+                pipe.sadd(self.active_key, account_id)
+            await pipe.execute()
+        self.local_cache.invalidate([self.ids_key, self.active_key])
+        return True
+
+    async def add_many(self, account_ids: list[int], active_ids: list[int]) -> bool:
+        async with self.client.pipeline(transaction=True) as pipe:
+            for i in range(0, len(account_ids), self.batch_size):
+                pipe.sadd(self.ids_key, *account_ids[i:i + self.batch_size])
+            for i in range(0, len(active_ids), self.batch_size):
+                pipe.sadd(self.active_key, *active_ids[i:i + self.batch_size])
+            await pipe.execute()
+        self.local_cache.invalidate([self.ids_key, self.active_key])
+        return True
+
+    async def deactivate(self, account_id: int) -> bool:
+        await self.client.srem(self.active_key, account_id)
+        self.local_cache.invalidate([self.active_key])
+        return True
+
+    async def remove(self, account_id: int) -> bool:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.srem(self.ids_key, account_id)
+            pipe.srem(self.active_key, account_id)
+            await pipe.execute()
+        self.local_cache.invalidate([self.ids_key, self.active_key])
+        return True
+
+    async def rebuild(self, ids: Iterable[int], active_ids: Iterable[int]) -> bool:
+        """
+        Replaces both sets at once, readers never see a half-filled set
+        :param ids: every account id in postgres
+        :param active_ids: ids of the accounts with is_active=True
+        :return: bool - True if success
+        """
+        for key, values in ((self.ids_key, list(ids)), (self.active_key, list(active_ids))):
+            tmp_key = f'{key}:rebuild'
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.delete(tmp_key)
+                for i in range(0, len(values), self.batch_size):
+                    pipe.sadd(tmp_key, *values[i:i + self.batch_size])
+                if values:
+                    pipe.rename(tmp_key, key)
+                else:
+                    pipe.delete(key)
+                await pipe.execute()
+        await self.client.delete(self.rebuild_key)
+        self.local_cache.invalidate([self.ids_key, self.active_key])
+        return True
+
+    async def request_rebuild(self) -> bool:
+        await self.client.set(self.rebuild_key, 1)
+        return True
+
+    async def is_rebuild_requested(self) -> bool:
+        return bool(await self.client.exists(self.rebuild_key))
+
+
+account_registry = AccountRegistry()
@@ -1,11 +1,50 @@
+import time
+
 from redis import asyncio as redis
 
+from metrics import redis_command_seconds
 from settings import settings
 
-redis_client = redis.Redis(
+
+class ObservedPipeline(redis.client.Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        start = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            redis_command_seconds.observe(time.perf_counter() - start, 'PIPELINE')
+
+
+class ObservedRedis(redis.Redis):
+    """
+    Redis client that times every command by its name
+    """
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            redis_command_seconds.observe(time.perf_counter() - start, str(args[0]).upper())
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> ObservedPipeline:
+        return ObservedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+connection_kwargs = dict(
     host=settings.redis_host,
-    port=settings.redis_port,
+    port=int(settings.redis_port),
     db=0,
     decode_responses=True,
-    password=settings.redis_password
-)
\ No newline at end of file
+    password=settings.redis_password,
+    socket_connect_timeout=settings.redis_connect_timeout,
+)
+
+redis_pool = redis.BlockingConnectionPool(
+    **connection_kwargs,
+    socket_timeout=settings.redis_socket_timeout,
+    health_check_interval=settings.redis_health_check_interval,
+    max_connections=settings.redis_max_connections,
+    timeout=settings.redis_pool_timeout,
+)
+
+redis_client = ObservedRedis(connection_pool=redis_pool)
@@ -0,0 +1,144 @@
+import math
+import uuid
+
+from cache.cache_getter import redis_client
+from exceptions import ThrottledException
+from settings import settings
+
+# KEYS: window and lock key of every scope, ARGV: member, then limit and window ms of every scope.
+# Nothing is counted unless every scope lets the attempt through, gives the ms to wait or 0
+check_script = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local wait = 0
+for i = 1, #KEYS / 2 do
+    local window, lock = KEYS[2 * i - 1], KEYS[2 * i]
+    local limit, span = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+    wait = math.max(wait, redis.call('PTTL', lock))
+    redis.call('ZREMRANGEBYSCORE', window, '-inf', now - span)
+    if redis.call('ZCARD', window) >= limit then
+        local oldest = redis.call('ZRANGE', window, 0, 0, 'WITHSCORES')
+        wait = math.max(wait, tonumber(oldest[2]) + span - now)
+    end
+end
+if wait > 0 then
+    return wait
+end
+for i = 1, #KEYS / 2 do
+    redis.call('ZADD', KEYS[2 * i - 1], now, ARGV[1])
+    redis.call('PEXPIRE', KEYS[2 * i - 1], ARGV[2 * i + 1])
+end
+return 0
+"""
+
+# KEYS: failures and lock key of every scope, ARGV: lockout_after, base ms, max ms, failures ttl ms of every scope.
+# Past lockout_after failures the lock doubles with every failure, gives the longest lock in ms
+failure_script = """
+local longest = 0
+for i = 1, #KEYS / 2 do
+    local failures = redis.call('INCR', KEYS[2 * i - 1])
+    redis.call('PEXPIRE', KEYS[2 * i - 1], ARGV[4 * i])
+    local after = tonumber(ARGV[4 * i - 3])
+    if after > 0 and failures >= after then
+        local ttl = math.floor(math.min(tonumber(ARGV[4 * i - 2]) * 2 ^ (failures - after), tonumber(ARGV[4 * i - 1])))
+        redis.call('SET', KEYS[2 * i], 1, 'PX', ttl)
+        longest = math.max(longest, ttl)
+    end
+end
+return longest
+"""
+
+
+class Policy:
+    """
+    limit attempts per window seconds, after lockout_after failures in a row (0 - never) the scope is locked
+    """
+    def __init__(self, limit: int, window: float, lockout_after: int):
+        self.limit = limit
+        self.window = window
+        self.lockout_after = lockout_after
+
+
+class LoginThrottle:
+    """
+    Sliding window limits and exponential lockouts of password checks, by scope (email hash, client ip). \n
+    Every check is one script call, so all workers share the counters, and it is done before bcrypt runs
+    """
+    window_key = 'throttle:window:{scope}:{identity}'
+    lock_key = 'throttle:lock:{scope}:{identity}'
+    failures_key = 'throttle:failures:{scope}:{identity}'
+
+    def __init__(self, policies: dict[str, Policy], client=redis_client, lockout_base: float = 1,
+                 lockout_max: float = 900, failures_ttl: float = 900, enabled: bool = True):
+        self.policies = policies
+        self.client = client
+        self.lockout_base = lockout_base
+        self.lockout_max = lockout_max
+        self.failures_ttl = failures_ttl
+        self.enabled = enabled
+        self.check_script = client.register_script(check_script)
+        self.failure_script = client.register_script(failure_script)
+        self.rejected = 0
+
+    async def check(self, identities: dict[str, str]):
+        """
+        Counts an attempt
+        :param identities: scope -> identity, e.g. {'email': email_hash, 'ip': '10.0.0.1'}
+        :raise ThrottledException: with the seconds to wait, if any scope is over its limit or locked
+        """
+        if not self.enabled:
+            return
+        keys, args = [], [uuid.uuid4().hex]
+        for scope, identity in identities.items():
+            policy = self.policies[scope]
+            keys += [self.window_key.format(scope=scope, identity=identity),
+                     self.lock_key.format(scope=scope, identity=identity)]
+            args += [policy.limit, int(policy.window * 1000)]
+        if wait := await self.check_script(keys=keys, args=args):
+            self.rejected += 1
+            raise ThrottledException(retry_after=math.ceil(int(wait) / 1000))
+
+    async def failed(self, identities: dict[str, str]) -> float:
+        """
+        Counts a wrong password
+        :return: seconds of the longest lock it caused, 0 if none
+        """
+        if not self.enabled:
+            return 0
+        keys, args = [], []
+        for scope, identity in identities.items():
+            policy = self.policies[scope]
+            keys += [self.failures_key.format(scope=scope, identity=identity),
+                     self.lock_key.format(scope=scope, identity=identity)]
+            args += [policy.lockout_after, int(self.lockout_base * 1000), int(self.lockout_max * 1000),
+                     int(self.failures_ttl * 1000)]
+        return int(await self.failure_script(keys=keys, args=args)) / 1000
+
+    async def succeeded(self, identities: dict[str, str]):
+        """
+        Forgets the failures, the windows still count the attempt
+        """
+        if self.enabled:
+            await self.client.delete(*[self.failures_key.format(scope=scope, identity=identity)
+                                       for scope, identity in identities.items()])
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'rejected': self.rejected,
+            'policies': {scope: vars(policy) for scope, policy in self.policies.items()},
+        }
+
+
+login_throttle = LoginThrottle(
+    policies={
+        'email': Policy(limit=settings.login_email_limit, window=settings.login_email_window,
+                        lockout_after=settings.login_email_lockout_after),
+        'ip': Policy(limit=settings.login_ip_limit, window=settings.login_ip_window,
+                     lockout_after=settings.login_ip_lockout_after),
+    },
+    lockout_base=settings.login_lockout_base,
+    lockout_max=settings.login_lockout_max,
+    failures_ttl=settings.login_failures_ttl,
+    enabled=settings.login_throttle_enabled,
+)
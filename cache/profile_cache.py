@@ -0,0 +1,106 @@
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from cache.cache_getter import redis_client
+from metrics import Counter, registry
+from schemas import Profile
+from settings import settings
+
+profile_cache_requests = registry.register(Counter(
+    'profile_cache_requests_total', 'Profile lookups by where they were answered', ('result',)))
+
+
+class ProfileCache:
+    """
+    Decrypted profiles by account id, an in-process LRU with a short ttl in front of a redis copy. \n
+    Invalidation replaces the redis copy with an empty tombstone for tombstone_ttl, fills are SET NX,
+    so a fill that read the old row before the change can't put it back. Other workers may show
+    their local copy for up to local_ttl after a change
+    """
+    key = 'profile:{account_id}'
+    changed_key = 'profile_changed:{account_id}'
+    tombstone_ttl = 5
+
+    def __init__(self, client=redis_client, ttl: int = 300, local_ttl: float = 5, max_entries: int = 10000,
+                 enabled: bool = True):
+        self.client = client
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.entries: OrderedDict[int, tuple[float, Profile]] = OrderedDict()
+        self.epoch = 0
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def _remember(self, account_id: int, profile: Profile):
+        self.entries[account_id] = (time.monotonic() + self.local_ttl, profile)
+        self.entries.move_to_end(account_id)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get(self, account_id: int, load: Callable[[], Awaitable[Profile]]) -> Profile:
+        """
+        Gives the profile, on a miss calls load and stores what it gave
+        :param account_id: int
+        :param load: coroutine function, reads the profile from postgres
+        :return: Profile object
+        """
+        if not self.enabled:
+            return await load()
+        if (entry := self.entries.get(account_id)) is not None:
+            if entry[0] > time.monotonic():
+                self.entries.move_to_end(account_id)
+                self.local_hits += 1
+                profile_cache_requests.inc('local')
+                return entry[1]
+            del self.entries[account_id]
+        epoch = self.epoch
+        key = self.key.format(account_id=account_id)
+        if cached := await self.client.get(key):
+            profile = Profile.model_validate_json(cached)
+            self.redis_hits += 1
+            profile_cache_requests.inc('redis')
+        else:
+            profile = await load()
+            await self.client.set(key, profile.model_dump_json(), ex=self.ttl, nx=True)
+            self.misses += 1
+            profile_cache_requests.inc('miss')
+        if epoch == self.epoch:  # Nothing was invalidated in this worker while reading
+            self._remember(account_id, profile)
+        return profile
+
+    async def invalidate(self, account_id: int):
+        """
+        Call after the account was changed or deleted
+        """
+        self.epoch += 1
+        self.entries.pop(account_id, None)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.set(self.key.format(account_id=account_id), '', ex=self.tombstone_ttl)
+            pipe.set(self.changed_key.format(account_id=account_id), time.time(), ex=self.ttl)
+            await pipe.execute()
+
+    async def changed_at(self, account_id: int) -> float:
+        """
+        :return: float - time.time() of the last invalidate within ttl, 0 if there was none.
+            A replica that has a heartbeat from after it has the current row
+        """
+        return float(await self.client.get(self.changed_key.format(account_id=account_id)) or 0)
+
+    def stats(self) -> dict:
+        total = self.local_hits + self.redis_hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self.entries),
+            'local_hits': self.local_hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'hit_rate': (self.local_hits + self.redis_hits) / total if total else 0.0,
+        }
+
+
+profile_cache = ProfileCache(ttl=settings.profile_cache_ttl, local_ttl=settings.profile_cache_local_ttl,
+                             max_entries=settings.profile_cache_size)
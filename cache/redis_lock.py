@@ -0,0 +1,68 @@
+import asyncio
+import uuid
+
+from cache.cache_getter import redis_client
+
+release_script = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+extend_script = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class RedisLock:
+    """
+    Lock across workers: SET NX with a random token, so only the worker that holds it can release it.
+    If the holder dies, the lock expires after ttl, work that may take longer runs with keep_alive
+    """
+    def __init__(self, key: str, ttl: float, client=redis_client):
+        """
+        :param key: redis key of the lock
+        :param ttl: seconds the lock lives without the holder
+        :param client: redis client (Default=redis_client)
+        """
+        self.key = key
+        self.ttl = ttl
+        self.client = client
+        self.token = str(uuid.uuid4())
+
+    async def acquire(self) -> bool:
+        """
+        :return: bool - True if the lock was free and is now held
+        """
+        return bool(await self.client.set(self.key, self.token, nx=True, px=int(self.ttl * 1000)))
+
+    async def release(self) -> bool:
+        """
+        Deletes the lock if it is still this one, an expired lock taken by someone else stays
+        :return: bool - True if it was released
+        """
+        return bool(await self.client.eval(release_script, 1, self.key, self.token))
+
+    async def extend(self) -> bool:
+        """
+        Sets the ttl of the lock again if it is still this one
+        :return: bool - False if the lock expired and may be someone else's
+        """
+        return bool(await self.client.eval(extend_script, 1, self.key, self.token, int(self.ttl * 1000)))
+
+    async def keep_alive(self):
+        """
+        Extends the lock every third of ttl until cancelled, run it as a task next to the work
+        """
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                if not await self.extend():
+                    print(f'Lock {self.key} was lost')
+                    return
+            except Exception as exc:  # Redis blipped, the next try may still be in time
+                print(f'Lock {self.key} not extended ({exc!r})')
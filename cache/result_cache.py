@@ -0,0 +1,118 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from cache.cache_getter import redis_client
+from cache.redis_lock import RedisLock
+from cache.tracked_cache import tracked_cache
+from settings import settings
+
+
+class ResultCache:
+    """
+    Read-through cache of serialized responses. \n
+    Every table has a version counter, writers bump it, so old entries are never read again and just expire.
+    Only one caller per key runs fill at a time, in this process through a lock, across workers through RedisLock.
+    The filler keeps the lock alive while fill runs, waiters poll for the entry and take the lock over only
+    once it expires (the filler died), nobody fills without holding it
+    """
+    version_key = 'table_version:{table}'
+    bumped_key = 'table_bumped:{table}'
+    entry_key = 'result:{key}'
+    lock_key = 'result_lock:{key}'
+    poll_interval = 0.05
+
+    def __init__(self, client=redis_client, local_cache=tracked_cache, ttl: int = 300, lock_ttl: int = 10):
+        self.client = client
+        self.local_cache = local_cache
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.locks: dict[str, asyncio.Lock] = {}
+        self.lock_users: dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    async def version(self, table: str) -> int:
+        return int(await self.local_cache.get(self.version_key.format(table=table)) or 0)
+
+    async def bump(self, table: str) -> int:
+        """
+        Call after the write was committed, also records when, see bumped_at
+        """
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.incr(self.version_key.format(table=table))
+            pipe.set(self.bumped_key.format(table=table), time.time())
+            version, _ = await pipe.execute()
+        self.local_cache.invalidate([self.version_key.format(table=table)])
+        return version
+
+    async def bumped_at(self, table: str) -> float:
+        """
+        :return: float - time.time() of the last bump, 0 if there was none. A replica that has a heartbeat
+            from after it has the rows of the current version
+        """
+        return float(await self.client.get(self.bumped_key.format(table=table)) or 0)
+
+    async def _get(self, key: str) -> tuple[str, int | None] | None:
+        if entry := await self.client.hgetall(self.entry_key.format(key=key)):
+            return entry['body'], int(entry['next']) if entry['next'] else None
+        return None
+
+    async def _set(self, key: str, body: str, next_after_id: int | None):
+        entry_key = self.entry_key.format(key=key)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(entry_key, mapping={'body': body, 'next': '' if next_after_id is None else next_after_id})
+            pipe.expire(entry_key, self.ttl)
+            await pipe.execute()
+
+    async def get_or_fill(self, key: str,
+                          fill: Callable[[], Awaitable[tuple[str, int | None]]]) -> tuple[str, int | None]:
+        """
+        Gives cached body and next_after_id, on miss calls fill once and stores its result
+        :param key: cache key, must contain the table version
+        :param fill: coroutine function, returns body and next_after_id
+        :return: body and next_after_id
+        """
+        if (entry := await self._get(key)) is not None:
+            self.hits += 1
+            return entry
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        self.lock_users[key] = self.lock_users.get(key, 0) + 1
+        try:
+            async with lock:
+                if (entry := await self._get(key)) is not None:
+                    self.hits += 1
+                    return entry
+                self.misses += 1
+                redis_lock = RedisLock(self.lock_key.format(key=key), self.lock_ttl, client=self.client)
+                while not await redis_lock.acquire():
+                    self.waits += 1
+                    for _ in range(int(self.lock_ttl / self.poll_interval)):  # Another worker is filling it
+                        await asyncio.sleep(self.poll_interval)
+                        if (entry := await self._get(key)) is not None:
+                            return entry
+                keep_alive = asyncio.create_task(redis_lock.keep_alive())  # A fill may outlive lock_ttl
+                try:
+                    body, next_after_id = await fill()
+                    await self._set(key, body, next_after_id)
+                finally:
+                    keep_alive.cancel()
+                    await redis_lock.release()
+                return body, next_after_id
+        finally:
+            self.lock_users[key] -= 1
+            if not self.lock_users[key]:
+                del self.locks[key], self.lock_users[key]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'waits': self.waits,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+result_cache = ResultCache(ttl=settings.fetch_cache_ttl)
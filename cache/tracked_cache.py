@@ -0,0 +1,138 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from redis.asyncio import Connection
+
+from cache.cache_getter import redis_client, connection_kwargs
+
+
+class TrackedCache:
+    """
+    In-process copy of hot, rarely changing keys, kept correct by redis server-assisted client-side caching. \n
+    One connection subscribes to __redis__:invalidate, the other turns CLIENT TRACKING on in BCAST mode
+    for the prefixes and redirects it to the first one, so redis reports every change of those keys,
+    whoever made it. Until tracking is confirmed, or after any of the two connections failed, reads go to redis
+    """
+    channel = '__redis__:invalidate'
+    health_interval = 1
+
+    def __init__(self, client=redis_client, prefixes: tuple[str, ...] = (), max_entries: int = 100000):
+        self.client = client
+        self.prefixes = prefixes
+        self.max_entries = max_entries
+        self.entries: dict[str, dict] = {}
+        self.size = 0
+        self.epoch = 0
+        self.enabled = False
+        self.task = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def _read(self, key: str, field: Any, read: Callable[[], Awaitable]):
+        if not self.enabled or not key.startswith(self.prefixes):
+            return await read()
+        if field in (entry := self.entries.get(key, {})):
+            self.hits += 1
+            return entry[field]
+        self.misses += 1
+        epoch = self.epoch
+        value = await read()
+        if self.enabled and epoch == self.epoch:  # Nothing was invalidated while reading
+            if self.size >= self.max_entries:
+                self.flush()
+            self.entries.setdefault(key, {})[field] = value
+            self.size += 1
+        return value
+
+    async def get(self, key: str) -> str | None:
+        return await self._read(key, 'get', lambda: self.client.get(key))
+
+    async def sismember(self, key: str, member) -> bool:
+        return await self._read(key, ('sismember', str(member)), lambda: self.client.sismember(key, member))
+
+    def invalidate(self, keys: list[str] | None):
+        self.epoch += 1
+        self.invalidations += 1
+        if keys is None:  # Redis flushed or tracking was lost
+            self.flush()
+            return
+        for key in keys:
+            self.size -= len(self.entries.pop(key, {}))
+
+    def flush(self):
+        self.entries.clear()
+        self.size = 0
+
+    async def _listen(self):
+        listener = Connection(**connection_kwargs, socket_timeout=None)
+        tracker = Connection(**connection_kwargs)
+        try:
+            await listener.connect()
+            await listener.send_command('CLIENT', 'ID')
+            client_id = await listener.read_response()
+            await listener.send_command('SUBSCRIBE', self.channel)
+            await listener.read_response()
+
+            await tracker.connect()
+            prefixes = [arg for prefix in self.prefixes for arg in ('PREFIX', prefix)]
+            await tracker.send_command('CLIENT', 'TRACKING', 'ON', 'REDIRECT', client_id, 'BCAST', *prefixes)
+            await tracker.read_response()
+
+            self.enabled = True
+            unanswered_pings = 0
+            while unanswered_pings < 3:
+                message = await listener.read_response(timeout=self.health_interval)
+                if message is None:  # Quiet, make sure both connections are still there
+                    await listener.send_command('PING')
+                    await tracker.send_command('PING')
+                    await tracker.read_response()
+                    unanswered_pings += 1
+                elif message[0] == 'message' and message[1] == self.channel:
+                    self.invalidate(message[2])
+                elif message[0] == 'pong':
+                    unanswered_pings = 0
+            raise ConnectionError('Invalidation connection stopped answering')
+        finally:
+            self.enabled = False
+            self.invalidate(None)
+            await listener.disconnect()
+            await tracker.disconnect()
+
+    async def _run(self):
+        delay = 1
+        while True:
+            started = asyncio.get_running_loop().time()
+            try:
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                print(f'Redis client-side cache disabled: {exc!r}')
+            if asyncio.get_running_loop().time() - started > 60:
+                delay = 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+tracked_cache = TrackedCache(prefixes=('accounts:', 'table_version:'))
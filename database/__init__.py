@@ -1,9 +1,15 @@
-from database.orm_schemas import Accounts, VeryUnimportantData, UnimportantData, ImportantData
-from database.database_getter import get_db_session, get_db_session_cm, create_databases
-from database.repositories import (AccountsRepository,
+from database.orm_schemas import Accounts, VeryUnimportantData, UnimportantData, ImportantData, SCHEMA_VERSION
+from database.database_getter import (get_db_session, get_db_session_cm, get_lazy_session, get_read_session,
+                                      LazySession, create_databases, ping_postgres, get_schema_version,
+                                      set_schema_version, pool_stats,
+                                      session_router, ReadYourWritesMiddleware)
+from database.repositories import (AccountsRepository, DataRepository,
                                    VeryUnimportantDataRepository, UnimportantDataRepository, ImportantDataRepository,
                                    create_mock_data)
 
-__all__ = ['Accounts', 'VeryUnimportantData', 'UnimportantData', 'ImportantData',
-           'get_db_session', 'get_db_session_cm', 'create_databases', 'create_mock_data',
-           'AccountsRepository', 'VeryUnimportantDataRepository', 'UnimportantDataRepository', 'ImportantDataRepository']
\ No newline at end of file
+__all__ = ['Accounts', 'VeryUnimportantData', 'UnimportantData', 'ImportantData', 'SCHEMA_VERSION',
+           'get_db_session', 'get_db_session_cm', 'get_lazy_session', 'get_read_session', 'LazySession',
+           'create_databases', 'ping_postgres', 'get_schema_version', 'set_schema_version',
+           'create_mock_data', 'pool_stats', 'session_router', 'ReadYourWritesMiddleware',
+           'AccountsRepository', 'DataRepository',
+           'VeryUnimportantDataRepository', 'UnimportantDataRepository', 'ImportantDataRepository']
\ No newline at end of file
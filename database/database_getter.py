@@ -1,33 +1,363 @@
+import asyncio
+import math
+import time
+from collections import Counter
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy import event, exc, inspect, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.requests import Request
 
-from database.orm_schemas import Base
+from database.orm_schemas import Base, SchemaVersion, ReplicationHeartbeat
+from database.search import text_searches
 from settings import settings
 
 
-url = '{engine}://{user}:{password}@{host}:{port}/{db}'.format(
-    engine=settings.postgres_engine,
-    user=settings.postgres_user,
-    password=settings.postgres_password,
-    host=settings.postgres_host,
-    port=settings.postgres_port,
-    db=settings.postgres_db,
-)
-engine = create_async_engine(url)
+class ObservedPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that counts how long checkouts take and how many of them timed out
+    """
+    checkouts = 0
+    checkout_time = 0.0
+    max_checkout_time = 0.0
+    timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            ObservedPool.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            ObservedPool.checkouts += 1
+            ObservedPool.checkout_time += elapsed
+            ObservedPool.max_checkout_time = max(ObservedPool.max_checkout_time, elapsed)
+
+
+def database_url(host: str, port: str) -> str:
+    url = '{engine}://{user}:{password}@{host}:{port}/{db}'.format(
+        engine=settings.postgres_engine,
+        user=settings.postgres_user,
+        password=settings.postgres_password,
+        host=host,
+        port=port,
+        db=settings.postgres_db,
+    )
+    if settings.postgres_engine.endswith('asyncpg'):
+        url += f'?prepared_statement_cache_size={settings.db_statement_cache_size}'
+    return url
+
+def make_engine(url: str, poolclass=AsyncAdaptedQueuePool, **options) -> AsyncEngine:
+    """
+    Engine with the pool settings of the app
+    :param url: database url
+    :param poolclass: pool class (Default=AsyncAdaptedQueuePool), the primary uses ObservedPool
+    :param options: more create_async_engine arguments
+    """
+    return create_async_engine(
+        url,
+        poolclass=poolclass,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        **options,
+    )
+
+engine = make_engine(database_url(settings.postgres_host, settings.postgres_port), poolclass=ObservedPool)
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+# Same pool, but every transaction is started as READ ONLY, postgres refuses any write made through it
+read_only_engine = engine.execution_options(postgresql_readonly=True) \
+    if settings.postgres_engine.startswith('postgresql') else engine
+ReadOnlySessionLocal = async_sessionmaker(read_only_engine, expire_on_commit=False)
+
+
+class SessionRouter:
+    """
+    Decides where the read sessions go. Without a replica everything goes to the primary. \n
+    With one, reads go to the replica while it is at most max_lag seconds behind, and to the primary when it lags,
+    is down, or the client wrote in the last read_your_writes seconds (see ReadYourWritesMiddleware). \n
+    Lag is measured with a heartbeat: every check_interval the primary gets the current time in replication_heartbeat
+    and the replica is asked for it, lag is now minus what the replica has. It works the same for streaming
+    replication and for anything that copies the database, and reads up to check_interval above the real lag
+    """
+    cookie = 'primary_until'
+
+    def __init__(self, max_lag: float, check_interval: float, read_your_writes: float):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.read_your_writes = read_your_writes
+        self.replica_engine: AsyncEngine | None = None
+        self.ReplicaSessionLocal: async_sessionmaker | None = None
+        self.usable = False
+        self.lag: float | None = None
+        self.beat: float | None = None
+        self.checks = 0
+        self.failures = 0
+        self.routed = Counter()
+
+    def use_replica(self, replica_engine: AsyncEngine | None):
+        """
+        Sets the replica engine, None for no replica. Reads stay on the primary until the first check passes
+        """
+        self.replica_engine = replica_engine
+        self.ReplicaSessionLocal = None
+        self.usable = False
+        self.lag = None
+        self.beat = None
+        if replica_engine is None:
+            return
+        if replica_engine.dialect.name == 'postgresql':
+            replica_engine = replica_engine.execution_options(postgresql_readonly=True)
+        self.ReplicaSessionLocal = async_sessionmaker(replica_engine, expire_on_commit=False)
+
+        @event.listens_for(self.replica_engine.sync_engine, 'handle_error')
+        def replica_error(context):
+            if context.is_disconnect or isinstance(context.sqlalchemy_exception, exc.OperationalError):
+                self.usable = False  # Until the next check, reads go to the primary
+
+    def wrote(self, request: Request):
+        """
+        Sends the reads of this client to the primary for read_your_writes seconds, from this request on
+        """
+        if self.replica_engine is not None:
+            request.state.primary_until = time.time() + self.read_your_writes
+
+    def pinned(self, request: Request) -> bool:
+        """
+        :return: True if the client wrote recently, in this request or within the cookie's time
+        """
+        until = getattr(request.state, 'primary_until', None)
+        if until is None:
+            try:
+                until = float(request.cookies.get(self.cookie, 0))
+            except ValueError:
+                return False
+        return until > time.time()
+
+    def read_sessionmaker(self, replica: bool = True) -> async_sessionmaker:
+        """
+        :param replica: False for reads that must see the latest writes
+        :return: replica sessionmaker if it can be used, the read only one of the primary otherwise
+        """
+        if self.replica_engine is None:
+            return ReadOnlySessionLocal
+        if replica and self.usable:
+            self.routed['replica'] += 1
+            return self.ReplicaSessionLocal
+        self.routed['primary'] += 1
+        return ReadOnlySessionLocal
+
+    def caught_up(self, moment: float) -> bool:
+        """
+        The replica only moves forward, so once it showed a heartbeat written after moment, it has every write
+        committed before moment. Used by the cache fills, a body read from a replica that doesn't have the write
+        yet would be cached under the new version. The clocks of the workers are assumed to be in sync
+        :param moment: time.time() after a write was committed
+        :return: bool - True if the replica has the write, or there is no replica
+        """
+        return self.replica_engine is None or (self.beat is not None and self.beat >= moment)
+
+    async def check(self) -> bool:
+        """
+        Reads the heartbeat on the replica, then writes a new one on the primary
+        :return: bool - if the replica can be used
+        """
+        self.checks += 1
+        try:
+            async with self.replica_engine.connect() as conn:
+                beat = await asyncio.wait_for(
+                    conn.scalar(select(ReplicationHeartbeat.beat).where(ReplicationHeartbeat.id == 1)),
+                    timeout=max(self.check_interval, 1))
+            self.lag = time.time() - beat if beat is not None else None
+            self.beat = beat
+        except Exception:
+            self.failures += 1
+            self.lag = None
+        self.usable = self.lag is not None and self.lag <= self.max_lag
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.merge(ReplicationHeartbeat(id=1, beat=time.time()))
+                await session.commit()
+        except Exception:  # Without new heartbeats the lag grows, so reads move to the primary by themselves
+            pass
+        return self.usable
+
+    async def run(self):
+        """
+        Checks the replica every check_interval, for the background tasks
+        """
+        if self.replica_engine is None:
+            return
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+    def stats(self) -> dict:
+        if self.replica_engine is None:
+            return {'replica': False}
+        return {
+            'replica': True,
+            'usable': self.usable,
+            'lag_seconds': self.lag,
+            'max_lag_seconds': self.max_lag,
+            'checks': self.checks,
+            'failures': self.failures,
+            'replica_reads': self.routed['replica'],
+            'primary_reads': self.routed['primary'],
+            'checked_out': self.replica_engine.sync_engine.pool.checkedout(),
+        }
+
+
+session_router = SessionRouter(max_lag=settings.db_replica_max_lag,
+                               check_interval=settings.db_replica_check_interval,
+                               read_your_writes=settings.db_read_your_writes_seconds)
+if settings.postgres_replica_host:
+    session_router.use_replica(make_engine(database_url(settings.postgres_replica_host,
+                                                        settings.postgres_replica_port)))
+
 
-async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
+class ReadYourWritesMiddleware:
+    """
+    Plain ASGI middleware, a response to a request that wrote (SessionRouter.wrote) gets the primary_until cookie,
+    so the next reads of that client, e.g. get_name right after registration, go to the primary
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or session_router.replica_engine is None:
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start' \
+                    and (until := scope.get('state', {}).get('primary_until')) is not None:
+                cookie = (f'{session_router.cookie}={until:.3f}; Max-Age={math.ceil(session_router.read_your_writes)}; '
+                          f'Path=/; HttpOnly; SameSite=Lax')
+                message = {**message, 'headers': [*message['headers'], (b'set-cookie', cookie.encode('latin-1'))]}
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class LazySession:
+    """
+    Session for request handlers, nothing is opened until the handler asks for it. \n
+    Wrap only the repository work into `async with lazy_session as session:`, the connection goes back
+    to the pool on exit, so rendering and serialization don't hold it. Anything left open is closed after the response
+    """
+    def __init__(self, read_only: bool = False, replica: bool = False):
+        """
+        :param read_only: READ ONLY transactions (Default=False)
+        :param replica: read only sessions may go to the replica, see SessionRouter (Default=False)
+        """
+        self.read_only = read_only
+        self.replica = replica
+        self.session: AsyncSession | None = None
+
+    def get(self) -> AsyncSession:
+        """
+        Gives the session without releasing it on exit, for responses that keep reading from it (streams)
+        """
+        if self.session is None:
+            self.session = (session_router.read_sessionmaker(self.replica) if self.read_only
+                            else AsyncSessionLocal)()
+        return self.session
+
+    def use_primary(self):
+        """
+        The next sessions read from the primary, for reads that must see the latest writes
+        """
+        self.replica = False
+
+    async def release(self):
+        if self.session is not None:
+            await self.session.close()  # Rolls back whatever was not committed
+            self.session = None  # The next one is routed again
+
+    async def __aenter__(self) -> AsyncSession:
+        return self.get()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+
+
+async def get_db_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    session_router.wrote(request)
     async with AsyncSessionLocal() as session:
         yield session
 
+async def get_lazy_session(request: Request) -> AsyncGenerator[LazySession, None]:
+    session_router.wrote(request)
+    lazy_session = LazySession()
+    try:
+        yield lazy_session
+    finally:
+        await lazy_session.release()
+
+async def get_read_session(request: Request) -> AsyncGenerator[LazySession, None]:
+    lazy_session = LazySession(read_only=True, replica=not session_router.pinned(request))
+    try:
+        yield lazy_session
+    finally:
+        await lazy_session.release()
+
 @asynccontextmanager
 async def get_db_session_cm() -> AsyncSession:
     async with AsyncSessionLocal() as session:
         yield session
 
+def create_indexes(conn) -> None:
+    """
+    create_all skips the indexes of tables that already exist, so the ones added later are created here
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
 async def create_databases() -> bool:
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-        return True
\ No newline at end of file
+        await conn.run_sync(create_indexes)
+        for search in text_searches.values():
+            await conn.run_sync(search.create)
+        return True
+
+async def ping_postgres() -> bool:
+    async with engine.connect() as conn:
+        await conn.execute(text('SELECT 1'))
+        return True
+
+async def get_schema_version() -> int:
+    """
+    Gives the stored schema version, 0 if the database was never bootstrapped
+    """
+    async with engine.connect() as conn:
+        if not await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table(SchemaVersion.__tablename__)):
+            return 0
+        result = await conn.execute(select(SchemaVersion.version).where(SchemaVersion.id == 1))
+        return result.scalar() or 0
+
+async def set_schema_version(version: int) -> bool:
+    async with AsyncSessionLocal() as session:
+        await session.merge(SchemaVersion(id=1, version=version))
+        await session.commit()
+        return True
+
+def pool_stats() -> dict:
+    pool = engine.sync_engine.pool
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'checked_in': pool.checkedin(),
+        'overflow': max(pool.overflow(), 0),
+        'checkouts': ObservedPool.checkouts,
+        'timeouts': ObservedPool.timeouts,
+        'avg_checkout_seconds': ObservedPool.checkout_time / ObservedPool.checkouts if ObservedPool.checkouts else 0.0,
+        'max_checkout_seconds': ObservedPool.max_checkout_time,
+    }
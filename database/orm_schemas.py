@@ -1,14 +1,46 @@
-from datetime import datetime
+from datetime import datetime, date
 
-from sqlalchemy import BigInteger, String, Boolean, DateTime, Integer
+from sqlalchemy import BigInteger, String, Boolean, DateTime, Integer, Date, Float
 from sqlalchemy.orm import DeclarativeBase, Mapped
 from sqlalchemy.testing.schema import mapped_column
 
 
+# Bump it whenever the tables or the seed data change, the next startup will bootstrap the database again
+SCHEMA_VERSION = 5
+
+
 class Base(DeclarativeBase):
     pass
 
 
+class SchemaVersion(Base):
+    """
+    Single row, version of the schema and seed data the database was bootstrapped with
+    """
+    __tablename__ = 'schema_version'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer)
+
+    __table_args__ = {
+        'extend_existing': True
+    }
+
+
+class ReplicationHeartbeat(Base):
+    """
+    Single row, time of the last heartbeat the primary wrote, read on the replica to measure its lag
+    """
+    __tablename__ = 'replication_heartbeat'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    beat: Mapped[float] = mapped_column(Float)
+
+    __table_args__ = {
+        'extend_existing': True
+    }
+
+
 class VeryUnimportantData(Base):
     """
     Access_levels: 0 to read, 3 to write
@@ -30,7 +62,7 @@ class UnimportantData(Base):
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     text: Mapped[str] = mapped_column(String)
-    date: Mapped[datetime] = mapped_column(DateTime)
+    date: Mapped[datetime] = mapped_column(DateTime, index=True)
 
     __table_args__ = {
         'extend_existing': True
@@ -45,8 +77,25 @@ class ImportantData(Base):
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     text: Mapped[str] = mapped_column(String)
-    date: Mapped[datetime] = mapped_column(DateTime)
-    amount: Mapped[int] = mapped_column(Integer)
+    date: Mapped[datetime] = mapped_column(DateTime, index=True)
+    amount: Mapped[int] = mapped_column(Integer, index=True)
+
+    __table_args__ = {
+        'extend_existing': True
+    }
+
+
+class ImportantDataRollup(Base):
+    """
+    Count and sum of important_data.amount per day, week (from monday) and month, kept up to date on every write,
+    see database.rollups. Access_levels: the same as important_data
+    """
+    __tablename__ = 'important_data_rollups'
+
+    period: Mapped[str] = mapped_column(String(8), primary_key=True)
+    bucket: Mapped[date] = mapped_column(Date, primary_key=True)
+    rows: Mapped[int] = mapped_column(BigInteger)
+    total: Mapped[int] = mapped_column(BigInteger)
 
     __table_args__ = {
         'extend_existing': True
@@ -1,16 +1,24 @@
+import functools
 import hashlib
-import json
-from datetime import datetime
-
-import bcrypt
-from cryptography.fernet import Fernet
-from sqlalchemy import select, delete
+import operator
+from datetime import datetime, date
+from typing import AsyncIterator
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import select, delete, insert, Select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from cache import redis_client
-from database.orm_schemas import Accounts, VeryUnimportantData, ImportantData, UnimportantData, Base
+from cache import account_registry, result_cache, profile_cache
+from database.orm_schemas import Accounts, VeryUnimportantData, ImportantData, UnimportantData, ImportantDataRollup, Base
+from database.rollups import Rollup
+from database.search import text_searches, highlight
+from metrics import instrument_repository, serialization_seconds
 from exceptions import EmailTakenException, InputException, AccessException
-from schemas import AccountProcessed, Account, TokenDict, LoginInfo, UnimportantRow, ImportantRow, VeryUnimportantRow
+from security import password_hasher, field_cipher, token_cache
+from schemas import (AccountProcessed, Account, TokenDict, LoginInfo, UnimportantRow, ImportantRow, VeryUnimportantRow,
+                     RowQuery)
 from settings import settings
 
 
@@ -19,13 +27,43 @@ def check_access_level(method: str, access_level: int, access_levels: dict):
         raise AccessException(needed_level=access_levels[method], current_level=access_level)
 
 
+def paginate(query: Select, id_column, after_id: int | None = None, limit: int | None = None,
+             descending: bool = False) -> Select:
+    """
+    Keyset pagination, rows are ordered by id and start after after_id
+    :param query: select query
+    :param id_column: primary key column of the table
+    :param after_id: last id of the previous page (Default=None, from the start)
+    :param limit: rows per page (Default=None, all rows)
+    :param descending: from the highest id down (Default=False)
+    :return: Select object
+    """
+    if after_id is not None:
+        query = query.where(id_column < after_id if descending else id_column > after_id)
+    query = query.order_by(id_column.desc() if descending else id_column)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def as_dicts(keys, rows) -> list[dict]:
+    """
+    Turns row tuples into dicts, the only per-row work before the page is serialized
+    """
+    keys = tuple(keys)
+    return [dict(zip(keys, row)) for row in rows]
+
+
+@instrument_repository
 class AccountsRepository:
     access_levels = {'read': 4, 'write': 5}
     def __init__(self, session: AsyncSession):
         self.session = session
 
-    async def get_ids(self) -> list[int]:
+    async def get_ids(self, only_active: bool = False) -> list[int]:
         query = select(Accounts.id)
+        if only_active:
+            query = query.where(Accounts.is_active)
         result = await self.session.execute(query)
         ids = list(
             result.scalars().all()
@@ -33,14 +71,14 @@ class AccountsRepository:
 
         return ids if ids else []
 
-    async def update_redis(self, is_setup: bool = False) -> bool:
-        ids = await self.get_ids()
-        r = redis_client
-        await r.set('used_ids_postgres', json.dumps(ids))
-
-        if is_setup:
-            await r.set('used_ids_redis', json.dumps([]))
-
+    async def update_redis(self) -> bool:
+        """
+        Full rebuild of the account registry, does a table scan, so only call it on setup or when reconciling
+        """
+        await account_registry.rebuild(
+            ids=await self.get_ids(),
+            active_ids=await self.get_ids(only_active=True)
+        )
         return True
 
     async def get_account_by_id(self, account_id: int) -> AccountProcessed:
@@ -57,9 +95,8 @@ class AccountsRepository:
         query = select(Accounts).where(Accounts.email_hash==email_hash)
         result = await self.session.execute(query)
         for i in result.scalars().all():
-            if bcrypt.checkpw(login_info.password.encode(), i.password_hash.encode()):
-                f = Fernet(key=settings.access_level_secret)
-                access_level = f.decrypt(i.access_level_enc.encode()).decode()
+            if await password_hasher.check(login_info.password, i.password_hash):
+                access_level = field_cipher.decrypt('access_level', i.access_level_enc)
                 settings.print(f'Login successful for :{i.id}')
                 return TokenDict(
                     id=i.id,
@@ -85,21 +122,58 @@ class AccountsRepository:
         )
         self.session.add(account_db)
         await self.session.commit()
-        await self.update_redis()
+        await account_registry.add(account.id, is_active=account.is_active)
         settings.print(f'Created account {account.id}')
         return True
 
+    async def get_taken_email_hashes(self, email_hashes: list[str]) -> set[str]:
+        """
+        Gives those of email_hashes that already have an account, one query per 10000 hashes
+        :param email_hashes: list of str
+        :return: set of str
+        """
+        taken = set()
+        for i in range(0, len(email_hashes), 10000):
+            query = select(Accounts.email_hash).where(Accounts.email_hash.in_(email_hashes[i:i + 10000]))
+            result = await self.session.execute(query)
+            taken.update(result.scalars().all())
+        return taken
+
+    async def create_accounts(self, accounts: list[AccountProcessed]) -> set[int]:
+        """
+        Inserts accounts with one multi-row insert (split into pages by the driver) and one commit,
+        then updates the account registry once. Rows whose email or id got taken in between are skipped,
+        emails should be checked with get_taken_email_hashes before
+        :param accounts: list of AccountProcessed objects
+        :return: set of int - ids of the inserted accounts
+        """
+        if not accounts:
+            return set()
+        dialect = (await self.session.connection()).dialect.name
+        statement = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(Accounts)
+        result = await self.session.execute(statement.on_conflict_do_nothing().returning(Accounts.id),
+                                            [i.model_dump() for i in accounts])
+        created = set(result.scalars().all())
+        await self.session.commit()
+        await account_registry.add_many(
+            account_ids=[i.id for i in accounts if i.id in created],
+            active_ids=[i.id for i in accounts if i.id in created and i.is_active]
+        )
+        settings.print(f'Created {len(created)} accounts')
+        return created
+
     async def update_account(self, account: Account, account_processed: AccountProcessed, token_dict: TokenDict) -> bool:
         query = select(Accounts).where(Accounts.id==token_dict.id)
         result = await self.session.execute(query)
         for i in result.scalars().all():
-            if bcrypt.checkpw(account.password.encode(), i.password_hash.encode()):
+            if await password_hasher.check(account.password, i.password_hash):
                 i.username_enc=account_processed.username_enc
                 i.name_enc=account_processed.name_enc
                 i.email_enc=account_processed.email_enc
                 i.email_hash=account_processed.email_hash
 
                 await self.session.commit()
+                await profile_cache.invalidate(i.id)
                 settings.print(f'Updated account, id:{i.id}')
                 return True
         return False
@@ -109,77 +183,221 @@ class AccountsRepository:
         query = select(Accounts).where(Accounts.email_hash==email_hash)
         result = await self.session.execute(query)
         for i in result.scalars().all():
-            if bcrypt.checkpw(login_info.password.encode(), i.password_hash.encode()):
+            if await password_hasher.check(login_info.password, i.password_hash):
                 if soft:
                     i.is_active=False
                 else:
                     query = delete(Accounts).where(Accounts.id==i.id)
                     await self.session.execute(query)
                 await self.session.commit()
+                if soft:
+                    await account_registry.deactivate(i.id)
+                else:
+                    await account_registry.remove(i.id)
+                token_cache.evict_account(i.id)
+                await profile_cache.invalidate(i.id)
                 settings.print(f'Deleted account, id:{i.id}, soft={soft}')
                 return True
         return False
 
-    async def get_all(self, access_level: int = 5) -> list[AccountProcessed]:
+    async def get_all(self, access_level: int = 5,
+                      after_id: int | None = None, limit: int | None = None,
+                      query: RowQuery | None = None) -> list[AccountProcessed]:
         check_access_level('read', access_level, self.access_levels)
-        query = select(Accounts)
+        if query is not None:  # Every column but id is encrypted or hashed, there is nothing to filter in SQL
+            raise InputException(invalid_field='filter')
+        query = paginate(select(Accounts), Accounts.id, after_id, limit)
         result = await self.session.execute(query)
         result = list(result.scalars().all())
-        return [AccountProcessed.model_validate(i) for i in result]
+        with serialization_seconds.time('pydantic_validate'):
+            return [AccountProcessed.model_validate(i) for i in result]
 
-# I know that they have the same functions, but I've decided not to work on that because it's all mockdata
-class VeryUnimportantDataRepository:
-    access_levels = {'read':0, 'write':3}
-    def __init__(self, session: AsyncSession):
-        self.session = session
-
-    async def get_all(self, access_level: int = 5) -> list[VeryUnimportantRow]:
+    async def stream(self, access_level: int = 5, after_id: int | None = None,
+                     query: RowQuery | None = None) -> AsyncIterator[AccountProcessed]:
         check_access_level('read', access_level, self.access_levels)
-        query = select(VeryUnimportantData)
+        if query is not None:
+            raise InputException(invalid_field='filter')
+        query = paginate(select(Accounts), Accounts.id, after_id)
+        result = await self.session.stream_scalars(query.execution_options(yield_per=settings.stream_batch_size))
+        return (AccountProcessed.model_validate(i) async for i in result)
+
+    async def rotate_keys(self, after_id: int, batch_size: int) -> int | None:
+        """
+        Re-encrypts the next batch of accounts with the primary keys, rows are locked until commit
+        :param after_id: last id of the previous batch
+        :param batch_size: int
+        :return: last id of this batch, None if there are no accounts left
+        """
+        query = select(Accounts).where(Accounts.id > after_id).order_by(Accounts.id).limit(batch_size).with_for_update()
         result = await self.session.execute(query)
         result = list(result.scalars().all())
-        return [VeryUnimportantRow.model_validate(i) for i in result]
-
-    async def add_all(self, objects: list[VeryUnimportantData]) -> bool:
-        self.session.add_all(objects)
+        changed = [i.id for i in result if field_cipher.rotate_row(i)]
         await self.session.commit()
-        return True
+        settings.print(f'Rotated keys of {len(changed)} accounts')
+        return result[-1].id if result else None
+
+operators = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'lt': operator.lt,
+    'le': operator.le,
+    'gt': operator.gt,
+    'ge': operator.ge,
+    'prefix': lambda column, value: column.startswith(value, autoescape=True),
+}
+
+
+@functools.cache
+def column_adapter(annotation) -> TypeAdapter:
+    return TypeAdapter(annotation)
+
+
+class DataRepository:
+    """
+    Reads and writes of a data table. A subclass sets model (ORM class), row (TypedDict of the columns it gives),
+    table and access_levels, and is decorated with instrument_repository. \n
+    Filters, ordering, projection and limits of a RowQuery go into the SQL, so only the asked rows leave the database
+    """
+    model: type[Base]
+    row: type
+    table: str
+    access_levels: dict[str, int]
+    rollup: Rollup | None = None
 
-
-class UnimportantDataRepository:
-    access_levels = {'read': 1, 'write': 3}
     def __init__(self, session: AsyncSession):
         self.session = session
 
-    async def get_all(self, access_level: int = 5) -> list[UnimportantRow]:
+    def build_select(self, query: RowQuery | None = None,
+                     after_id: int | None = None, limit: int | None = None) -> Select:
+        """
+        :param query: RowQuery object (Default=None, all columns by id)
+        :param after_id: last id of the previous page, only when ordered by id
+        :param limit: rows per page (Default=None, all rows)
+        :return: Select object
+        :raise InputException: for unknown columns, wrong values or operators, after_id with another ordering
+        """
+        query = query or RowQuery()
+        fields = self.row.__annotations__
+        columns = self.model.__table__.c
+        names = list(fields) if query.columns is None else ['id'] + [i for i in dict.fromkeys(query.columns) if i != 'id']
+        if any(name not in fields for name in names):
+            raise InputException(invalid_field='columns')
+        statement = select(*[columns[name] for name in names])
+        for condition in query.filters:
+            if condition.column not in fields or (condition.op == 'prefix' and fields[condition.column] is not str):
+                raise InputException(invalid_field='filter')
+            try:
+                value = column_adapter(fields[condition.column]).validate_python(condition.value)
+            except ValidationError:
+                raise InputException(invalid_field='filter')
+            statement = statement.where(operators[condition.op](columns[condition.column], value))
+        if query.order_by not in fields:
+            raise InputException(invalid_field='order')
+        if query.order_by == 'id':
+            return paginate(statement, columns.id, after_id, limit, query.descending)
+        if after_id is not None:  # Keyset pages need the ordering column to be the id
+            raise InputException(invalid_field='after_id')
+        order = [columns[query.order_by], columns.id]  # id breaks the ties, so the order is stable
+        statement = statement.order_by(*[i.desc() if query.descending else i for i in order])
+        return statement.limit(limit) if limit is not None else statement
+
+    async def get_all(self, access_level: int = 5, after_id: int | None = None, limit: int | None = None,
+                      query: RowQuery | None = None) -> list[dict]:
         check_access_level('read', access_level, self.access_levels)
-        query = select(UnimportantData)
-        result = await self.session.execute(query)
-        result = list(result.scalars().all())
-        return [UnimportantRow.model_validate(i) for i in result]
+        result = await self.session.execute(self.build_select(query, after_id, limit))
+        with serialization_seconds.time('row_dicts'):
+            return as_dicts(result.keys(), result.all())
 
-    async def add_all(self, objects: list[UnimportantData]) -> bool:
+    async def stream(self, access_level: int = 5, after_id: int | None = None,
+                     query: RowQuery | None = None) -> AsyncIterator[dict]:
+        check_access_level('read', access_level, self.access_levels)
+        statement = self.build_select(query, after_id)
+        result = await self.session.stream(statement.execution_options(yield_per=settings.stream_batch_size))
+        keys = tuple(result.keys())
+        return (dict(zip(keys, row)) async for row in result)
+
+    async def search(self, terms: str, access_level: int = 5, limit: int = 20, offset: int = 0) -> list[dict]:
+        """
+        Full-text search over the text column, best matches first
+        :param terms: what the user typed
+        :param access_level: int
+        :param limit: rows per page
+        :param offset: rows to skip
+        :return: list of dicts, the row columns with rank and highlight (html, matches in <mark>)
+        """
+        check_access_level('read', access_level, self.access_levels)
+        dialect = (await self.session.connection()).dialect.name
+        search = text_searches[self.table]
+        result = await self.session.execute(search.select(dialect, list(self.row.__annotations__)), {
+            'terms': search.terms(dialect, terms), 'limit': limit, 'offset': offset})
+        rows = as_dicts(result.keys(), result.all())
+        for row in rows:
+            row['highlight'] = highlight(row['highlight'] or '')
+        return rows
+
+    async def add_all(self, objects: list) -> bool:
         self.session.add_all(objects)
+        if self.rollup is not None:
+            await self.rollup.add(await self.session.connection(),
+                                  [(getattr(i, self.rollup.date_column), getattr(i, self.rollup.value_column))
+                                   for i in objects])
         await self.session.commit()
+        await result_cache.bump(self.table)
         return True
 
+    async def aggregate(self, period: str, access_level: int = 5,
+                        start: date | None = None, end: date | None = None) -> list[dict]:
+        """
+        Count, total and average per bucket, read from the rollup, not from the table
+        :param period: day, week or month
+        :param access_level: int
+        :param start: first bucket (Default=None, from the oldest), any date inside it works
+        :param end: buckets before this date (Default=None, up to the newest)
+        :return: list of dicts with bucket, rows, total and average
+        """
+        check_access_level('read', access_level, self.access_levels)
+        if self.rollup is None:
+            raise InputException(invalid_field='repository_name')
+        result = await self.session.execute(self.rollup.select(period, start, end))
+        return [{'bucket': bucket, 'rows': rows, 'total': total, 'average': total / rows}
+                for bucket, rows, total in result.all()]
+
+    async def rebuild_rollup(self) -> int:
+        """
+        Recounts the rollup from the whole table, a table scan, so only on bootstrap or to reconcile
+        :return: int - rows counted
+        """
+        if self.rollup is None:
+            return 0
+        counted = await self.rollup.rebuild(await self.session.connection())
+        await self.session.commit()
+        settings.print(f'Rebuilt the rollup of {self.table} from {counted} rows')
+        return counted
 
-class ImportantDataRepository:
-    access_levels = {'read': 2, 'write': 3}
-    def __init__(self, session: AsyncSession):
-        self.session = session
 
-    async def get_all(self, access_level: int = 5) -> list[ImportantRow]:
-        check_access_level('read', access_level, self.access_levels)
-        query = select(ImportantData)
-        result = await self.session.execute(query)
-        result = list(result.scalars().all())
-        return [ImportantRow.model_validate(i) for i in result]
+@instrument_repository
+class VeryUnimportantDataRepository(DataRepository):
+    model = VeryUnimportantData
+    row = VeryUnimportantRow
+    table = VeryUnimportantData.__tablename__
+    access_levels = {'read': 0, 'write': 3}
 
-    async def add_all(self, objects: list[ImportantData]) -> bool:
-        self.session.add_all(objects)
-        await self.session.commit()
-        return True
+
+@instrument_repository
+class UnimportantDataRepository(DataRepository):
+    model = UnimportantData
+    row = UnimportantRow
+    table = UnimportantData.__tablename__
+    access_levels = {'read': 1, 'write': 3}
+
+
+@instrument_repository
+class ImportantDataRepository(DataRepository):
+    model = ImportantData
+    row = ImportantRow
+    table = ImportantData.__tablename__
+    access_levels = {'read': 2, 'write': 3}
+    rollup = Rollup(ImportantDataRollup, ImportantData, date_column='date', value_column='amount')
 
 poem = """There will come soft rains and the smell of the ground
 And swallows circling with their shimmering sound
@@ -221,5 +439,5 @@ async def create_mock_data(session: AsyncSession):
               unimportant_data,
               important_data]
     for repo, objects in zip(repos, datas):
-        if await repo.get_all() == []:
+        if await repo.get_all(limit=1) == []:
           await repo.add_all(objects)
\ No newline at end of file
@@ -0,0 +1,106 @@
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+from typing import Iterable
+
+from sqlalchemy import select, delete, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from exceptions import InputException
+from settings import settings
+
+
+def day(moment: datetime) -> date:
+    return moment.date()
+
+def week(moment: datetime) -> date:
+    return moment.date() - timedelta(days=moment.weekday())
+
+def month(moment: datetime) -> date:
+    return moment.date().replace(day=1)
+
+periods = {'day': day, 'week': week, 'month': month}
+
+
+class Rollup:
+    """
+    Count and sum of a value column per time bucket of a date column, in a table keyed by (period, bucket). \n
+    Every write adds its rows to the buckets in the same transaction (an upsert per touched bucket), so reads are
+    a range scan of a few thousand rows at most, however big the source table is. rebuild recounts everything
+    """
+    def __init__(self, table, source, date_column: str, value_column: str):
+        self.table = table
+        self.source = source
+        self.date_column = date_column
+        self.value_column = value_column
+
+    @staticmethod
+    def buckets(rows: Iterable[tuple[datetime, int]],
+                buckets: dict | None = None) -> dict[tuple[str, date], list[int]]:
+        """
+        :param rows: date and value of every row, rows without a date are not counted
+        :param buckets: result of an earlier call to add to (Default=None, a new one)
+        :return: (period, bucket) -> [rows, total]
+        """
+        buckets = buckets if buckets is not None else defaultdict(lambda: [0, 0])
+        for moment, value in rows:
+            if moment is None:
+                continue
+            for period, truncate in periods.items():
+                bucket = buckets[period, truncate(moment)]
+                bucket[0] += 1
+                bucket[1] += value or 0
+        return buckets
+
+    async def _upsert(self, conn: AsyncConnection, buckets: dict):
+        statement = (postgresql.insert if conn.dialect.name == 'postgresql' else sqlite.insert)(self.table)
+        statement = statement.on_conflict_do_update(
+            index_elements=['period', 'bucket'],
+            set_={'rows': self.table.rows + statement.excluded.rows,
+                  'total': self.table.total + statement.excluded.total},
+        )
+        await conn.execute(statement, [{'period': period, 'bucket': bucket, 'rows': count, 'total': total}
+                                       for (period, bucket), (count, total) in buckets.items()])
+
+    async def add(self, conn: AsyncConnection, rows: Iterable[tuple[datetime, int]]):
+        """
+        Adds rows to their buckets, call it in the transaction that writes them
+        :param conn: AsyncConnection object, session.connection() for a session
+        :param rows: date and value of every new row
+        """
+        if buckets := self.buckets(rows):
+            await self._upsert(conn, buckets)
+
+    async def rebuild(self, conn: AsyncConnection) -> int:
+        """
+        Recounts every bucket from the source table, for the first start and for rows written around add
+        :return: int - rows counted
+        """
+        if conn.dialect.name == 'postgresql':  # Writers wait until the transaction ends, so no row is counted twice
+            await conn.execute(text(f'LOCK TABLE {self.source.__tablename__} IN SHARE MODE'))
+        query = select(self.source.__table__.c[self.date_column], self.source.__table__.c[self.value_column])
+        result = await conn.stream(query.execution_options(yield_per=settings.stream_batch_size))
+        buckets = None
+        async for partition in result.partitions():
+            buckets = self.buckets(partition, buckets)
+        await conn.execute(delete(self.table))
+        if buckets:
+            await self._upsert(conn, buckets)
+        return sum(value[0] for key, value in (buckets or {}).items() if key[0] == 'day')
+
+    def select(self, period: str, start: date | None = None, end: date | None = None):
+        """
+        :param period: day, week or month
+        :param start: first bucket (Default=None, from the oldest), any date inside it works
+        :param end: buckets before this date (Default=None, up to the newest)
+        :return: Select object of bucket, rows and total, ordered by bucket
+        :raise InputException: for an unknown period
+        """
+        if period not in periods:
+            raise InputException(invalid_field='period')
+        query = select(self.table.bucket, self.table.rows, self.table.total).where(self.table.period == period)
+        if start is not None:
+            query = query.where(self.table.bucket >= periods[period](datetime.combine(start, datetime.min.time())))
+        if end is not None:
+            query = query.where(self.table.bucket < end)
+        return query.order_by(self.table.bucket)
@@ -0,0 +1,100 @@
+import html
+import re
+
+from sqlalchemy import text, column, Float, String, TextClause
+from sqlalchemy.engine import Connection
+
+from database.orm_schemas import VeryUnimportantData, UnimportantData, ImportantData
+from exceptions import InputException
+
+# Highlight markers the database puts around the matches, the text is escaped before they become <mark> tags
+start_mark, stop_mark = '\x02', '\x03'
+
+
+def highlight(fragment: str) -> str:
+    return html.escape(fragment).replace(start_mark, '<mark>').replace(stop_mark, '</mark>')
+
+
+class TextSearch:
+    """
+    Full-text search over the text column of a data table, ranked, highlighted, a page at a time. \n
+    Postgres: stored generated tsvector column with a GIN index, websearch_to_tsquery, ts_rank_cd and ts_headline.
+    Sqlite (the benchmark stand-in): external content FTS5 table kept up to date by triggers, bm25 and snippet
+    """
+    column = 'text_search'
+    config = 'english'
+
+    def __init__(self, model):
+        self.model = model
+        self.table = model.__tablename__
+        self.fts_table = f'{self.table}_search'
+
+    def create(self, conn: Connection):
+        """
+        Adds what the search needs to an existing table, safe to run again. Runs through run_sync in create_databases
+        """
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text(
+                f'ALTER TABLE {self.table} ADD COLUMN IF NOT EXISTS {self.column} tsvector '
+                f"GENERATED ALWAYS AS (to_tsvector('{self.config}', coalesce(text, ''))) STORED"))
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{self.table}_{self.column} '
+                              f'ON {self.table} USING GIN ({self.column})'))
+            return
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': self.fts_table}).first()
+        conn.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.fts_table} USING fts5("
+                          f"text, content='{self.table}', content_rowid='id', tokenize='porter unicode61')"))
+        conn.execute(text(f'CREATE TRIGGER IF NOT EXISTS {self.fts_table}_insert AFTER INSERT ON {self.table} BEGIN '
+                          f'INSERT INTO {self.fts_table}(rowid, text) VALUES (new.id, new.text); END'))
+        conn.execute(text(f'CREATE TRIGGER IF NOT EXISTS {self.fts_table}_delete AFTER DELETE ON {self.table} BEGIN '
+                          f"INSERT INTO {self.fts_table}({self.fts_table}, rowid, text) "
+                          f"VALUES ('delete', old.id, old.text); END"))
+        conn.execute(text(f'CREATE TRIGGER IF NOT EXISTS {self.fts_table}_update AFTER UPDATE OF text ON {self.table} '
+                          f"BEGIN INSERT INTO {self.fts_table}({self.fts_table}, rowid, text) "
+                          f"VALUES ('delete', old.id, old.text); "
+                          f'INSERT INTO {self.fts_table}(rowid, text) VALUES (new.id, new.text); END'))
+        if exists is None:  # Rows written before the index existed
+            conn.execute(text(f"INSERT INTO {self.fts_table}({self.fts_table}) VALUES ('rebuild')"))
+
+    def select(self, dialect: str, names: list[str]) -> TextClause:
+        """
+        :param dialect: name of the dialect of the session
+        :param names: columns of the row, in their order
+        :return: TextClause with :terms, :limit and :offset binds, gives the columns, rank and highlight
+        """
+        columns = ', '.join(f'd.{name}' for name in names)
+        if dialect == 'postgresql':
+            # Only the page gets a headline, ts_headline parses the whole text
+            statement = text(
+                f"SELECT {columns}, page.rank, ts_headline('{self.config}', d.text, page.query, :options) AS highlight "
+                f'FROM (SELECT id, ts_rank_cd({self.column}, query) AS rank, query '
+                f"FROM {self.table}, websearch_to_tsquery('{self.config}', :terms) query "
+                f'WHERE {self.column} @@ query ORDER BY rank DESC, id LIMIT :limit OFFSET :offset) page '
+                f'JOIN {self.table} d ON d.id = page.id ORDER BY page.rank DESC, d.id'
+            ).bindparams(options=f'StartSel={start_mark}, StopSel={stop_mark}, MaxFragments=2, MaxWords=24, '
+                                 f'MinWords=8')
+        else:
+            statement = text(
+                f'SELECT {columns}, -bm25({self.fts_table}) AS rank, '
+                f"snippet({self.fts_table}, 0, :start_mark, :stop_mark, '…', 24) AS highlight "
+                f'FROM {self.fts_table} JOIN {self.table} d ON d.id = {self.fts_table}.rowid '
+                f'WHERE {self.fts_table} MATCH :terms ORDER BY bm25({self.fts_table}), d.id '
+                f'LIMIT :limit OFFSET :offset'
+            ).bindparams(start_mark=start_mark, stop_mark=stop_mark)
+        return statement.columns(*[self.model.__table__.c[name] for name in names],
+                                 column('rank', Float), column('highlight', String))
+
+    @staticmethod
+    def terms(dialect: str, query: str) -> str:
+        """
+        What the user typed, as the database's query syntax. Postgres parses it itself (websearch_to_tsquery),
+        for FTS5 every word is quoted, so no input is a syntax error
+        :raise InputException: if there are no words
+        """
+        words = re.findall(r'\w+', query)
+        if not words:
+            raise InputException(invalid_field='q')
+        return query if dialect == 'postgresql' else ' '.join(f'"{word}"' for word in words)
+
+
+text_searches = {model.__tablename__: TextSearch(model)
+                 for model in (VeryUnimportantData, UnimportantData, ImportantData)}
@@ -0,0 +1,219 @@
+"""
+Synthetic data for load and capacity testing, millions of rows in every table. \n
+The same --seed gives the same rows (Fernet tokens and bcrypt salts are random by design, their plaintext is not).
+Rows are written in batches through postgres COPY in one transaction per table, memory stays at about one batch,
+the important_data rollup is updated with every batch.
+Seeded accounts log in with email user<id>@seed.example and password seed-password-<id>,
+or seed-password for all of them with --precomputed-hash. \n
+Run with: python -m database.seeder --rows 1000000 --accounts 10000 --seed 42
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import AsyncIterator
+
+import bcrypt
+from sqlalchemy import func, insert, select
+
+from cache import account_registry, result_cache
+from database import database_getter
+from database.orm_schemas import Accounts
+from database.repositories import (AccountsRepository, VeryUnimportantDataRepository, UnimportantDataRepository,
+                                   ImportantDataRepository, poem)
+from security import field_cipher
+
+vocabulary = sorted({word.lower() for line in poem for word in line.split()} | {
+    'report', 'order', 'invoice', 'delivery', 'customer', 'payment', 'region', 'quarter', 'update', 'review',
+    'pending', 'approved', 'shipment', 'warehouse', 'contract', 'budget', 'forecast', 'account', 'balance', 'note',
+})
+first_names = ['Anna', 'Boris', 'Vera', 'Gleb', 'Daria', 'Egor', 'Zoya', 'Ivan', 'Kira', 'Lev',
+               'Maria', 'Nikita', 'Olga', 'Pavel', 'Roman', 'Sofia', 'Timur', 'Ulyana', 'Fedor', 'Yana']
+last_names = ['Ivanov', 'Smirnov', 'Kuznetsov', 'Popov', 'Vasiliev', 'Petrov', 'Sokolov', 'Mikhailov',
+              'Novikov', 'Fedorov', 'Morozov', 'Volkov', 'Alekseev', 'Lebedev', 'Semenov', 'Egorov']
+seeded_password = 'seed-password'
+first_account_id = 1111112  # Above generate_id range, so seeded accounts don't slow down id generation
+
+
+class RowGenerator:
+    """
+    Deterministic rows, every table gets its own random.Random derived from the seed
+    """
+    def __init__(self, seed: int, table: str, end_date: datetime, years: float):
+        self.rng = random.Random(f'{seed}:{table}')
+        self.end_date = end_date
+        self.span_seconds = years * 365 * 24 * 60 * 60
+
+    def text(self) -> str:
+        words = min(max(int(self.rng.lognormvariate(math.log(12), 0.6)), 1), 120)
+        return ' '.join(self.rng.choices(vocabulary, k=words)).capitalize()
+
+    def date(self) -> datetime:
+        """
+        Newer rows are more frequent (the table grows), working hours and weekdays more than nights and weekends
+        """
+        while True:
+            age = self.span_seconds * (1 - math.sqrt(self.rng.random()))
+            date = self.end_date - timedelta(seconds=age)
+            if date.weekday() < 5 or self.rng.random() < 0.3:
+                break
+        hour = min(max(self.rng.gauss(14, 3.5), 0), 23.99)
+        return date.replace(hour=int(hour), minute=int(hour % 1 * 60), second=self.rng.randrange(60), microsecond=0)
+
+    def amount(self) -> int:
+        return min(int(self.rng.lognormvariate(4, 1.2)) + 1, 10_000_000)
+
+    def account(self, account_id: int) -> tuple:
+        first, last = self.rng.choice(first_names), self.rng.choice(last_names)
+        username = f'{first.lower()}{account_id}'
+        access_level = self.rng.choices((1, 2, 3), weights=(85, 12, 3))[0]
+        is_active = self.rng.random() < 0.97
+        return (account_id, username, f'{first} {last}', f'user{account_id}@seed.example',
+                access_level, is_active, f'{seeded_password}-{account_id}')
+
+
+def _account_rows(rows: list[tuple], password_hash: str | None, rounds: int) -> list[tuple]:
+    """
+    Runs in worker processes: encrypts and hashes a chunk of accounts, gives rows in Accounts column order
+    """
+    result = []
+    for account_id, username, full_name, email, access_level, is_active, password in rows:
+        result.append((
+            account_id,
+            field_cipher.encrypt('access_level', str(access_level)),
+            field_cipher.encrypt('username', username),
+            field_cipher.encrypt('email', email),
+            field_cipher.encrypt('name', full_name.title()),
+            password_hash or bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode(),
+            hashlib.sha256(email.lower().encode()).hexdigest(),
+            is_active,
+        ))
+    return result
+
+
+async def copy_rows(conn, table, columns: list[str], batches: AsyncIterator[list[tuple]]) -> int:
+    """
+    Writes batches with COPY on asyncpg, with a multi-row insert on other drivers
+    :return: int - rows written
+    """
+    raw = (await conn.get_raw_connection()).driver_connection
+    written = 0
+    started = time.perf_counter()
+    async for rows in batches:
+        if hasattr(raw, 'copy_records_to_table'):
+            await raw.copy_records_to_table(table.__tablename__, records=rows, columns=columns)
+        else:
+            await conn.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+        written += len(rows)
+        print(f'{table.__tablename__}: {written} rows, {written / (time.perf_counter() - started):.0f} rows/s')
+    return written
+
+
+async def next_id(conn, table, minimum: int = 0) -> int:
+    return max((await conn.scalar(select(func.max(table.id)))) or 0, minimum - 1) + 1
+
+
+async def seed_table(repository, count: int, args) -> int:
+    table = repository.model
+    generator = RowGenerator(args.seed, table.__tablename__, args.end_date, args.years)
+    columns = [column.name for column in table.__table__.columns]
+
+    async with database_getter.engine.connect() as conn:
+        start_id = await next_id(conn, table)
+
+        async def batches():
+            for offset in range(0, count, args.batch_size):
+                rows = []
+                for i in range(start_id + offset, start_id + min(offset + args.batch_size, count)):
+                    values = {'id': i, 'text': generator.text()}
+                    if 'date' in columns:
+                        values['date'] = generator.date()
+                    if 'amount' in columns:
+                        values['amount'] = generator.amount()
+                    rows.append(tuple(values[column] for column in columns))
+                if repository.rollup is not None:  # Same transaction as the rows
+                    date_index = columns.index(repository.rollup.date_column)
+                    value_index = columns.index(repository.rollup.value_column)
+                    await repository.rollup.add(conn, [(row[date_index], row[value_index]) for row in rows])
+                yield rows
+
+        written = await copy_rows(conn, table, columns, batches())
+        await conn.commit()
+    return written
+
+
+async def seed_accounts(count: int, args) -> int:
+    generator = RowGenerator(args.seed, Accounts.__tablename__, args.end_date, args.years)
+    columns = ['id', 'access_level_enc', 'username_enc', 'email_enc', 'name_enc',
+               'password_hash', 'email_hash', 'is_active']
+    password_hash = bcrypt.hashpw(seeded_password.encode(), bcrypt.gensalt(args.bcrypt_rounds)).decode() \
+        if args.precomputed_hash else None
+    loop = asyncio.get_running_loop()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        async with database_getter.engine.connect() as conn:
+            start_id = await next_id(conn, Accounts, minimum=first_account_id)
+
+            async def batches():
+                chunk_size = max(args.batch_size // (args.workers * 4), 1)
+                for offset in range(0, count, args.batch_size):
+                    plain = [generator.account(i) for i in
+                             range(start_id + offset, start_id + min(offset + args.batch_size, count))]
+                    chunks = await asyncio.gather(*[
+                        loop.run_in_executor(executor, _account_rows, plain[i:i + chunk_size],
+                                             password_hash, args.bcrypt_rounds)
+                        for i in range(0, len(plain), chunk_size)
+                    ])
+                    yield [row for chunk in chunks for row in chunk]
+
+            written = await copy_rows(conn, Accounts, columns, batches())
+            await conn.commit()
+    return written
+
+
+async def main(args):
+    await database_getter.create_databases()
+    tables = {'very_unimportant_data': VeryUnimportantDataRepository,
+              'unimportant_data': UnimportantDataRepository,
+              'important_data': ImportantDataRepository}
+    for name in args.tables:
+        if name == 'accounts':
+            await seed_accounts(args.accounts, args)
+            try:
+                async with database_getter.get_db_session_cm() as session:
+                    await AccountsRepository(session).update_redis()
+            except Exception as exc:
+                await account_registry.request_rebuild()
+                print(f'Account registry not rebuilt ({exc!r}), requested a rebuild')
+        else:
+            await seed_table(tables[name], args.rows, args)
+            await result_cache.bump(name)
+    await database_getter.engine.dispose()
+
+
+def parse_args(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog='python -m database.seeder', description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=1_000_000, help='rows in every data table')
+    parser.add_argument('--accounts', type=int, default=10_000)
+    parser.add_argument('--tables', type=lambda text: text.split(','),
+                        default=['very_unimportant_data', 'unimportant_data', 'important_data', 'accounts'],
+                        help='comma separated, default: all')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=10_000, help='rows per COPY')
+    parser.add_argument('--end-date', type=datetime.fromisoformat, default=datetime(2026, 1, 1),
+                        help='newest date, fixed so the rows do not depend on the day of the run')
+    parser.add_argument('--years', type=float, default=5, help='how far back the dates go')
+    parser.add_argument('--precomputed-hash', action='store_true',
+                        help='one bcrypt hash for every account instead of one per account')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
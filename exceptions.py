@@ -62,6 +62,21 @@ class EmailTakenException(Exception):
         super().__init__(self.message)
 
 
+class HasherBusyException(Exception):
+    """Too many passwords are waiting to be hashed"""
+    def __init__(self):
+        self.message = 'The server is busy, please, try again later'
+        super().__init__(self.message)
+
+
+class ThrottledException(Exception):
+    """Too many login attempts for this email or from this address"""
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        self.message = f'Too many attempts, please, try again in {retry_after} seconds'
+        super().__init__(self.message)
+
+
 def init_exception_handlers(app):
     @app.exception_handler(EmailTakenException)
     async def handle_email_exc(request: Request, exc: EmailTakenException):
@@ -81,3 +96,17 @@ def init_exception_handlers(app):
             status_code=400,
             content={"detail": str(exc)},
         )
+    @app.exception_handler(HasherBusyException)
+    async def handle_hasher_busy_exc(request: Request, exc: HasherBusyException):
+        return JSONResponse(
+            status_code=503,
+            content={"detail": str(exc)},
+            headers={"Retry-After": "1"},
+        )
+    @app.exception_handler(ThrottledException)
+    async def handle_throttled_exc(request: Request, exc: ThrottledException):
+        return JSONResponse(
+            status_code=429,
+            content={"detail": str(exc)},
+            headers={"Retry-After": str(exc.retry_after)},
+        )
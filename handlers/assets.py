@@ -0,0 +1,94 @@
+import hashlib
+import mimetypes
+import os
+
+from starlette.requests import Request
+from starlette.responses import Response, PlainTextResponse
+from starlette.templating import Jinja2Templates
+
+from handlers.compression import encodings, choose_encoding, compress, is_compressible, tag
+from settings import settings
+
+
+def not_modified(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    return any(value.strip().removeprefix('W/') in (etag, '*') for value in if_none_match.split(','))
+
+
+class Asset:
+    """
+    A body that never changes while the app runs, kept with its strong ETag and compressed copies,
+    compressed once with the highest ratio
+    """
+    def __init__(self, body: bytes, media_type: str, cache_control: str):
+        self.body = body
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self.encoded: dict[str, bytes] = {}
+        if is_compressible(media_type) and len(body) >= settings.compression_min_size:
+            for encoding in encodings:
+                if len(encoded := compress(body, encoding, best=True)) < len(body):
+                    self.encoded[encoding] = encoded
+
+    def response(self, request: Request) -> Response:
+        headers = {'ETag': self.etag, 'Cache-Control': self.cache_control}
+        if self.encoded:
+            headers['Vary'] = 'Accept-Encoding'
+        if not_modified(request.headers.get('if-none-match'), self.etag):
+            return Response(status_code=304, headers=headers)
+        encoding = choose_encoding(request.headers.get('accept-encoding', ''), tuple(self.encoded))
+        if encoding is None:
+            return Response(content=self.body, media_type=self.media_type, headers=headers)
+        headers.update({'ETag': tag(self.etag, encoding), 'Content-Encoding': encoding})
+        return Response(content=self.encoded[encoding], media_type=self.media_type, headers=headers)
+
+
+class Pages:
+    """
+    The one jinja environment of the app. Every template is compiled and rendered at startup,
+    they don't use the request, so a page view is a dict lookup. A template that needs per-request
+    context should go through templates.TemplateResponse instead
+    """
+    def __init__(self, directory: str):
+        self.templates = Jinja2Templates(directory=directory)
+        self.pages = {
+            name: Asset(self.templates.get_template(name).render().encode(), 'text/html; charset=utf-8',
+                        'private, no-cache')
+            for name in self.templates.env.list_templates()
+        }
+
+    def response(self, request: Request, name: str) -> Response:
+        return self.pages[name].response(request)
+
+
+class StaticAssets:
+    """
+    ASGI app for a directory of static files, they are read once at startup and served from memory
+    """
+    def __init__(self, directory: str, cache_control: str = 'public, max-age=86400'):
+        self.assets: dict[str, Asset] = {}
+        for root, _, files in os.walk(directory):
+            for file in files:
+                path = os.path.join(root, file)
+                with open(path, 'rb') as f:
+                    body = f.read()
+                media_type = mimetypes.guess_type(file)[0] or 'application/octet-stream'
+                self.assets[os.path.relpath(path, directory).replace(os.sep, '/')] = Asset(body, media_type,
+                                                                                           cache_control)
+
+    async def __call__(self, scope, receive, send):
+        root_path = scope.get('root_path', '')
+        path = scope['path'][len(root_path):] if scope['path'].startswith(root_path) else scope['path']
+        if scope['method'] not in ('GET', 'HEAD'):
+            response = PlainTextResponse('Method Not Allowed', status_code=405)
+        elif (asset := self.assets.get(path.lstrip('/'))) is None:
+            response = PlainTextResponse('Not Found', status_code=404)
+        else:
+            response = asset.response(Request(scope))
+        await response(scope, receive, send)
+
+
+pages = Pages(directory='frontend')
+static_assets = StaticAssets(directory='static')
@@ -4,77 +4,75 @@ from fastapi import APIRouter, Depends
 from fastapi.responses import Response
 from fastapi.requests import Request
 from fastapi.responses import RedirectResponse
-from fastapi.templating import Jinja2Templates
 from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db_session, AccountsRepository
-from exceptions import AccessException, InputException
+from database import get_db_session, get_lazy_session, get_read_session, LazySession
+from exceptions import AccessException, InputException, LoginExpiredException, LoginInvalidException
+from handlers.assets import pages
 from schemas import TokenDict, Account, LoginInfo, AdminCreatedAccount
-from service import login, unprocess_account,  get_token_dict, register, delete, update, account_to_login_info, get_account
+from service import (login, get_token_dict, give_temp_token, register, delete, update,
+                     account_to_login_info, get_profile, validate_account, read_accounts_csv, register_many)
 from settings import settings
 
 
 router = APIRouter(prefix='/auth', tags=['auth'])
-frontend = Jinja2Templates(directory='frontend')
 
 @router.get("/")
-async def index_auth(request: Request,
-                     session: AsyncSession = Depends(get_db_session)) -> Response:
-    response = frontend.TemplateResponse(
-        'auth.html',
-        {'request': request}
-    )
+async def index_auth(request: Request) -> Response:
+    response = pages.response(request, 'auth.html')
     token_dict = await check_login_cookies(response=response, request=request)
     if token_dict.access_level:
-        account = await AccountsRepository(session).get_account_by_id(token_dict.id)
-        account = unprocess_account(account)
-        print('Hello', account.name)
+        settings.print(f'Hello, user {token_dict.id}')
     else:
-        print(f'Hello, temp user {token_dict.id}')
+        settings.print(f'Hello, temp user {token_dict.id}')
 
     return response
 
 
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else 'unknown'
+
+
 async def check_login_cookies(request: Request, response: Response = None) -> TokenDict:
     if access_token := request.cookies.get('access_token'):
         return await get_token_dict(access_token=access_token)
-    elif temp_id := request.cookies.get('temp_id'):
-        return await get_token_dict(temp_id=temp_id)
-    else:
-        temp_id = str(uuid.uuid4())
+    if temp_token := request.cookies.get('temp_token'):
+        try:
+            return await get_token_dict(temp_token=temp_token)
+        except (LoginExpiredException, LoginInvalidException):
+            pass  # Give a new one below
+    temp_id = str(uuid.uuid4())
+    temp_token = give_temp_token(temp_id)
+    if response is not None:
         response.set_cookie(
-            key='temp_id',
-            value=temp_id,
-            max_age=60 * 60 * 24,
+            key='temp_token',
+            value=temp_token,
+            max_age=settings.temp_user_ttl,
+            httponly=True,
             samesite='lax'
         )
-        settings.print(f'Created temp user {temp_id}')
-        return await get_token_dict(temp_id=temp_id)
+    settings.print(f'Created temp user {temp_id}')
+    return await get_token_dict(temp_token=temp_token)
 
 
 @router.post('/register')
-async def register_user(account: Account,
+async def register_user(account: Account, request: Request,
                         session: AsyncSession = Depends(get_db_session)) -> RedirectResponse:
-    if len(account.password) < 8:
-        raise InputException(invalid_field='Password is too short, needs at least 8 characters')
-    if len(account.username) < 3:
-        raise InputException(invalid_field='Username is too short, needs at least 3 characters')
-    if len(account.email) < 6 or not '@' in account.email or not '.' in account.email:
-        raise InputException(invalid_field='Enter valid email address')
-
+    validate_account(account)
     await register(account, session)
     settings.print(f'Registered user {account.username}')
     return await login_user(
         login_info=account_to_login_info(account),
+        request=request,
         session=session
     )
 
 
 @router.post('/login')
-async def login_user(login_info: LoginInfo,
+async def login_user(login_info: LoginInfo, request: Request,
                      session: AsyncSession = Depends(get_db_session)) -> RedirectResponse:
-    jwt = await login(login_info, session)
+    jwt = await login(login_info, session, client_ip=client_ip(request))
     response = RedirectResponse(url='/', status_code=303)
     response.set_cookie(
         key='access_token',
@@ -93,10 +91,10 @@ async def logout_user(request: Request) -> RedirectResponse:
         return response
 
 @router.post('/delete')
-async def delete_user(login_info: LoginInfo,
+async def delete_user(login_info: LoginInfo, request: Request,
                       session: AsyncSession = Depends(get_db_session)) -> RedirectResponse:
-    await delete(login_info, session, soft=True)
-    return await logout_user()
+    await delete(login_info, session, soft=True, client_ip=client_ip(request))
+    return await logout_user(request)
 
 @router.post('/update')
 async def update_user(account: Account, request: Request,
@@ -109,20 +107,20 @@ async def update_user(account: Account, request: Request,
             session=session,
             token_dict=token_dict
         )
-        await logout_user()
         return await login_user(
             login_info=account_to_login_info(account),
+            request=request,
             session=session
         )
     raise AccessException(needed_level=1, current_level=token_dict.access_level)
 
 @router.get('/get_name')
 async def get_user_name(request: Request,
-                        session: AsyncSession = Depends(get_db_session)) -> JSONResponse:
+                        lazy_session: LazySession = Depends(get_read_session)) -> JSONResponse:
     token_dict = await check_login_cookies(request=request)
     if token_dict.access_level > 0:
-        account = await get_account(account_id=token_dict.id, session=session)
-        message = account.name
+        profile = await get_profile(account_id=token_dict.id, lazy_session=lazy_session)
+        message = profile.name
     else:
         message = 'Temp user'
     return JSONResponse(status_code=200, content={'name': message})
@@ -130,21 +128,51 @@ async def get_user_name(request: Request,
 @router.post('/admin_create')
 async def admin_create_account(request: Request,
                                account: AdminCreatedAccount,
-                               session: AsyncSession = Depends(get_db_session)) -> JSONResponse:
+                               lazy_session: LazySession = Depends(get_lazy_session)) -> JSONResponse:
     token_dict = await check_login_cookies(request=request)
     if token_dict.access_level >= 4:
-        await register(account=account.account, session=session, access_level=account.access_level)
+        async with lazy_session as session:
+            await register(account=account.account, session=session, access_level=account.access_level)
         return JSONResponse(status_code=200, content={'message': 'Account created'})
     else:
         raise AccessException(needed_level=4, current_level=token_dict.access_level)
 
+@router.post('/admin_create_batch')
+async def admin_create_accounts(request: Request,
+                                accounts: list[AdminCreatedAccount],
+                                lazy_session: LazySession = Depends(get_lazy_session)) -> JSONResponse:
+    token_dict = await check_login_cookies(request=request)
+    if token_dict.access_level >= 4:
+        report = await register_many(accounts=accounts, lazy_session=lazy_session)
+        return JSONResponse(status_code=200, content=report)
+    else:
+        raise AccessException(needed_level=4, current_level=token_dict.access_level)
+
+@router.post('/admin_create_csv')
+async def admin_create_accounts_csv(request: Request,
+                                    lazy_session: LazySession = Depends(get_lazy_session)) -> JSONResponse:
+    """
+    Same as admin_create_batch, the body is a csv file: username,name,surname,email,password,access_level
+    """
+    token_dict = await check_login_cookies(request=request)
+    if token_dict.access_level >= 4:
+        try:
+            text = (await request.body()).decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise InputException(invalid_field='csv encoding, use utf-8')
+        report = await register_many(accounts=read_accounts_csv(text), lazy_session=lazy_session)
+        return JSONResponse(status_code=200, content=report)
+    else:
+        raise AccessException(needed_level=4, current_level=token_dict.access_level)
+
 @router.post('/admin_delete')
 async def admin_delete_account(request: Request,
                                login_info: LoginInfo,
-                               session: AsyncSession = Depends(get_db_session)) -> JSONResponse:
+                               lazy_session: LazySession = Depends(get_lazy_session)) -> JSONResponse:
     token_dict = await check_login_cookies(request=request)
     if token_dict.access_level >= 4:
-        await delete(login_info=login_info, session=session, soft=False)
+        async with lazy_session as session:
+            await delete(login_info=login_info, session=session, soft=False, client_ip=client_ip(request))
         return JSONResponse(status_code=200, content={'message': 'Account deleted'})
     else:
         raise AccessException(needed_level=4, current_level=token_dict.access_level)
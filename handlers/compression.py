@@ -0,0 +1,212 @@
+import zlib
+from collections import OrderedDict
+
+from starlette.datastructures import MutableHeaders
+
+from settings import settings
+
+try:
+    import brotli
+except ImportError:  # br is only offered when the brotli extra is installed
+    brotli = None
+
+encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+compressible_types = ('text/', 'application/json', 'application/x-ndjson', 'application/javascript',
+                      'image/svg+xml', 'image/x-icon', 'image/vnd.microsoft.icon')
+
+
+def is_compressible(media_type: str) -> bool:
+    return media_type.startswith(compressible_types)
+
+
+def choose_encoding(accept_encoding: str, offered=encodings) -> str | None:
+    """
+    Picks the first of offered that the Accept-Encoding header allows, offered is in the order of preference
+    :param accept_encoding: header value, e.g. 'gzip, deflate, br;q=0.9'
+    :param offered: encodings that can be sent
+    :return: encoding or None for identity
+    """
+    accepted, refused = set(), set()
+    for item in accept_encoding.lower().split(','):
+        name, _, params = item.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            refused.add(name.strip())
+        else:
+            accepted.add(name.strip())
+    for encoding in offered:
+        if encoding in accepted or ('*' in accepted and encoding not in refused):
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    """
+    :param best: highest ratio, for bodies that are compressed once and sent many times
+    """
+    if encoding == 'br':
+        return brotli.compress(body, quality=11 if best else settings.compression_brotli_quality)
+    level = 9 if best else settings.compression_gzip_level
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 - gzip container
+    return compressor.compress(body) + compressor.flush()
+
+
+class StreamCompressor:
+    """
+    Compresses a body sent in parts, every part is flushed, so a stream of rows is not held back
+    """
+    def __init__(self, encoding: str):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=settings.compression_brotli_quality)
+            self.process, self.flush, self.finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            compressor = zlib.compressobj(settings.compression_gzip_level, zlib.DEFLATED, 31)
+            self.process, self.finish = compressor.compress, compressor.flush
+            self.flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def compress(self, chunk: bytes, last: bool) -> bytes:
+        return self.process(chunk) + (self.finish() if last else self.flush())
+
+
+def tag(etag: str, encoding: str) -> str:
+    """
+    ETag of the compressed representation, '"abc"' with br is '"abc-br"', strong etags must differ per encoding
+    """
+    return f'{etag[:-1]}-{encoding}"' if etag.endswith('"') else etag
+
+
+def untag(if_none_match: str) -> tuple[str, str | None]:
+    """
+    Reverse of tag for an If-None-Match header, the handlers compare it with their own etags
+    :return: header without the suffixes and the encoding that was stripped
+    """
+    stripped = None
+    values = []
+    for value in if_none_match.split(','):
+        value = value.strip()
+        for encoding in encodings:
+            if value.endswith(f'-{encoding}"'):
+                value = value[:-len(encoding) - 2] + '"'
+                stripped = encoding
+                break
+        values.append(value)
+    return ', '.join(values), stripped
+
+
+class CompressedBodies:
+    """
+    LRU of compressed bodies by path, etag and encoding, so a cached fetch_data page is compressed once
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[tuple, bytes] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> bytes | None:
+        if (body := self.entries.get(key)) is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+        return body
+
+    def put(self, key: tuple, body: bytes):
+        if len(body) > self.max_bytes // 8:
+            return
+        self.entries[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            self.size -= len(self.entries.popitem(last=False)[1])
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+compressed_bodies = CompressedBodies(max_bytes=settings.compression_cache_bytes)
+
+
+class CompressionMiddleware:
+    """
+    Plain ASGI middleware, gzip or br by Accept-Encoding for compressible responses of at least minimum_size.
+    Responses that already have a Content-Encoding (the precompressed pages) pass as they are. \n
+    ETags get the encoding suffix, If-None-Match loses it before the handlers see it, and gets it back on a 304
+    """
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        accept_encoding, if_none_match = '', None
+        for name, value in scope['headers']:
+            if name == b'accept-encoding':
+                accept_encoding = value.decode('latin-1')
+            elif name == b'if-none-match':
+                if_none_match = value.decode('latin-1')
+        encoding = choose_encoding(accept_encoding) if accept_encoding else None
+        stripped = None
+        if if_none_match is not None:
+            untagged, stripped = untag(if_none_match)
+            if stripped is not None:
+                scope = {**scope, 'headers': [(name, value) for name, value in scope['headers']
+                                              if name != b'if-none-match'] + [(b'if-none-match', untagged.encode())]}
+        if encoding is None and stripped is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        compressor = None
+
+        async def send_wrapper(message):
+            nonlocal start, compressor
+            if message['type'] == 'http.response.start':
+                start = message
+                return
+            if message['type'] != 'http.response.body':
+                return await send(message)
+            if compressor is not None:
+                last = not message.get('more_body', False)
+                return await send({'type': 'http.response.body', 'more_body': not last,
+                                   'body': compressor.compress(message.get('body', b''), last)})
+            if start is None:
+                return await send(message)
+            response_start, start = start, None
+            headers = MutableHeaders(raw=list(response_start['headers']))
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if response_start['status'] == 304:
+                if stripped is not None and 'etag' in headers:
+                    headers['etag'] = tag(headers['etag'], stripped)
+            elif (encoding is not None and response_start['status'] == 200 and 'content-encoding' not in headers
+                  and is_compressible(headers.get('content-type', ''))
+                  and (more_body or len(body) >= self.minimum_size)):
+                headers.add_vary_header('Accept-Encoding')
+                headers['content-encoding'] = encoding
+                etag = headers.get('etag')
+                if etag is not None:
+                    headers['etag'] = tag(etag, encoding)
+                if more_body:
+                    del headers['content-length']
+                    compressor = StreamCompressor(encoding)
+                    body = compressor.compress(body, False)
+                else:
+                    key = (scope['path'], scope.get('query_string', b''), etag, encoding)
+                    compressed = compressed_bodies.get(key) if etag is not None else None
+                    if compressed is None:
+                        compressed = compress(body, encoding)
+                        if etag is not None:
+                            compressed_bodies.put(key, compressed)
+                    body = compressed
+                    headers['content-length'] = str(len(body))
+            await send({**response_start, 'headers': headers.raw})
+            await send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+
+        await self.app(scope, receive, send_wrapper)
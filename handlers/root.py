@@ -1,21 +1,39 @@
-from fastapi import APIRouter
+import asyncio
+import secrets
+
+from fastapi import APIRouter, Depends
 from fastapi.requests import Request
-from fastapi.responses import FileResponse, Response
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import Response, JSONResponse, PlainTextResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from cache import redis_client
+from database import pool_stats, ping_postgres, get_db_session, ImportantDataRepository, session_router
 from database.repositories import check_access_level
 from exceptions import AccessException
+from handlers.assets import pages, static_assets
 from handlers.auth import check_login_cookies
+from handlers.compression import compressed_bodies
+from cache import result_cache, tracked_cache, login_throttle, profile_cache
+from security import password_hasher, token_cache
+from metrics import Gauge, registry, profiler
+from service import startup
+from settings import settings
 
 router = APIRouter(tags=['root'])
-frontend = Jinja2Templates(directory='frontend')
+
+registry.register(Gauge('db_pool_connections', 'Connections of the postgres pool by state', lambda: {
+    ('checked_out',): (stats := pool_stats())['checked_out'], ('checked_in',): stats['checked_in'],
+    ('overflow',): stats['overflow']}, ('state',)))
+registry.register(Gauge('db_replica_lag_seconds', 'How far the read replica is behind the primary',
+                        lambda: {} if session_router.lag is None else {(): session_router.lag}))
+registry.register(Gauge('bcrypt_queue_depth', 'Hashes waiting for a worker',
+                        lambda: {(): password_hasher.stats()['queue_depth']}))
+registry.register(Gauge('token_cache_entries', 'Verified tokens in the cache',
+                        lambda: {(): token_cache.stats()['size']}))
 
 @router.get('/')
 async def index(request: Request):
-    response = frontend.TemplateResponse(
-        'index.html',
-        {'request': request},
-    )
+    response = pages.response(request, 'index.html')
     await check_login_cookies(request=request, response=response)
     return response
 
@@ -23,14 +41,155 @@ async def index(request: Request):
 async def index_admin(request: Request):
     token_dict = await check_login_cookies(request=request)
     if token_dict.access_level >= 4:
-        response = frontend.TemplateResponse(
-            'admin.html',
-            {'request': request},
-        )
-        return response
+        return pages.response(request, 'admin.html')
+    else:
+        raise AccessException(needed_level=4, current_level=token_dict.access_level)
+
+@router.get('/admin/hasher_stats')
+async def hasher_stats(request: Request) -> JSONResponse:
+    token_dict = await check_login_cookies(request=request)
+    if token_dict.access_level >= 4:
+        return JSONResponse(status_code=200, content=password_hasher.stats())
+    else:
+        raise AccessException(needed_level=4, current_level=token_dict.access_level)
+
+@router.get('/admin/fetch_cache_stats')
+async def fetch_cache_stats(request: Request) -> JSONResponse:
+    token_dict = await check_login_cookies(request=request)
+    if token_dict.access_level >= 4:
+        return JSONResponse(status_code=200, content={**result_cache.stats(), 'local': tracked_cache.stats()})
+    else:
+        raise AccessException(needed_level=4, current_level=token_dict.access_level)
+
+@router.get('/admin/db_pool_stats')
+async def db_pool_stats(request: Request) -> JSONResponse:
+    token_dict = await check_login_cookies(request=request)
+    if token_dict.access_level >= 4:
+        return JSONResponse(status_code=200, content=pool_stats())
+    else:
+        raise AccessException(needed_level=4, current_level=token_dict.access_level)
+
+@router.get('/admin/db_replica_stats')
+async def db_replica_stats(request: Request) -> JSONResponse:
+    token_dict = await check_login_cookies(request=request)
+    if token_dict.access_level >= 4:
+        return JSONResponse(status_code=200, content=session_router.stats())
+    else:
+        raise AccessException(needed_level=4, current_level=token_dict.access_level)
+
+@router.get('/admin/token_cache_stats')
+async def token_cache_stats(request: Request) -> JSONResponse:
+    token_dict = await check_login_cookies(request=request)
+    if token_dict.access_level >= 4:
+        return JSONResponse(status_code=200, content=token_cache.stats())
+    else:
+        raise AccessException(needed_level=4, current_level=token_dict.access_level)
+
+@router.get('/admin/login_throttle_stats')
+async def login_throttle_stats(request: Request) -> JSONResponse:
+    token_dict = await check_login_cookies(request=request)
+    if token_dict.access_level >= 4:
+        return JSONResponse(status_code=200, content=login_throttle.stats())
+    else:
+        raise AccessException(needed_level=4, current_level=token_dict.access_level)
+
+@router.get('/admin/compression_stats')
+async def compression_stats(request: Request) -> JSONResponse:
+    token_dict = await check_login_cookies(request=request)
+    if token_dict.access_level >= 4:
+        return JSONResponse(status_code=200, content=compressed_bodies.stats())
     else:
         raise AccessException(needed_level=4, current_level=token_dict.access_level)
 
+@router.get('/admin/profile_cache_stats')
+async def profile_cache_stats(request: Request) -> JSONResponse:
+    token_dict = await check_login_cookies(request=request)
+    if token_dict.access_level >= 4:
+        return JSONResponse(status_code=200, content=profile_cache.stats())
+    else:
+        raise AccessException(needed_level=4, current_level=token_dict.access_level)
+
+@router.post('/admin/rebuild_rollups')
+async def rebuild_rollups(request: Request, session: AsyncSession = Depends(get_db_session)) -> JSONResponse:
+    """
+    Recounts the important_data rollup from the table, for rows that were written around the repository
+    """
+    token_dict = await check_login_cookies(request=request)
+    if token_dict.access_level >= 4:
+        counted = await ImportantDataRepository(session).rebuild_rollup()
+        return JSONResponse(status_code=200, content={'important_data': counted})
+    else:
+        raise AccessException(needed_level=4, current_level=token_dict.access_level)
+
+@router.get('/admin/profiles')
+async def profiles(request: Request) -> JSONResponse:
+    """
+    Profiler settings and the kept captures, newest first
+    """
+    token_dict = await check_login_cookies(request=request)
+    if token_dict.access_level >= 4:
+        return JSONResponse(status_code=200, content=profiler.stats())
+    else:
+        raise AccessException(needed_level=4, current_level=token_dict.access_level)
+
+@router.get('/admin/profiles/{capture_id}')
+async def profile(request: Request, capture_id: str, folded: bool = False) -> Response:
+    """
+    One capture as JSON, with folded=true only its stacks as a file for flamegraph.pl or speedscope
+    """
+    token_dict = await check_login_cookies(request=request)
+    if token_dict.access_level < 4:
+        raise AccessException(needed_level=4, current_level=token_dict.access_level)
+    if (capture := profiler.get(capture_id)) is None:
+        return JSONResponse(status_code=404, content={'detail': 'No such capture, it may have left the buffer'})
+    if folded:
+        return PlainTextResponse(content=capture.folded(), headers={
+            'Content-Disposition': f'attachment; filename="profile-{capture.id}.folded"'})
+    return JSONResponse(status_code=200, content=capture.to_dict(), headers={
+        'Content-Disposition': f'attachment; filename="profile-{capture.id}.json"'})
+
+@router.get('/healthz')
+async def healthz() -> JSONResponse:
+    """
+    Liveness, fails only if the startup gave up
+    """
+    if startup.failed:
+        return JSONResponse(status_code=503, content=startup.status())
+    return JSONResponse(status_code=200, content={'status': 'ok'})
+
+@router.get('/readyz')
+async def readyz() -> JSONResponse:
+    """
+    Readiness, the bootstrap is done and both postgres and redis answer
+    """
+    status = startup.status()
+    if not startup.ready:
+        return JSONResponse(status_code=503, content=status)
+    for name, probe in (('postgres', ping_postgres), ('redis', redis_client.ping)):
+        try:
+            await asyncio.wait_for(probe(), timeout=1)
+        except Exception as exc:
+            return JSONResponse(status_code=503, content={**status, 'ready': False, 'error': f'{name}: {exc!r}'})
+    return JSONResponse(status_code=200, content=status)
+
+@router.get('/metrics')
+async def metrics(request: Request) -> PlainTextResponse:
+    """
+    Prometheus text format. Scrapers send the PYTHON_METRICS_TOKEN bearer token, admins can open it
+    with their login cookies, PYTHON_METRICS_PUBLIC=1 opens it to everyone
+    """
+    if not settings.metrics_public:
+        authorization = request.headers.get('authorization')
+        if authorization is not None:
+            if not settings.metrics_token \
+                    or not secrets.compare_digest(authorization, f'Bearer {settings.metrics_token}'):
+                return PlainTextResponse(status_code=401, content='Unauthorized\n')
+        else:
+            token_dict = await check_login_cookies(request=request)
+            if token_dict.access_level < 4:
+                raise AccessException(needed_level=4, current_level=token_dict.access_level)
+    return PlainTextResponse(content=registry.render(), media_type='text/plain; version=0.0.4')
+
 @router.get("/favicon.ico")
-async def favicon() -> FileResponse:
-    return FileResponse("static/favicon.ico")
\ No newline at end of file
+async def favicon(request: Request) -> Response:
+    return static_assets.assets['favicon.ico'].response(request)
\ No newline at end of file
@@ -1,30 +1,81 @@
-from fastapi import APIRouter
+from datetime import date
+
+from fastapi import APIRouter, Query
 from fastapi.params import Depends
-from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.requests import Request
-from starlette.responses import JSONResponse
-from starlette.templating import Jinja2Templates
+from starlette.responses import StreamingResponse, Response
 
-from database import get_db_session
+from database import get_read_session, LazySession
+from handlers.assets import pages
 from handlers.auth import check_login_cookies
-from service.data_service import fetch
+from settings import settings
+from service.data_service import fetch, fetch_stream, fetch_version, fetch_json, serialize, serialize_stream, \
+    body_format, parse_row_query, aggregate, search
 
 
 router = APIRouter(prefix='/service', tags=['service'])
-frontend = Jinja2Templates(directory='frontend')
 
 @router.get('/')
 async def index_service(request: Request):
-    response = frontend.TemplateResponse(
-        'service.html',
-        {'request': request},
-    )
+    response = pages.response(request, 'service.html')
     await check_login_cookies(request=request, response=response)
     return response
 
 @router.get('/fetch_data')
-async def fetch_data(request: Request, repository_name: str, session: AsyncSession = Depends(get_db_session)):
+async def fetch_data(request: Request, repository_name: str,
+                     after_id: int | None = None, limit: int | None = Query(default=None, ge=1), stream: bool = False,
+                     filters: list[str] = Query(default=[], alias='filter',
+                                                description='column:op:value, e.g. amount:gt:100, repeatable'),
+                     order: str | None = Query(default=None, description='column, -column for descending'),
+                     columns: str | None = Query(default=None, description='comma separated, id is always given'),
+                     lazy_session: LazySession = Depends(get_read_session)):
+    token_dict = await check_login_cookies(request=request)
+    query = parse_row_query(filters=filters, order=order, columns=columns)
+    if stream:  # NDJSON, one row per line, rows are read from the cursor as they are sent
+        # The session stays open while the response is sent, it is closed after that by get_read_session
+        rows = await fetch_stream(session=lazy_session.get(), repository_name=repository_name,
+                                  access_level=token_dict.access_level, after_id=after_id, query=query)
+        return StreamingResponse(serialize_stream(rows, repository_name), media_type='application/x-ndjson')
+
+    version = await fetch_version(repository_name=repository_name, access_level=token_dict.access_level)
+    if version is None:
+        data, next_after_id = await fetch(lazy_session=lazy_session, repository_name=repository_name,
+                                          access_level=token_dict.access_level, after_id=after_id, limit=limit,
+                                          query=query)
+        response = Response(content=serialize(repository_name, data), media_type='application/json')
+    else:
+        query_key = query.key() if query is not None else 'all'
+        etag = f'"{repository_name}-{body_format}-{version}-{after_id}-{limit}-{query_key}"'
+        if request.headers.get('if-none-match') == etag:
+            return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+        body, next_after_id = await fetch_json(lazy_session=lazy_session, repository_name=repository_name,
+                                               access_level=token_dict.access_level, version=version,
+                                               after_id=after_id, limit=limit, query=query)
+        response = Response(content=body, media_type='application/json',
+                            headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+    if next_after_id is not None:
+        response.headers['X-Next-After-Id'] = str(next_after_id)
+    return response
+
+
+@router.get('/aggregate')
+async def aggregate_data(request: Request, repository_name: str = 'important_data', period: str = 'day',
+                         start: date | None = None, end: date | None = None,
+                         lazy_session: LazySession = Depends(get_read_session)):
     token_dict = await check_login_cookies(request=request)
-    data = await fetch(session=session, repository_name=repository_name, access_level=token_dict.access_level)
-    return JSONResponse(content=[i.model_dump_json() for i in data], status_code=200)
+    body = await aggregate(lazy_session=lazy_session, repository_name=repository_name,
+                           access_level=token_dict.access_level, period=period, start=start, end=end)
+    return Response(content=body, media_type='application/json', headers={'Cache-Control': 'private, no-cache'})
 
+@router.get('/search')
+async def search_data(request: Request, repository_name: str, q: str = Query(min_length=1, max_length=256),
+                      limit: int = Query(default=20, ge=1, le=settings.search_max_limit),
+                      offset: int = Query(default=0, ge=0, le=settings.search_max_offset),
+                      lazy_session: LazySession = Depends(get_read_session)):
+    token_dict = await check_login_cookies(request=request)
+    body, next_offset = await search(lazy_session=lazy_session, repository_name=repository_name,
+                                     access_level=token_dict.access_level, terms=q, limit=limit, offset=offset)
+    response = Response(content=body, media_type='application/json', headers={'Cache-Control': 'private, no-cache'})
+    if next_offset is not None:
+        response.headers['X-Next-Offset'] = str(next_offset)
+    return response
@@ -2,52 +2,70 @@ import asyncio
 import traceback
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from starlette.middleware.cors import CORSMiddleware
-from starlette.staticfiles import StaticFiles
 
-from database import AccountsRepository, get_db_session_cm, create_databases, create_mock_data
-from exceptions import RedisPostgresException, init_exception_handlers, InputException
+from cache import tracked_cache
+from database import session_router, ReadYourWritesMiddleware
+from exceptions import init_exception_handlers
 from handlers import routers
-from schemas import Account
-from service import process_account, account_to_login_info
+from handlers.assets import static_assets
+from handlers.compression import CompressionMiddleware
+from handlers.auth import check_login_cookies
+from metrics import observe_requests, ProfilingMiddleware
+from security import password_hasher, account_decoder
+from service import reconcile_account_registry, rotate_account_keys, startup
 from settings import settings
 
 
+async def start_up() -> None:
+    """
+    Waits for the bootstrap, then starts the background jobs. Until then only /healthz and /readyz answer
+    """
+    try:
+        await startup.run()
+    except Exception:
+        traceback.print_exc()
+        return
+    tracked_cache.start()
+    background_tasks.append(asyncio.create_task(reconcile_account_registry(settings.registry_reconcile_interval)))
+    background_tasks.append(asyncio.create_task(rotate_account_keys(settings.key_rotation_batch_size)))
+    background_tasks.append(asyncio.create_task(session_router.run()))
+
+background_tasks = []
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    max_retries = 30
-    for i in range(max_retries):
-        try:
-            async with get_db_session_cm() as session:
-                repo = AccountsRepository(session)
-                admin_account = Account(
-                    username='admin',
-                    name='Administrator',
-                    surname='Sidorovich',
-                    email=settings.admin_email,
-                    password=settings.admin_password,
-                )
-                try:
-                    await AccountsRepository(session).check_login(account_to_login_info(admin_account))
-                except InputException:
-                    await repo.create_account(await process_account(admin_account, access_level=4))
-                await create_databases()
-                await repo.update_redis(is_setup=True)
-                await create_mock_data(session)
-
-            print("Redis updated with account ids")
-            break
-        except:
-            traceback.print_exc()
-            print('Postgres not ready yet')
-            await asyncio.sleep(5)
-    else:
-        raise RedisPostgresException
+    background_tasks.append(asyncio.create_task(start_up()))
     yield
+    for task in background_tasks:
+        task.cancel()
+    tracked_cache.stop()
+    password_hasher.shutdown()
+    account_decoder.shutdown()
+
+async def is_admin(request: Request) -> bool:
+    try:
+        return (await check_login_cookies(request=request)).access_level >= 4
+    except Exception:
+        return False
 
 app = FastAPI(lifespan=lifespan)
 
+# Plain ASGI middlewares are added first, inside the http ones, so they see the responses as the routes sent them
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_min_size)
+app.add_middleware(ProfilingMiddleware, is_admin=is_admin)
+
+@app.middleware('http')
+async def wait_for_startup(request: Request, call_next):
+    if not startup.ready and request.url.path not in ('/healthz', '/readyz'):
+        return JSONResponse(status_code=503, content={'detail': 'Starting up'}, headers={'Retry-After': '1'})
+    return await call_next(request)
+
+app.middleware('http')(observe_requests)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -59,6 +77,6 @@ app.add_middleware(
 for router in routers:
     app.include_router(router)
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", static_assets, name="static")
 
 init_exception_handlers(app)
\ No newline at end of file
@@ -0,0 +1,10 @@
+from metrics.registry import (Counter, Histogram, Timer, Gauge, Registry, registry, current_capture, http_requests,
+                              http_request_seconds, db_statement_seconds, redis_command_seconds, crypto_seconds,
+                              serialization_seconds)
+from metrics.hooks import current_operation, instrument_repository, observe_requests
+from metrics.profiler import Capture, Profiler, ProfilingMiddleware, profiler
+
+__all__ = ['Counter', 'Histogram', 'Timer', 'Gauge', 'Registry', 'registry', 'current_capture', 'http_requests',
+           'http_request_seconds', 'db_statement_seconds', 'redis_command_seconds', 'crypto_seconds',
+           'serialization_seconds', 'current_operation', 'instrument_repository', 'observe_requests',
+           'Capture', 'Profiler', 'ProfilingMiddleware', 'profiler']
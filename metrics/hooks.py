@@ -0,0 +1,72 @@
+import functools
+import inspect
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.requests import Request
+
+from metrics.registry import registry, http_requests, http_request_seconds, db_statement_seconds
+
+current_operation: ContextVar[str] = ContextVar('current_operation', default='other')
+
+
+def instrument_repository(cls):
+    """
+    Class decorator, SQL run inside the public async methods is labelled Class.method in db_statement_seconds.
+    Inherited methods are labelled with the subclass, so decorate the subclasses, not their base
+    """
+    for name in dir(cls):
+        method = getattr(cls, name)
+        if name.startswith('_') or not inspect.iscoroutinefunction(method):
+            continue
+
+        def wrap(method, label):
+            @functools.wraps(method)
+            async def wrapper(*args, **kwargs):
+                token = current_operation.set(label)
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    current_operation.reset(token)
+            return wrapper
+
+        setattr(cls, name, wrap(method, f'{cls.__name__}.{name}'))
+    return cls
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['statement_start'].pop()
+    db_statement_seconds.observe(time.perf_counter() - started, current_operation.get())
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    if context.connection is not None and context.connection.info.get('statement_start'):
+        context.connection.info['statement_start'].pop()
+
+
+async def observe_requests(request: Request, call_next):
+    """
+    Middleware, latency and status by route template, so /service/fetch_data?x=1 and ?x=2 are one series
+    """
+    if not registry.enabled:
+        return await call_next(request)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get('route')
+        route = getattr(route, 'path', 'unmatched')
+        http_request_seconds.observe(time.perf_counter() - start, request.method, route)
+        http_requests.inc(request.method, route, status)
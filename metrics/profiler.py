@@ -0,0 +1,206 @@
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, UTC
+from typing import Awaitable, Callable
+
+from starlette.requests import Request
+
+from metrics.registry import current_capture
+from settings import settings
+
+_frame_names: dict = {}  # code object -> 'qualname (file:line)'
+
+
+def _frame_name(code) -> str:
+    if (name := _frame_names.get(code)) is None:
+        path = code.co_filename
+        if path.startswith(os.getcwd()):
+            path = os.path.relpath(path)
+        else:
+            path = os.path.join(*path.split(os.sep)[-2:])
+        name = _frame_names[code] = f'{code.co_qualname} ({path}:{code.co_firstlineno})'
+    return name
+
+
+class Capture:
+    """
+    One profiled request: spans are every metrics observation made inside it (SQL, Redis, bcrypt, Fernet,
+    serialization), stacks are the sampled event loop stacks while it was the one running
+    """
+    def __init__(self, method: str, path: str, reason: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.reason = reason  # header, sampled or slow
+        self.status = 500
+        self.started_at = datetime.now(UTC).isoformat()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.spans: dict[tuple, list] = {}  # (metric, labels) -> [count, total seconds]
+        self.stacks: dict[tuple, int] = {}  # code objects from the root -> samples
+        self.samples = 0  # samples taken while it ran, the ones not in stacks waited on I/O or on other requests
+
+    def add_span(self, name: str, labels: tuple, value: float):
+        if (span := self.spans.get((name, labels))) is None:
+            span = self.spans[(name, labels)] = [0, 0.0]
+        span[0] += 1
+        span[1] += value
+
+    def summary(self) -> dict:
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'reason': self.reason,
+            'status': self.status,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 3),
+            'samples': self.samples,
+            'on_cpu_samples': sum(self.stacks.values()),
+        }
+
+    def to_dict(self) -> dict:
+        spans = sorted(self.spans.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            **self.summary(),
+            'interval_ms': profiler.interval * 1000,
+            'spans': [{'metric': name, 'labels': list(labels), 'count': count, 'total_ms': round(total * 1000, 3)}
+                      for (name, labels), (count, total) in spans],
+            'stacks': self.folded(),
+        }
+
+    def folded(self) -> str:
+        """
+        Stacks in the folded format, one 'root;...;leaf count' per line, for flamegraph.pl or speedscope
+        """
+        return ''.join(f'{";".join(_frame_name(code) for code in stack)} {count}\n'
+                       for stack, count in self.stacks.items())
+
+
+class Profiler:
+    """
+    Sampling profiler of the event loop thread. A thread wakes up every interval while some request is profiled,
+    takes the loop stack and gives it to the request whose middleware frame is on it. \n
+    Kept captures go to a ring buffer of buffer_size. With sample_rate and slow_seconds at 0 nothing runs
+    """
+    def __init__(self, sample_rate: float, slow_seconds: float, interval: float, buffer_size: int):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.interval = interval
+        self.captures: deque[Capture] = deque(maxlen=buffer_size)
+        self.active: dict = {}  # middleware frame -> Capture
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.loop_thread: int | None = None
+        self.thread: threading.Thread | None = None
+
+    def begin(self, capture: Capture, frame):
+        with self.lock:
+            self.active[frame] = capture
+        self.loop_thread = threading.get_ident()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+            self.thread.start()
+        self.wakeup.set()
+
+    def end(self, capture: Capture, frame) -> bool:
+        """
+        :return: True if the capture was kept, slow ones only when they went over slow_seconds
+        """
+        with self.lock:
+            del self.active[frame]
+        capture.duration = time.perf_counter() - capture.start
+        if capture.reason == 'slow' and capture.duration < self.slow_seconds:
+            return False
+        self.captures.append(capture)
+        return True
+
+    def _sample(self):
+        while True:
+            self.wakeup.wait()
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.loop_thread)
+            with self.lock:
+                if not self.active:
+                    self.wakeup.clear()
+                    continue
+                owner = None
+                codes = []
+                while frame is not None:
+                    if (owner := self.active.get(frame)) is not None:
+                        break
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                frame = None
+                for capture in self.active.values():
+                    capture.samples += 1
+                if owner is not None and codes:
+                    stack = tuple(reversed(codes))
+                    owner.stacks[stack] = owner.stacks.get(stack, 0) + 1
+
+    def get(self, capture_id: str) -> Capture | None:
+        for capture in self.captures:
+            if capture.id == capture_id:
+                return capture
+        return None
+
+    def stats(self) -> dict:
+        return {
+            'sample_rate': self.sample_rate,
+            'slow_ms': self.slow_seconds * 1000,
+            'interval_ms': self.interval * 1000,
+            'buffer_size': self.captures.maxlen,
+            'active': len(self.active),
+            'captures': [capture.summary() for capture in reversed(self.captures)],
+        }
+
+
+profiler = Profiler(sample_rate=settings.profile_sample_rate, slow_seconds=settings.profile_slow_ms / 1000,
+                    interval=settings.profile_interval_ms / 1000, buffer_size=settings.profile_buffer_size)
+
+
+class ProfilingMiddleware:
+    """
+    Plain ASGI middleware, so the route runs in its task and its frame is on the sampled stacks. \n
+    A request is profiled if it has the X-Profile header and is_admin agrees, if it is picked by sample_rate,
+    or always when slow_seconds is set (kept only if it was slow). The id of a kept capture is in X-Profile-Id
+    """
+    def __init__(self, app, is_admin: Callable[[Request], Awaitable[bool]]):
+        self.app = app
+        self.is_admin = is_admin
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        reason = None
+        if any(name == b'x-profile' for name, _ in scope['headers']) and await self.is_admin(Request(scope)):
+            reason = 'header'
+        elif profiler.sample_rate and random.random() < profiler.sample_rate:
+            reason = 'sampled'
+        elif profiler.slow_seconds:
+            reason = 'slow'
+        if reason is None:
+            return await self.app(scope, receive, send)
+
+        capture = Capture(scope['method'], scope['path'], reason)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                capture.status = message['status']
+                if reason != 'slow':
+                    message['headers'] = [*message.get('headers', ()), (b'x-profile-id', capture.id.encode())]
+            await send(message)
+
+        frame = sys._getframe()
+        token = current_capture.set(capture)
+        profiler.begin(capture, frame)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.end(capture, frame)
+            current_capture.reset(token)
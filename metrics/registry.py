@@ -0,0 +1,146 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable
+
+from settings import settings
+
+# Capture of the request being profiled (metrics.profiler), every observation inside it is also kept as a span
+current_capture: ContextVar = ContextVar('current_capture', default=None)
+
+default_buckets = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        if registry.enabled:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for labels, value in self.values.items():
+            lines.append(f'{self.name}{_labels(self.label_names, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    """
+    Keeps per-bucket counts, they are made cumulative only when rendered, so observe is one bisect and three adds
+    """
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = default_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self.buckets = buckets
+        self.series: dict[tuple, list] = {}  # labels -> [bucket counts + overflow, sum, count]
+
+    def observe(self, value: float, *labels):
+        if (capture := current_capture.get()) is not None:
+            capture.add_span(self.name, labels, value)
+        if not registry.enabled:
+            return
+        if (series := self.series.get(labels)) is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels) -> 'Timer':
+        return Timer(self, labels)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_labels((*self.label_names, "le"), (*labels, bound))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, labels)} {count}')
+        return lines
+
+
+class Timer:
+    """
+    with histogram.time(*labels): observes how long the block took, a class is cheaper than @contextmanager
+    """
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Gauge:
+    """
+    Read when rendered, function gives {labels tuple: value}
+    """
+    def __init__(self, name: str, documentation: str, function: Callable[[], dict], labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self.function = function
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        try:
+            values = self.function()
+        except Exception:
+            return lines
+        for labels, value in values.items():
+            lines.append(f'{self.name}{_labels(self.label_names, labels)} {value}')
+        return lines
+
+
+class Registry:
+    """
+    Metrics of this process in the prometheus text format. Every worker keeps its own, scrape each of them
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+
+registry = Registry(enabled=settings.metrics_enabled)
+
+http_requests = registry.register(Counter(
+    'http_requests_total', 'Requests by route and status', ('method', 'route', 'status')))
+http_request_seconds = registry.register(Histogram(
+    'http_request_duration_seconds', 'Request latency by route', ('method', 'route')))
+db_statement_seconds = registry.register(Histogram(
+    'db_statement_duration_seconds', 'SQL statement latency by repository method', ('operation',)))
+redis_command_seconds = registry.register(Histogram(
+    'redis_command_duration_seconds', 'Redis command latency by command, pipelines are PIPELINE', ('command',)))
+crypto_seconds = registry.register(Histogram(
+    'crypto_duration_seconds', 'bcrypt and Fernet latency, bcrypt includes the wait for a worker', ('operation',)))
+serialization_seconds = registry.register(Histogram(
+    'serialization_duration_seconds', 'building rows and JSON encoding of result sets', ('operation',)))
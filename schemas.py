@@ -1,6 +1,9 @@
-from datetime import datetime
+import hashlib
+from datetime import datetime, date
+from typing import Literal
 
 from pydantic import BaseModel
+from typing_extensions import TypedDict  # pydantic needs it instead of typing.TypedDict before 3.12
 
 class TokenDict(BaseModel):
     """
@@ -33,6 +36,15 @@ class LoginInfo(BaseModel):
     email: str
     password: str
 
+class Profile(BaseModel):
+    """
+    Display-safe part of an account, what the profile cache holds. \n
+    Contains username, name and surname, never the email or any hash
+    """
+    username: str
+    name: str
+    surname: str
+
 
 class AccountProcessed(BaseModel):
     """
@@ -52,30 +64,57 @@ class AccountProcessed(BaseModel):
         'from_attributes': True
     }
 
-class VeryUnimportantRow(BaseModel):
+# Rows of the data tables are plain dicts, they come from column projections and are serialized once
+# for a whole page with a TypeAdapter, never copied into models
+class VeryUnimportantRow(TypedDict):
     id: int
     text: str
 
-    model_config = {
-        'from_attributes': True
-    }
-
-class UnimportantRow(BaseModel):
+class UnimportantRow(TypedDict):
     id: int
     text: str
     date: datetime
 
-    model_config = {
-        'from_attributes': True
-    }
-
 
-class ImportantRow(BaseModel):
+class ImportantRow(TypedDict):
     id: int
     text: str
     date: datetime
     amount: int
 
-    model_config = {
-        'from_attributes': True
-    }
\ No newline at end of file
+
+class AggregateRow(TypedDict):
+    """
+    One time bucket of a rollup, bucket is its first day
+    """
+    bucket: date
+    rows: int
+    total: int
+    average: float
+
+
+class RowFilter(BaseModel):
+    """
+    One condition of a RowQuery, value is converted to the type of the column by the repository. \n
+    Contains column, op (eq, ne, lt, le, gt, ge, prefix - strings only) and value
+    """
+    column: str
+    op: Literal['eq', 'ne', 'lt', 'le', 'gt', 'ge', 'prefix']
+    value: str
+
+
+class RowQuery(BaseModel):
+    """
+    What to read from a data table, everything is done in SQL. \n
+    Contains filters (all must match), order_by with descending, and columns (None - all, id is always given)
+    """
+    filters: list[RowFilter] = []
+    order_by: str = 'id'
+    descending: bool = False
+    columns: list[str] | None = None
+
+    def key(self) -> str:
+        """
+        Short stable digest, for cache keys and etags
+        """
+        return hashlib.sha256(self.model_dump_json().encode()).hexdigest()[:16]
@@ -0,0 +1,7 @@
+from security.password_hasher import PasswordHasher, password_hasher
+from security.field_cipher import FieldCipher, field_cipher
+from security.account_decoder import AccountDecoder, account_decoder
+from security.token_cache import TokenCache, token_cache
+
+__all__ = ['PasswordHasher', 'password_hasher', 'FieldCipher', 'field_cipher', 'AccountDecoder', 'account_decoder',
+           'TokenCache', 'token_cache']
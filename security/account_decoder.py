@@ -0,0 +1,76 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterable, AsyncIterator
+
+from metrics import crypto_seconds
+from security.field_cipher import field_cipher
+from settings import settings
+
+fields = ('username', 'name', 'email')
+
+
+def _decrypt_chunk(rows: list[tuple[str, str, str]]) -> list[tuple[str, str, str]]:
+    return [tuple(field_cipher.decrypt(field, token) for field, token in zip(fields, row)) for row in rows]
+
+
+class AccountDecoder:
+    """
+    Decrypts (username_enc, name_enc, email_enc) rows in chunks in a pool of worker processes. \n
+    Results come back in the original order, at most workers * 2 chunks are in flight at once,
+    input that fits in one chunk is decrypted in place, it is not worth the trip to another process.
+    With workers=0 the chunks are decrypted one by one in a thread, so a stream still goes out as it is read
+    """
+    def __init__(self, workers: int, chunk_size: int):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    async def _decrypt_remote(self, loop, chunk: list[tuple[str, str, str]]) -> list[tuple[str, str, str]]:
+        with crypto_seconds.time('fernet_decrypt_chunk'):
+            return await loop.run_in_executor(self._get_executor(), _decrypt_chunk, chunk)
+
+    async def _decrypt_local(self, chunk: list[tuple[str, str, str]]) -> list[tuple[str, str, str]]:
+        with crypto_seconds.time('fernet_decrypt_chunk'):
+            return await asyncio.to_thread(_decrypt_chunk, chunk)
+
+    async def decrypt(self, rows: AsyncIterable[tuple[str, str, str]]) -> AsyncIterator[tuple[str, str, str]]:
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        chunk = []
+        async for row in rows:
+            chunk.append(row)
+            if len(chunk) < self.chunk_size:
+                continue
+            if not self.workers:  # No pool, still one chunk at a time and off the event loop
+                for i in await self._decrypt_local(chunk):
+                    yield i
+                chunk = []
+                continue
+            pending.append(asyncio.ensure_future(self._decrypt_remote(loop, chunk)))
+            chunk = []
+            if len(pending) > self.workers * 2:
+                for i in await pending.popleft():
+                    yield i
+        if chunk:
+            if pending:
+                pending.append(asyncio.ensure_future(self._decrypt_remote(loop, chunk)))
+            else:
+                for i in _decrypt_chunk(chunk):
+                    yield i
+        while pending:
+            for i in await pending.popleft():
+                yield i
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+account_decoder = AccountDecoder(workers=settings.decode_workers, chunk_size=settings.decode_chunk_size)
@@ -0,0 +1,87 @@
+import hashlib
+
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+
+from metrics import crypto_seconds
+from settings import settings
+
+
+class FieldCipher:
+    """
+    Fernet ciphers for the encrypted account fields, built once per process. \n
+    Each secret may hold several comma-separated keys: the first one encrypts, all of them decrypt,
+    so a new key can be put in front and the old ones dropped after rotate_row went over every account
+    """
+    secrets = {
+        'name': 'name_secret',
+        'email': 'email_secret',
+        'access_level': 'access_level_secret',
+        'username': 'username_secret',
+    }
+    columns = {
+        'name': 'name_enc',
+        'email': 'email_enc',
+        'access_level': 'access_level_enc',
+        'username': 'username_enc',
+    }
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.rings = {}
+        self.ciphers = {}
+
+    def _build(self):
+        for field, secret in self.secrets.items():
+            keys = [Fernet(key.strip()) for key in getattr(self.settings, secret).split(',') if key.strip()]
+            self.rings[field] = keys
+            self.ciphers[field] = MultiFernet(keys)
+
+    def _cipher(self, field: str) -> MultiFernet:
+        if not self.ciphers:
+            self._build()
+        return self.ciphers[field]
+
+    def encrypt(self, field: str, text: str) -> str:
+        with crypto_seconds.time('fernet_encrypt'):
+            return self._cipher(field).encrypt(text.encode()).decode()
+
+    def decrypt(self, field: str, token: str) -> str:
+        with crypto_seconds.time('fernet_decrypt'):
+            return self._cipher(field).decrypt(token.encode()).decode()
+
+    def is_rotating(self) -> bool:
+        """True if any field has an old key left in its ring"""
+        self._cipher('name')
+        return any(len(keys) > 1 for keys in self.rings.values())
+
+    def fingerprint(self) -> str:
+        """Short hash of the primary keys, names a rotation without giving the keys away"""
+        primary = ','.join(getattr(self.settings, secret).split(',')[0].strip() for secret in self.secrets.values())
+        return hashlib.sha256(primary.encode()).hexdigest()[:16]
+
+    def is_current(self, field: str, token: str) -> bool:
+        self._cipher(field)
+        if len(self.rings[field]) == 1:
+            return True
+        try:
+            self.rings[field][0].decrypt(token.encode())
+            return True
+        except InvalidToken:
+            return False
+
+    def rotate_row(self, row) -> bool:
+        """
+        Re-encrypts the fields of row (Accounts or AccountProcessed) that were encrypted with an old key
+        :param row: object with name_enc, email_enc, access_level_enc, username_enc
+        :return: bool - True if anything changed
+        """
+        changed = False
+        for field, column in self.columns.items():
+            token = getattr(row, column)
+            if not self.is_current(field, token):
+                setattr(row, column, self._cipher(field).rotate(token.encode()).decode())
+                changed = True
+        return changed
+
+
+field_cipher = FieldCipher(settings)
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+from exceptions import HasherBusyException
+from metrics import crypto_seconds
+from settings import settings
+
+
+def _hashpw(password: bytes) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt())
+
+
+def _hashpw_many(passwords: list[bytes]) -> list[bytes]:
+    return [bcrypt.hashpw(password, bcrypt.gensalt()) for password in passwords]
+
+
+def _checkpw(password: bytes, password_hash: bytes) -> bool:
+    return bcrypt.checkpw(password, password_hash)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a pool of worker processes, so it does not block the event loop. \n
+    At most `workers` hashes run at once, `queue_size` more may wait, anything above is rejected
+    """
+    operations = {_hashpw: 'bcrypt_hash', _hashpw_many: 'bcrypt_hash_many', _checkpw: 'bcrypt_check'}
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = None
+        self.semaphore = None
+        self.pending = 0
+        self.running = 0
+        self.max_queue_depth = 0
+        self.calls = 0
+        self.rejected = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            self.semaphore = asyncio.Semaphore(self.workers)
+        return self.executor
+
+    async def _run(self, func, *args):
+        with crypto_seconds.time(self.operations[func]):
+            return await self._queue(func, *args)
+
+    async def _queue(self, func, *args):
+        executor = self._get_executor()
+        if self.pending >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise HasherBusyException
+        self.pending += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.pending - self.running)
+        try:
+            async with self.semaphore:
+                self.running += 1
+                start = time.perf_counter()
+                try:
+                    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+                finally:
+                    elapsed = time.perf_counter() - start
+                    self.running -= 1
+                    self.calls += 1
+                    self.total_time += elapsed
+                    self.max_time = max(self.max_time, elapsed)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return (await self._run(_hashpw, password.encode())).decode()
+
+    async def hash_many(self, passwords: list[str], chunk_size: int = 8) -> list[str]:
+        """
+        Hashes a batch, chunk_size passwords per call, at most one chunk per worker at a time,
+        so the batch takes `workers` queue slots and logins still get through between the chunks
+        :param passwords: list of str
+        :param chunk_size: passwords per worker call
+        :return: list of hashes in the same order
+        """
+        hashes = []
+        step = chunk_size * self.workers
+        for i in range(0, len(passwords), step):
+            chunks = [[password.encode() for password in passwords[j:j + chunk_size]]
+                      for j in range(i, min(i + step, len(passwords)), chunk_size)]
+            for chunk in await asyncio.gather(*[self._run(_hashpw_many, chunk) for chunk in chunks]):
+                hashes.extend(password_hash.decode() for password_hash in chunk)
+        return hashes
+
+    async def check(self, password: str, password_hash: str) -> bool:
+        return await self._run(_checkpw, password.encode(), password_hash.encode())
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'queue_depth': self.pending - self.running,
+            'max_queue_depth': self.max_queue_depth,
+            'running': self.running,
+            'calls': self.calls,
+            'rejected': self.rejected,
+            'avg_seconds': self.total_time / self.calls if self.calls else 0.0,
+            'max_seconds': self.max_time,
+        }
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+password_hasher = PasswordHasher(workers=settings.hash_workers, queue_size=settings.hash_queue_size)
@@ -0,0 +1,78 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+from schemas import TokenDict
+from settings import settings
+
+
+class TokenCache:
+    """
+    LRU of already verified access tokens, keyed by sha256 of the token. \n
+    An entry lives for ttl seconds at most and never past the token's exp,
+    evict_account drops every token of an account at once
+    """
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[TokenDict, float]] = OrderedDict()
+        self.by_account: dict[int, set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _digest(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> TokenDict | None:
+        digest = self._digest(token)
+        if (entry := self.entries.get(digest)) is None:
+            self.misses += 1
+            return None
+        token_dict, expires_at = entry
+        if expires_at <= time.time():
+            self.expirations += 1
+            self.misses += 1
+            self._remove(digest)
+            return None
+        self.hits += 1
+        self.entries.move_to_end(digest)
+        return token_dict
+
+    def put(self, token: str, token_dict: TokenDict, exp: float):
+        digest = self._digest(token)
+        self.entries[digest] = (token_dict, min(exp, time.time() + self.ttl))
+        self.entries.move_to_end(digest)
+        self.by_account.setdefault(token_dict.id, set()).add(digest)
+        while len(self.entries) > self.max_size:
+            self.evictions += 1
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, digest: str):
+        token_dict, _ = self.entries.pop(digest)
+        digests = self.by_account[token_dict.id]
+        digests.discard(digest)
+        if not digests:
+            del self.by_account[token_dict.id]
+
+    def evict_account(self, account_id: int):
+        """Call it when the account was deleted or its access level changed"""
+        for digest in self.by_account.pop(account_id, set()):
+            self.entries.pop(digest, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+token_cache = TokenCache(max_size=settings.token_cache_size, ttl=settings.token_cache_ttl)
@@ -1,7 +1,17 @@
-from service.conversions_service import process_account, unprocess_account, generate_id, account_to_login_info
-from service.auth_service import login, give_jwt_token, create_temp_user, get_token_dict, register, delete, update
-from service.data_service import get_account
+from service.conversions_service import (process_account, unprocess_account, unprocess_accounts, unprocess_accounts_stream,
+                                         generate_id, generate_ids, account_to_login_info,
+                                         process_accounts, encrypt_account, hash_email, account_to_profile)
+from service.auth_service import (login, give_jwt_token, give_temp_token, read_temp_token,
+                                  get_token_dict, register, delete, update, reconcile_account_registry,
+                                  rotate_account_keys, validate_account, read_accounts_csv, register_many,
+                                  throttled)
+from service.data_service import get_account, get_profile
+from service.startup_service import Startup, startup
 
-__all__ = ['process_account', 'unprocess_account', 'generate_id', 'account_to_login_info',
-           'login', 'give_jwt_token', 'create_temp_user', 'get_token_dict', 'register', 'delete', 'update',
-           'get_account']
\ No newline at end of file
+__all__ = ['process_account', 'unprocess_account', 'unprocess_accounts', 'unprocess_accounts_stream',
+           'generate_id', 'generate_ids', 'account_to_login_info', 'process_accounts', 'encrypt_account', 'hash_email',
+           'account_to_profile',
+           'login', 'give_jwt_token', 'give_temp_token', 'read_temp_token',
+           'get_token_dict', 'register', 'delete', 'update', 'reconcile_account_registry', 'rotate_account_keys',
+           'validate_account', 'read_accounts_csv', 'register_many', 'throttled',
+           'get_account', 'get_profile', 'Startup', 'startup']
\ No newline at end of file
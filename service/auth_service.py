@@ -1,15 +1,21 @@
-import json
+import asyncio
+import csv
+import io
+import uuid
 from datetime import datetime, timedelta, UTC
+from typing import Awaitable, Callable
 
 import jwt
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from cache import redis_client
-from exceptions import LoginException, LoginExpiredException, LoginInvalidException
-from schemas import TokenDict, Account, LoginInfo
-from service.conversions_service import process_account, generate_id
+from cache import redis_client, account_registry, login_throttle, RedisLock
+from exceptions import (LoginException, LoginExpiredException, LoginInvalidException, InputException,
+                        EmailTakenException)
+from schemas import TokenDict, Account, LoginInfo, AdminCreatedAccount
+from service.conversions_service import process_account, process_accounts, hash_email, generate_ids
+from security import field_cipher, token_cache
 from settings import settings
-from database import AccountsRepository
+from database import AccountsRepository, LazySession, get_db_session_cm
 
 
 def give_jwt_token(token_dict: TokenDict) -> str:
@@ -27,85 +33,113 @@ def give_jwt_token(token_dict: TokenDict) -> str:
     )
 
 
-async def create_temp_user(temp_id: str) -> int:
+def give_temp_token(temp_id: str) -> str:
     """
-    Essentially initializes temp_id in redis, creating temp user
+    Signs temp user identity into a token, so it can be checked without redis
     :param temp_id: Temporary user username
-    :return: int - id of the user
-    """
-    r = redis_client
-    if raw_used_ids := await r.get('used_ids_redis'):
-        used_ids = json.loads(raw_used_ids)
-        account_id = generate_id(used_ids=used_ids)
-        used_ids.append(account_id)
-        await r.set(
-            temp_id,
-            json.dumps({'id': account_id}),
-            ex=60 * 60 * 24
-        )
-        await r.set(
-            'used_ids_redis',
-            json.dumps(used_ids),
-            ex=60 * 60 * 24
+    :return: str - jwt token, containing temp_id and the id
+    """
+    return jwt.encode(
+        payload={'temp_id': temp_id,
+                 'id': uuid.UUID(temp_id).int % 9223372036854775806 + 1,
+                 'aud': 'temp',
+                 'exp': datetime.now(UTC) + timedelta(seconds=settings.temp_user_ttl)},
+        key=settings.jwt_secret,
+        algorithm='HS256'
+    )
+
+
+def read_temp_token(temp_token: str) -> dict:
+    """
+    Verifies temp user token locally
+    :param temp_token: token from give_temp_token
+    :return: dict - payload with temp_id and id
+    """
+    try:
+        return jwt.decode(
+            temp_token,
+            key=settings.jwt_secret,
+            algorithms=['HS256'],
+            audience='temp'
         )
-        settings.print(f'Temp user {temp_id} has been given id {account_id}')
-        return account_id
-    raise LoginException
+    except jwt.ExpiredSignatureError:
+        raise LoginExpiredException
+    except jwt.InvalidTokenError:
+        raise LoginInvalidException
 
 
-async def get_token_dict(access_token: str = '', temp_id: str = '') -> TokenDict:
+async def get_token_dict(access_token: str = '', temp_token: str = '') -> TokenDict:
     """
-    Input access_token to get registered user's token dict and temp id for temporary's
+    Input access_token to get registered user's token dict and temp token for temporary's
     :param access_token: Registered user access token (Default=None)
-    :param temp_id: Temporary user username (Default=None)
+    :param temp_token: Temporary user signed token (Default=None)
     :return: TokenDict object
     """
     if access_token:  # Registered user login
-        try:
-            payload = jwt.decode(
-                access_token,
-                key=settings.jwt_secret,
-                algorithms=['HS256']
-            )
-        except jwt.ExpiredSignatureError:
-            raise LoginExpiredException
-        except jwt.InvalidTokenError:
-            raise LoginInvalidException
-
-        r = redis_client
-        if used_ids_raw := await r.get('used_ids_postgres'):
-            if payload.get('id') in set(json.loads(used_ids_raw)):
-                settings.print(f'Registered user login successful {payload.get("id")}')
-                return TokenDict(
-                    id=payload.get('id'),
-                    access_level=payload.get('access_level')
+        if (token_dict := token_cache.get(access_token)) is None:  # Not verified yet
+            try:
+                payload = jwt.decode(
+                    access_token,
+                    key=settings.jwt_secret,
+                    algorithms=['HS256']
                 )
-        else:
-            raise LoginException(message='The account seems to be deleted')
+            except jwt.ExpiredSignatureError:
+                raise LoginExpiredException
+            except jwt.InvalidTokenError:
+                raise LoginInvalidException
+            token_dict = TokenDict(
+                id=payload.get('id'),
+                access_level=payload.get('access_level')
+            )
+            token_cache.put(access_token, token_dict, exp=payload.get('exp', 0))
 
-    elif temp_id:  # Temp user login
-        r = redis_client
-        if await r.get(temp_id) is None:
-            account_id = await create_temp_user(temp_id)  # Give temp user a redis id if none
-        else:
-            account_id = json.loads(await r.get(temp_id))['id']  # Otherwise retrieve the id
-            settings.print(f'Temp user login successful {account_id}')
+        if await account_registry.is_active(token_dict.id):
+            settings.print(f'Registered user login successful {token_dict.id}')
+            return token_dict
+        token_cache.evict_account(token_dict.id)
+        raise LoginException(message='The account seems to be deleted')
 
+    elif temp_token:  # Temp user login, verified locally
+        payload = read_temp_token(temp_token)
+        settings.print(f'Temp user login successful {payload["id"]}')
         return TokenDict(
-            id=account_id,
+            id=payload['id'],
             access_level=0
         )
     raise LoginException(message='There was an error')
 
-async def login(login_info: LoginInfo, session: AsyncSession) -> str:
+async def throttled(login_info: LoginInfo, client_ip: str, check: Callable[[], Awaitable]):
+    """
+    Runs check (anything that compares the password) only if neither the email nor the client ip are throttled,
+    a raised InputException or a returned False counts as a wrong password
+    :param login_info: LoginInfo object
+    :param client_ip: str
+    :param check: coroutine function
+    :return: what check returned
+    """
+    identities = {'email': hash_email(login_info.email), 'ip': client_ip}
+    await login_throttle.check(identities)
+    try:
+        result = await check()
+    except InputException:
+        await login_throttle.failed(identities)
+        raise
+    if result is False:
+        await login_throttle.failed(identities)
+    else:
+        await login_throttle.succeeded({'email': identities['email']})
+    return result
+
+async def login(login_info: LoginInfo, session: AsyncSession, client_ip: str) -> str:
     """
     Login account
     :param login_info: LoginInfo object
     :param session: AsyncSession object
+    :param client_ip: str, for the login throttle
     :return: str - jwt token
     """
     repo = AccountsRepository(session)
-    token_dict = await repo.check_login(login_info)
+    token_dict = await throttled(login_info, client_ip, lambda: repo.check_login(login_info))
     return give_jwt_token(token_dict)
 
 async def register(account: Account, session: AsyncSession, access_level: int = 1) -> bool:
@@ -121,16 +155,110 @@ async def register(account: Account, session: AsyncSession, access_level: int =
     await repo.create_account(account_processed)
     return True
 
-async def delete(login_info: LoginInfo, session: AsyncSession, soft: bool) -> bool:
+def validate_account(account: Account) -> bool:
+    """
+    Checks user-inputted account details
+    :param account: Account object
+    :return: bool - True if valid, raises InputException otherwise
+    """
+    if len(account.password) < 8:
+        raise InputException(invalid_field='Password is too short, needs at least 8 characters')
+    if len(account.username) < 3:
+        raise InputException(invalid_field='Username is too short, needs at least 3 characters')
+    if len(account.email) < 6 or not '@' in account.email or not '.' in account.email:
+        raise InputException(invalid_field='Enter valid email address')
+    return True
+
+def read_accounts_csv(text: str) -> list[AdminCreatedAccount]:
+    """
+    Reads accounts from csv with a header: username,name,surname,email,password,access_level
+    :param text: csv file contents
+    :return: list of AdminCreatedAccount objects
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    missing = {'username', 'name', 'surname', 'email', 'password', 'access_level'} - set(reader.fieldnames or ())
+    if missing:
+        raise InputException(invalid_field=f'csv header, missing {", ".join(sorted(missing))}')
+    accounts = []
+    for row_number, row in enumerate(reader, start=2):
+        try:
+            accounts.append(AdminCreatedAccount(
+                account=Account(username=row['username'], name=row['name'], surname=row['surname'],
+                                email=row['email'], password=row['password']),
+                access_level=int(row['access_level'])
+            ))
+        except (ValueError, TypeError):
+            raise InputException(invalid_field=f'csv row {row_number}')
+    return accounts
+
+async def register_many(accounts: list[AdminCreatedAccount], lazy_session: LazySession) -> list[dict]:
+    """
+    Registers a batch of accounts: one query for taken emails, one insert, one registry update.
+    No connection is held while the passwords are hashed
+    :param accounts: list of AdminCreatedAccount objects
+    :param lazy_session: LazySession object
+    :return: list of dict - result of every row, in the same order
+    """
+    if len(accounts) > settings.bulk_create_max_rows:
+        raise InputException(invalid_field=f'batch, at most {settings.bulk_create_max_rows} rows are allowed')
+    report = [{'row': i, 'email': item.account.email} for i, item in enumerate(accounts)]
+    rows_by_hash = {}
+    for i, item in enumerate(accounts):
+        try:
+            validate_account(item.account)
+        except InputException as exc:
+            report[i].update(status='invalid', detail=str(exc))
+            continue
+        email_hash = hash_email(item.account.email)
+        if email_hash in rows_by_hash:
+            report[i].update(status='duplicate', detail=f'Same email as row {rows_by_hash[email_hash]}')
+            continue
+        rows_by_hash[email_hash] = i
+
+    async with lazy_session as session:
+        taken = await AccountsRepository(session).get_taken_email_hashes(list(rows_by_hash))
+    rows = []
+    for email_hash, i in rows_by_hash.items():
+        if email_hash in taken:
+            report[i].update(status='duplicate', detail=str(EmailTakenException()))
+        else:
+            rows.append(i)
+
+    processed = await process_accounts(accounts=[accounts[i].account for i in rows],
+                                       access_levels=[accounts[i].access_level for i in rows])
+    pending = dict(zip(rows, processed))
+    for _ in range(3):  # Rounds for rows whose id was taken meanwhile
+        async with lazy_session as session:
+            repo = AccountsRepository(session)
+            created = await repo.create_accounts(list(pending.values()))
+            skipped = {i: item for i, item in pending.items() if item.id not in created}
+            taken = await repo.get_taken_email_hashes([i.email_hash for i in skipped.values()]) if skipped else set()
+        for i, item in pending.items():
+            if item.id in created:
+                report[i].update(status='created', id=item.id)
+            elif item.email_hash in taken:  # Registered after the check above
+                report[i].update(status='duplicate', detail=str(EmailTakenException()))
+        # The rest lost their id to another writer, they get new ones, the hashing is not repeated
+        pending = {i: item for i, item in skipped.items() if item.email_hash not in taken}
+        if not pending:
+            break
+        pending = {i: item.model_copy(update={'id': account_id})
+                   for (i, item), account_id in zip(pending.items(), await generate_ids(len(pending)))}
+    for i in pending:
+        report[i].update(status='failed', detail='No free id was found')
+    return report
+
+async def delete(login_info: LoginInfo, session: AsyncSession, soft: bool, client_ip: str) -> bool:
     """
     Delete account
     :param soft: Do not delete the account, but shut it off
     :param login_info: LoginInfo object
     :param session: AsyncSession object
+    :param client_ip: str, for the login throttle
     :return: bool - True if success
     """
     repo = AccountsRepository(session)
-    return await repo.delete_account(login_info, soft)
+    return await throttled(login_info, client_ip, lambda: repo.delete_account(login_info, soft))
 
 async def update(account: Account, token_dict: TokenDict, session: AsyncSession) -> bool:
     """
@@ -144,3 +272,54 @@ async def update(account: Account, token_dict: TokenDict, session: AsyncSession)
     account_processed = await process_account(account=account, create_id=False)
     await repo.update_account(account=account, account_processed=account_processed, token_dict=token_dict)
     return True
+
+async def reconcile_account_registry(interval: int) -> None:
+    """
+    Background job, rebuilds the account registry from postgres whenever a rebuild was requested
+    :param interval: seconds between the checks
+    :return: None
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await account_registry.is_rebuild_requested():
+                async with get_db_session_cm() as session:
+                    await AccountsRepository(session).update_redis()
+                settings.print('Account registry rebuilt')
+        except Exception as exc:
+            print(f'Account registry reconcile failed: {exc!r}')
+
+async def rotate_account_keys(batch_size: int, retry_interval: float = 30) -> None:
+    """
+    Background job, re-encrypts every account with the primary keys, does nothing unless a key ring has old keys. \n
+    One worker rotates at a time (RedisLock), the last rotated id is kept in redis, so if it dies another one
+    goes on from there. A failed batch is logged and retried after retry_interval
+    :param batch_size: accounts per transaction
+    :param retry_interval: seconds between the tries of the workers that don't rotate or failed
+    :return: None
+    """
+    if not field_cipher.is_rotating():
+        return
+    progress_key = f'account_keys:rotated:{field_cipher.fingerprint()}'
+    lock = RedisLock('account_keys:rotation_lock', ttl=60)
+    while True:
+        try:
+            if await redis_client.get(progress_key) == 'done':
+                return
+            if await lock.acquire():
+                heartbeat = asyncio.create_task(lock.keep_alive())
+                try:
+                    after_id = int(await redis_client.get(progress_key) or 0)
+                    while after_id is not None:
+                        async with get_db_session_cm() as session:
+                            after_id = await AccountsRepository(session).rotate_keys(after_id=after_id,
+                                                                                     batch_size=batch_size)
+                        await redis_client.set(progress_key, 'done' if after_id is None else after_id)
+                finally:
+                    heartbeat.cancel()
+                    await lock.release()
+                print('Account keys rotated, old keys can be removed')
+                return
+        except Exception as exc:
+            print(f'Account key rotation failed: {exc!r}, retrying in {retry_interval} s')
+        await asyncio.sleep(retry_interval)
@@ -1,13 +1,12 @@
-import json
+import asyncio
 from random import randint
+from typing import AsyncIterable, AsyncIterator
 
-import bcrypt
 import hashlib
-from cryptography.fernet import Fernet
 
-from settings import settings
-from cache import redis_client
-from schemas import Account, AccountProcessed, LoginInfo
+from cache import account_registry
+from security import password_hasher, field_cipher, account_decoder
+from schemas import Account, AccountProcessed, LoginInfo, Profile
 
 
 def generate_id(used_ids) -> int:
@@ -30,28 +29,29 @@ async def process_account(account: Account,
     :param create_id: Turn it off if you do not want to give processed account a unique id (Default=True)
     :return: AccountProcessed object
     """
-    r = redis_client
-    used_ids = set(json.loads(await r.get('used_ids')))
-
+    account_id = 0
     if create_id:
-        account_id = generate_id(used_ids)
-    else:
-        account_id = 0
-
-    f = Fernet(key=settings.name_secret)
-    name_enc = f.encrypt((account.name+' '+account.surname).title().encode()).decode()
+        while await account_registry.is_used(account_id := generate_id(used_ids=())):
+            pass
 
-    f = Fernet(key=settings.email_secret)
-    email_enc = f.encrypt(account.email.encode()).decode()
+    password_hash = await password_hasher.hash(account.password)
+    return encrypt_account(account, access_level=access_level, account_id=account_id, password_hash=password_hash)
 
-    f = Fernet(key=settings.access_level_secret)
-    access_level_enc = f.encrypt(str(access_level).encode()).decode()
-
-    f = Fernet(key=settings.username_secret)
-    username_enc = f.encrypt(account.username.encode()).decode()
+def encrypt_account(account: Account, access_level: int, account_id: int, password_hash: str) -> AccountProcessed:
+    """
+    Encrypts the fields of an already hashed account
+    :param account: Account object
+    :param access_level: int
+    :param account_id: int
+    :param password_hash: bcrypt hash of account.password
+    :return: AccountProcessed object
+    """
+    name_enc = field_cipher.encrypt('name', (account.name+' '+account.surname).title())
+    email_enc = field_cipher.encrypt('email', account.email)
+    access_level_enc = field_cipher.encrypt('access_level', str(access_level))
+    username_enc = field_cipher.encrypt('username', account.username)
 
-    password_hash = bcrypt.hashpw(account.password.encode(), bcrypt.gensalt()).decode()
-    email_hash = hashlib.sha256(account.email.lower().encode()).hexdigest()
+    email_hash = hash_email(account.email)
 
     return AccountProcessed(
         id=account_id,
@@ -64,20 +64,48 @@ async def process_account(account: Account,
         is_active=True
     )
 
+def hash_email(email: str) -> str:
+    return hashlib.sha256(email.lower().encode()).hexdigest()
+
+async def generate_ids(count: int) -> list[int]:
+    """
+    Generates count unique ids, that are not in the account registry, one registry call per round
+    :param count: int
+    :return: list of int
+    """
+    ids = set()
+    while len(ids) < count:
+        candidates = list({generate_id(used_ids=ids) for _ in range(count - len(ids))})
+        ids.update(i for i, used in zip(candidates, await account_registry.are_used(candidates)) if not used)
+    return list(ids)
+
+async def process_accounts(accounts: list[Account], access_levels: list[int]) -> list[AccountProcessed]:
+    """
+    Same as process_account for a batch: passwords are hashed in the worker processes a chunk at a time,
+    ids are checked against the registry together
+    :param accounts: list of Account objects
+    :param access_levels: access level of every account
+    :return: list of AccountProcessed objects in the same order
+    """
+    password_hashes = await password_hasher.hash_many([i.password for i in accounts])
+    account_ids = await generate_ids(len(accounts))
+    processed = []
+    for i, account in enumerate(accounts):
+        processed.append(encrypt_account(account, access_level=access_levels[i],
+                                         account_id=account_ids[i], password_hash=password_hashes[i]))
+        if i % 500 == 499:
+            await asyncio.sleep(0)  # Fernet is cheap, but do not hold the loop for the whole batch
+    return processed
+
 def unprocess_account(account_processed: AccountProcessed) -> Account:
     """
     Converts AccountProcessed into Account, gives blank password
     :param account_processed: AccountProcessed object
     :return: Account object
     """
-    f = Fernet(key=settings.email_secret)
-    email = f.decrypt(account_processed.email_enc.encode()).decode()
-
-    f = Fernet(key=settings.name_secret)
-    full_name = f.decrypt(account_processed.name_enc.encode()).decode().split()
-
-    f = Fernet(key=settings.username_secret)
-    username = f.decrypt(account_processed.username_enc.encode()).decode()
+    email = field_cipher.decrypt('email', account_processed.email_enc)
+    full_name = field_cipher.decrypt('name', account_processed.name_enc).split()
+    username = field_cipher.decrypt('username', account_processed.username_enc)
 
     return Account(
         username=username,
@@ -87,6 +115,44 @@ def unprocess_account(account_processed: AccountProcessed) -> Account:
         email=email
     )
 
+def account_to_profile(account_processed: AccountProcessed) -> Profile:
+    """
+    Converts AccountProcessed into Profile, decrypts only the name and the username
+    :param account_processed: AccountProcessed object
+    :return: Profile object
+    """
+    full_name = field_cipher.decrypt('name', account_processed.name_enc).split()
+    return Profile(
+        username=field_cipher.decrypt('username', account_processed.username_enc),
+        name=full_name[0],
+        surname=full_name[1]
+    )
+
+def unprocess_accounts(accounts_processed: list[AccountProcessed]) -> list[Account]:
+    """
+    Converts a list of AccountProcessed into Accounts, gives blank passwords
+    :param accounts_processed: list of AccountProcessed objects
+    :return: list of Account objects
+    """
+    return [unprocess_account(i) for i in accounts_processed]
+
+async def unprocess_accounts_stream(accounts_processed: AsyncIterable[AccountProcessed]) -> AsyncIterator[Account]:
+    """
+    Same as unprocess_accounts, but decrypts in chunks in worker processes, keeps the order
+    :param accounts_processed: async iterable of AccountProcessed objects
+    :return: async iterator of Account objects
+    """
+    rows = ((i.username_enc, i.name_enc, i.email_enc) async for i in accounts_processed)
+    async for username, full_name, email in account_decoder.decrypt(rows):
+        full_name = full_name.split()
+        yield Account(
+            username=username,
+            name=full_name[0],
+            surname=full_name[1],
+            password='',
+            email=email
+        )
+
 def account_to_login_info(account: Account) -> LoginInfo:
     """
     Converts Account object to LoginInfo object
@@ -1,9 +1,16 @@
+from datetime import date
+from typing import AsyncIterator, Any
+
+from pydantic import TypeAdapter, ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import VeryUnimportantDataRepository, AccountsRepository, UnimportantDataRepository, ImportantDataRepository
+from cache import result_cache, profile_cache
+from database import LazySession, DataRepository, session_router, VeryUnimportantDataRepository, AccountsRepository, UnimportantDataRepository, ImportantDataRepository
+from database.repositories import check_access_level
 from exceptions import InputException
-from schemas import Account
-from service.conversions_service import unprocess_account
+from metrics import serialization_seconds
+from schemas import Account, Profile, VeryUnimportantRow, UnimportantRow, ImportantRow, RowQuery, RowFilter, AggregateRow
+from service.conversions_service import unprocess_account, unprocess_accounts_stream, account_to_profile
 
 
 async def get_account(account_id: int, session: AsyncSession) -> Account:
@@ -17,28 +24,253 @@ async def get_account(account_id: int, session: AsyncSession) -> Account:
     account = await repo.get_account_by_id(account_id)
     return unprocess_account(account)
 
-async def fetch(session: AsyncSession,
+async def get_profile(account_id: int, lazy_session: LazySession) -> Profile:
+    """
+    Fetches the display-safe part of an account through the profile cache, the session is only opened on a miss
+    :param account_id: int
+    :param lazy_session: LazySession object
+    :return: Profile object
+    """
+    async def load() -> Profile:
+        if not session_router.caught_up(await profile_cache.changed_at(account_id)):
+            lazy_session.use_primary()  # The replica would put the old profile into the cache
+        async with lazy_session as session:
+            account = await AccountsRepository(session=session).get_account_by_id(account_id)
+        return account_to_profile(account)
+
+    return await profile_cache.get(account_id, load)
+
+async def iterate(items: list) -> AsyncIterator:
+    for i in items:
+        yield i
+
+repositories = {
+    'very_unimportant_data': VeryUnimportantDataRepository,
+    'unimportant_data': UnimportantDataRepository,
+    'important_data': ImportantDataRepository,
+    'accounts': AccountsRepository,
+}
+
+row_types = {
+    'very_unimportant_data': VeryUnimportantRow,
+    'unimportant_data': UnimportantRow,
+    'important_data': ImportantRow,
+    'accounts': Account,
+}
+# One adapter per row type and one for a page of them, a page is encoded in one call, straight to bytes
+row_adapters = {name: TypeAdapter(row_type) for name, row_type in row_types.items()}
+page_adapters = {name: TypeAdapter(list[row_type]) for name, row_type in row_types.items()}
+aggregate_adapter = TypeAdapter(list[AggregateRow])
+search_adapter = TypeAdapter(list[dict[str, Any]])
+
+# Part of the result cache keys and the fetch_data etags, bump it when the shape of the bodies changes
+body_format = 2
+
+def get_repository_class(repository_name: str):
+    """
+    Gives repository class by its name, enough for access levels and table names, doesn't need a session
+    :param repository_name: str
+    :return: repository class
+    """
+    if repository_name not in repositories:
+        raise InputException(invalid_field='repository_name')
+    return repositories[repository_name]
+
+def get_repository(session: AsyncSession, repository_name: str):
+    """
+    Gives repository object by its name
+    :param session: AsyncSession object
+    :param repository_name: str
+    :return: repository object
+    """
+    return get_repository_class(repository_name)(session)
+
+def parse_row_query(filters: list[str], order: str | None = None, columns: str | None = None) -> RowQuery | None:
+    """
+    Builds a RowQuery from the fetch_data query parameters, the repository checks the columns and values
+    :param filters: list of 'column:op:value', e.g. 'amount:gt:100', 'date:ge:2024-01-01T00:00', 'text:prefix:And'
+    :param order: column, '-column' for descending (Default=None, by id)
+    :param columns: comma separated columns to give (Default=None, all)
+    :return: RowQuery object, None if nothing was asked
+    """
+    if not filters and order is None and columns is None:
+        return None
+    try:
+        row_filters = []
+        for i in filters:
+            column, op, value = i.split(':', 2)
+            row_filters.append(RowFilter(column=column, op=op, value=value))
+    except (ValueError, ValidationError):
+        raise InputException(invalid_field='filter')
+    order = order or 'id'
+    return RowQuery(filters=row_filters, order_by=order.removeprefix('-'), descending=order.startswith('-'),
+                    columns=[i.strip() for i in columns.split(',') if i.strip()] if columns is not None else None)
+
+def get_data_repository(session: AsyncSession, repository_name: str) -> DataRepository:
+    """
+    Same as get_repository, for what only the data tables have (aggregates, search)
+    """
+    repo = get_repository(session, repository_name)
+    if not isinstance(repo, DataRepository):
+        raise InputException(invalid_field='repository_name')
+    return repo
+
+async def fetch(lazy_session: LazySession,
                 repository_name: str,
-                access_level: int) -> list:
+                access_level: int,
+                after_id: int | None = None,
+                limit: int | None = None,
+                query: RowQuery | None = None) -> tuple[list, int | None]:
+    """
+    Fetches a page of rows from repository with repository_name, the session is released before decrypting
+    :param lazy_session: LazySession object
+    :param repository_name: str
+    :param access_level: int
+    :param after_id: last id of the previous page (Default=None, from the start)
+    :param limit: rows per page (Default=None, all rows)
+    :param query: filters, ordering and columns (Default=None, all rows and columns by id)
+    :return: rows (dicts, Account objects for accounts) and the after_id of the next page, None if it was the last one
+        or the rows are not ordered by id
+    """
+    async with lazy_session as session:
+        repo = get_repository(session, repository_name)
+        data = await repo.get_all(access_level=access_level, after_id=after_id, limit=limit, query=query)
+    next_after_id = None
+    if data and limit is not None and len(data) == limit and (query is None or query.order_by == 'id'):
+        next_after_id = data[-1].id if repository_name == 'accounts' else data[-1]['id']
+    if repository_name == 'accounts':
+        data = [i async for i in unprocess_accounts_stream(iterate(data))]
+    return data, next_after_id
+
+async def fetch_stream(session: AsyncSession,
+                       repository_name: str,
+                       access_level: int,
+                       after_id: int | None = None,
+                       query: RowQuery | None = None) -> AsyncIterator:
     """
-    Fetches all rows from repository with repository_name
+    Streams rows from repository with repository_name through a server-side cursor
     :param session: AsyncSession object
     :param repository_name: str
     :param access_level: int
-    :return:
-    """
-    match repository_name:
-        case 'very_unimportant_data':
-            repo = VeryUnimportantDataRepository(session)
-        case 'unimportant_data':
-            repo = UnimportantDataRepository(session)
-        case 'important_data':
-            repo = ImportantDataRepository(session)
-        case 'accounts':
-            repo = AccountsRepository(session)
-        case _:
-            raise InputException(invalid_field='repository_name')
-    data = await repo.get_all(access_level=access_level)
+    :param after_id: last id already received (Default=None, from the start)
+    :param query: filters, ordering and columns (Default=None, all rows and columns by id)
+    :return: async iterator of rows
+    """
+    repo = get_repository(session, repository_name)
+    rows = await repo.stream(access_level=access_level, after_id=after_id, query=query)
     if repository_name == 'accounts':
-        data = [unprocess_account(i) for i in data]
-    return data
\ No newline at end of file
+        return unprocess_accounts_stream(rows)
+    return rows
+
+def serialize(repository_name: str, rows: list) -> bytes:
+    """
+    Encodes a page of rows as one JSON array of objects
+    :param repository_name: str
+    :param rows: rows from fetch
+    :return: bytes
+    """
+    with serialization_seconds.time('json_encode'):
+        return page_adapters[repository_name].dump_json(rows)
+
+async def serialize_stream(rows: AsyncIterator, repository_name: str) -> AsyncIterator[bytes]:
+    """
+    Encodes rows from fetch_stream as NDJSON, one object per line
+    :param rows: async iterator of rows
+    :param repository_name: str
+    :return: async iterator of bytes
+    """
+    dump_json = row_adapters[repository_name].dump_json
+    async for row in rows:
+        yield dump_json(row) + b'\n'
+
+async def fetch_version(repository_name: str, access_level: int) -> int | None:
+    """
+    Checks access and gives the current version of repository's table, doesn't touch postgres
+    :param repository_name: str
+    :param access_level: int
+    :return: int - table version, None if the repository is not cached
+    """
+    repo = get_repository_class(repository_name)
+    check_access_level('read', access_level, repo.access_levels)
+    if repository_name == 'accounts':  # Decrypted accounts are never put into redis
+        return None
+    return await result_cache.version(repo.table)
+
+async def fetch_json(lazy_session: LazySession,
+                     repository_name: str,
+                     access_level: int,
+                     version: int,
+                     after_id: int | None = None,
+                     limit: int | None = None,
+                     query: RowQuery | None = None) -> tuple[str, int | None]:
+    """
+    Same as fetch, but gives serialized body, read through the result cache. \n
+    The session is only opened on a cache miss and is released before serializing
+    :param lazy_session: LazySession object
+    :param repository_name: str
+    :param access_level: int
+    :param version: table version from fetch_version
+    :param after_id: last id of the previous page (Default=None, from the start)
+    :param limit: rows per page (Default=None, all rows)
+    :param query: filters, ordering and columns (Default=None, all rows and columns by id)
+    :return: json body and the after_id of the next page, None if it was the last one
+    """
+    repo = get_repository_class(repository_name)
+    key = f'{repository_name}:{repo.access_levels["read"]}:{body_format}:{version}:{after_id}:{limit}'
+    if query is not None:
+        key += f':{query.key()}'
+
+    async def fill() -> tuple[str, int | None]:
+        if not session_router.caught_up(await result_cache.bumped_at(repo.table)):
+            lazy_session.use_primary()  # The replica would cache the rows before the write under the new version
+        data, next_after_id = await fetch(lazy_session=lazy_session, repository_name=repository_name,
+                                          access_level=access_level, after_id=after_id, limit=limit, query=query)
+        return serialize(repository_name, data).decode(), next_after_id
+
+    return await result_cache.get_or_fill(key, fill)
+
+async def aggregate(lazy_session: LazySession,
+                    repository_name: str,
+                    access_level: int,
+                    period: str,
+                    start: date | None = None,
+                    end: date | None = None) -> bytes:
+    """
+    Count, total and average per day, week or month from the rollup of repository with repository_name
+    :param lazy_session: LazySession object
+    :param repository_name: str
+    :param access_level: int
+    :param period: day, week or month
+    :param start: first bucket (Default=None, from the oldest)
+    :param end: buckets before this date (Default=None, up to the newest)
+    :return: json body, an array of objects with bucket, rows, total and average
+    """
+    async with lazy_session as session:
+        repo = get_data_repository(session, repository_name)
+        data = await repo.aggregate(period=period, access_level=access_level, start=start, end=end)
+    with serialization_seconds.time('json_encode'):
+        return aggregate_adapter.dump_json(data)
+
+async def search(lazy_session: LazySession,
+                 repository_name: str,
+                 access_level: int,
+                 terms: str,
+                 limit: int = 20,
+                 offset: int = 0) -> tuple[bytes, int | None]:
+    """
+    Full-text search in repository with repository_name, best matches first
+    :param lazy_session: LazySession object
+    :param repository_name: str
+    :param access_level: int
+    :param terms: what the user typed
+    :param limit: rows per page (Default=20)
+    :param offset: rows to skip (Default=0)
+    :return: json body, an array of rows with rank and highlight, and the offset of the next page,
+        None if it was the last one
+    """
+    async with lazy_session as session:
+        repo = get_data_repository(session, repository_name)
+        data = await repo.search(terms=terms, access_level=access_level, limit=limit + 1, offset=offset)
+    next_offset = offset + limit if len(data) > limit else None
+    with serialization_seconds.time('json_encode'):
+        return search_adapter.dump_json(data[:limit]), next_offset
@@ -0,0 +1,151 @@
+import asyncio
+import time
+import traceback
+from typing import Awaitable, Callable
+
+from cache import redis_client, account_registry, RedisLock
+from database import (AccountsRepository, ImportantDataRepository, SCHEMA_VERSION, get_db_session_cm, create_databases,
+                      create_mock_data, ping_postgres, get_schema_version, set_schema_version)
+from exceptions import RedisPostgresException, InputException
+from schemas import Account
+from service.conversions_service import process_account, account_to_login_info
+from settings import settings
+
+started_at = time.perf_counter()  # Roughly the process start, the module is imported by main
+
+async def wait_for(name: str, probe: Callable[[], Awaitable], deadline: float) -> None:
+    """
+    Calls probe with exponential backoff until it succeeds
+    :param name: what is probed, for the logs
+    :param probe: async function, raises while the service is not available
+    :param deadline: time.perf_counter() value to give up at
+    :return: None
+    """
+    delay = 0.1
+    while True:
+        try:
+            await asyncio.wait_for(probe(), timeout=max(deadline - time.perf_counter(), 0.1))
+            return
+        except Exception as exc:
+            if time.perf_counter() + delay > deadline:
+                raise RedisPostgresException from exc
+            print(f'{name} not ready yet ({exc!r}), retrying in {delay:.1f} s')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5)
+
+
+async def provision_admin(repo: AccountsRepository) -> bool:
+    admin_account = Account(
+        username='admin',
+        name='Administrator',
+        surname='Sidorovich',
+        email=settings.admin_email,
+        password=settings.admin_password,
+    )
+    try:
+        await repo.check_login(account_to_login_info(admin_account))
+    except InputException:
+        await repo.create_account(await process_account(admin_account, access_level=4))
+        print('Admin account created')
+    return True
+
+
+async def bootstrap() -> bool:
+    """
+    Schema, seed data, admin account and the account registry. Done by one worker only, see Startup
+    :return: bool - True if success
+    """
+    if await get_schema_version() != SCHEMA_VERSION:
+        await create_databases()
+        async with get_db_session_cm() as session:
+            await create_mock_data(session)
+            await ImportantDataRepository(session).rebuild_rollup()  # Rows written before the rollup existed
+        await set_schema_version(SCHEMA_VERSION)
+        print(f'Database bootstrapped, schema version {SCHEMA_VERSION}')
+    async with get_db_session_cm() as session:
+        repo = AccountsRepository(session)
+        await provision_admin(repo)
+        if await redis_client.exists(account_registry.ids_key):
+            await account_registry.request_rebuild()  # Let the reconcile job catch up in background
+        else:
+            await repo.update_redis()
+            print('Redis updated with account ids')
+    return True
+
+
+class Startup:
+    """
+    Coordinates startup of several workers. \n
+    Every worker waits for postgres and redis, then one of them takes the redis lock and bootstraps,
+    the others wait until the lock is gone and the ready flag holds the current schema version.
+    The flag lives for startup_timeout, so workers of one rollout bootstrap once, and the next restart checks again.
+    The leader keeps the lock alive while it bootstraps, however long the migration takes, and the others wait
+    past startup_timeout while the lock is held. If the leader died on the way, the lock expires and someone else
+    takes it
+    """
+    lock_key = 'startup:lock'
+    ready_key = 'startup:ready'
+
+    def __init__(self, client=redis_client, timeout: float = settings.startup_timeout,
+                 lock_ttl: int = settings.startup_lock_ttl):
+        self.client = client
+        self.timeout = timeout
+        self.lock_ttl = lock_ttl
+        self.lock = RedisLock(self.lock_key, lock_ttl, client=client)
+        self.role = None
+        self.ready = False
+        self.failed = False
+        self.ready_seconds = None
+
+    async def _lead(self) -> bool:
+        heartbeat = asyncio.create_task(self.lock.keep_alive())
+        try:
+            await bootstrap()
+            await self.client.set(self.ready_key, SCHEMA_VERSION, ex=int(self.timeout))
+        finally:
+            heartbeat.cancel()
+            await self.lock.release()
+        return True
+
+    async def _elect(self, deadline: float) -> str:
+        delay = 0.1
+        while time.perf_counter() < deadline:
+            if await self.client.exists(self.lock_key):  # A live leader is migrating, it may take longer than timeout
+                deadline = max(deadline, time.perf_counter() + self.lock_ttl + 1)  # + the longest poll delay
+            elif await self.client.get(self.ready_key) == str(SCHEMA_VERSION):
+                return 'follower'
+            if await self.lock.acquire():
+                try:
+                    await self._lead()
+                    return 'leader'
+                except Exception:
+                    traceback.print_exc()
+                    print('Bootstrap failed, retrying')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1)
+        raise RedisPostgresException
+
+    async def run(self) -> bool:
+        deadline = time.perf_counter() + self.timeout
+        try:
+            await wait_for('Postgres', ping_postgres, deadline)
+            await wait_for('Redis', self.client.ping, deadline)
+            self.role = await self._elect(deadline)
+        except BaseException:
+            self.failed = True
+            raise
+        self.ready = True
+        self.ready_seconds = time.perf_counter() - started_at
+        print(f'Ready as {self.role} in {self.ready_seconds:.2f} s')
+        return True
+
+    def status(self) -> dict:
+        return {
+            'ready': self.ready,
+            'failed': self.failed,
+            'role': self.role,
+            'time_to_ready_seconds': self.ready_seconds,
+        }
+
+
+startup = Startup()
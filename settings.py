@@ -17,9 +17,69 @@ class Settings(BaseSettings):
     postgres_user: str = Field(default='root', env='POSTGRES_USER')
     postgres_host: str = Field(default='localhost', env='POSTGRES_CONTAINER_NAME')
 
+    db_pool_size: int = Field(default=10, env='POSTGRES_POOL_SIZE')
+    db_max_overflow: int = Field(default=10, env='POSTGRES_MAX_OVERFLOW')
+    db_pool_timeout: float = Field(default=10, env='POSTGRES_POOL_TIMEOUT')
+    db_pool_recycle: int = Field(default=1800, env='POSTGRES_POOL_RECYCLE')
+    db_pool_pre_ping: bool = Field(default=True, env='POSTGRES_POOL_PRE_PING')
+    db_statement_cache_size: int = Field(default=100, env='POSTGRES_STATEMENT_CACHE_SIZE')
+    # Read replica, reads go to it while it is at most max_lag seconds behind, empty host - no replica
+    postgres_replica_host: str = Field(default='', env='POSTGRES_REPLICA_CONTAINER_NAME')
+    postgres_replica_port: str = Field(default='5432', env='POSTGRES_REPLICA_PORT')
+    db_replica_max_lag: float = Field(default=3, env='POSTGRES_REPLICA_MAX_LAG')
+    db_replica_check_interval: float = Field(default=1, env='POSTGRES_REPLICA_CHECK_INTERVAL')
+    # Reads of a client that wrote go to the primary for this long, keep it above the max lag
+    db_read_your_writes_seconds: float = Field(default=5, env='POSTGRES_READ_YOUR_WRITES_SECONDS')
+
     redis_password: str = Field(default='12345', env='REDIS_PASSWORD')
     redis_port: str = Field(default='6379', env='REDIS_PORT')
     redis_host: str = Field(default='localhost', env='REDIS_CONTAINER_NAME')
+    redis_max_connections: int = Field(default=50, env='REDIS_MAX_CONNECTIONS')
+    redis_pool_timeout: float = Field(default=5, env='REDIS_POOL_TIMEOUT')
+    redis_socket_timeout: float = Field(default=5, env='REDIS_SOCKET_TIMEOUT')
+    redis_connect_timeout: float = Field(default=2, env='REDIS_CONNECT_TIMEOUT')
+    redis_health_check_interval: int = Field(default=30, env='REDIS_HEALTH_CHECK_INTERVAL')
+
+    hash_workers: int = Field(default=2, env='PYTHON_HASH_WORKERS')
+    hash_queue_size: int = Field(default=64, env='PYTHON_HASH_QUEUE_SIZE')
+    fetch_cache_ttl: int = Field(default=300, env='PYTHON_FETCH_CACHE_TTL')
+    stream_batch_size: int = Field(default=1000, env='PYTHON_STREAM_BATCH_SIZE')
+    decode_workers: int = Field(default=2, env='PYTHON_DECODE_WORKERS')
+    decode_chunk_size: int = Field(default=1000, env='PYTHON_DECODE_CHUNK_SIZE')
+    key_rotation_batch_size: int = Field(default=500, env='PYTHON_KEY_ROTATION_BATCH_SIZE')
+    token_cache_size: int = Field(default=10000, env='PYTHON_TOKEN_CACHE_SIZE')
+    token_cache_ttl: int = Field(default=300, env='PYTHON_TOKEN_CACHE_TTL')
+    temp_user_ttl: int = Field(default=60 * 60 * 24, env='PYTHON_TEMP_USER_TTL')
+    registry_reconcile_interval: int = Field(default=60, env='PYTHON_REGISTRY_RECONCILE_INTERVAL')
+    metrics_enabled: bool = Field(default=True, env='PYTHON_METRICS_ENABLED')
+    metrics_token: str = Field(default='', env='PYTHON_METRICS_TOKEN')
+    metrics_public: bool = Field(default=False, env='PYTHON_METRICS_PUBLIC')
+    bulk_create_max_rows: int = Field(default=10000, env='PYTHON_BULK_CREATE_MAX_ROWS')
+    startup_timeout: float = Field(default=120, env='PYTHON_STARTUP_TIMEOUT')
+    startup_lock_ttl: int = Field(default=60, env='PYTHON_STARTUP_LOCK_TTL')
+    login_throttle_enabled: bool = Field(default=True, env='PYTHON_LOGIN_THROTTLE_ENABLED')
+    login_email_limit: int = Field(default=5, env='PYTHON_LOGIN_EMAIL_LIMIT')
+    login_email_window: float = Field(default=60, env='PYTHON_LOGIN_EMAIL_WINDOW')
+    login_email_lockout_after: int = Field(default=5, env='PYTHON_LOGIN_EMAIL_LOCKOUT_AFTER')
+    login_ip_limit: int = Field(default=20, env='PYTHON_LOGIN_IP_LIMIT')
+    login_ip_window: float = Field(default=60, env='PYTHON_LOGIN_IP_WINDOW')
+    login_ip_lockout_after: int = Field(default=20, env='PYTHON_LOGIN_IP_LOCKOUT_AFTER')
+    login_lockout_base: float = Field(default=1, env='PYTHON_LOGIN_LOCKOUT_BASE')
+    login_lockout_max: float = Field(default=900, env='PYTHON_LOGIN_LOCKOUT_MAX')
+    login_failures_ttl: float = Field(default=900, env='PYTHON_LOGIN_FAILURES_TTL')
+    profile_cache_ttl: int = Field(default=300, env='PYTHON_PROFILE_CACHE_TTL')
+    profile_cache_local_ttl: float = Field(default=5, env='PYTHON_PROFILE_CACHE_LOCAL_TTL')
+    profile_cache_size: int = Field(default=10000, env='PYTHON_PROFILE_CACHE_SIZE')
+    compression_min_size: int = Field(default=1024, env='PYTHON_COMPRESSION_MIN_SIZE')
+    compression_gzip_level: int = Field(default=6, env='PYTHON_COMPRESSION_GZIP_LEVEL')
+    compression_brotli_quality: int = Field(default=4, env='PYTHON_COMPRESSION_BROTLI_QUALITY')
+    compression_cache_bytes: int = Field(default=32 * 1024 * 1024, env='PYTHON_COMPRESSION_CACHE_BYTES')
+    profile_sample_rate: float = Field(default=0, env='PYTHON_PROFILE_SAMPLE_RATE')
+    profile_slow_ms: float = Field(default=0, env='PYTHON_PROFILE_SLOW_MS')
+    profile_interval_ms: float = Field(default=5, env='PYTHON_PROFILE_INTERVAL_MS')
+    profile_buffer_size: int = Field(default=50, env='PYTHON_PROFILE_BUFFER_SIZE')
+    search_max_limit: int = Field(default=100, env='PYTHON_SEARCH_MAX_LIMIT')
+    search_max_offset: int = Field(default=1000, env='PYTHON_SEARCH_MAX_OFFSET')
 
     verbose: int = Field(default=0, env='PYTHON_VERBOSE')
     def print(self, text: str):